@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Similar-case search: IVF index vs brute force
+=============================================
+
+Builds a ``case_index.py`` index over synthetic MobileNetV2-sized embeddings
+(1280 non-negative dimensions, grouped around a few hundred "look-alike"
+clusters) and reports per-query search time and recall@k against exact search
+for several ``nprobe`` values. Brute force over the same float16 memory map is
+what a per-request comparison against the whole data set would cost at best,
+without decoding a single image. Runs without TensorFlow or a server.
+
+    python benchmark_case_index.py --cases 20000 --dimensions 1280
+"""
+
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+
+from case_index import CaseIndex, build_index, normalize
+
+
+def synthetic_embeddings(count, dimensions, clusters, seed=0):
+    """Non-negative vectors (like pooled ReLU6 activations) scattered around cluster centres"""
+    rng = np.random.default_rng(seed)
+    centres = rng.gamma(0.5, 1.0, (clusters, dimensions)).astype(np.float32)
+    assignment = rng.integers(0, clusters, count)
+    vectors = centres[assignment] + rng.gamma(0.5, 0.6, (count, dimensions)).astype(np.float32)
+    return vectors, assignment
+
+
+def time_queries(search, queries):
+    """Median and p99 milliseconds of one single-image search"""
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        search(query)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings)), float(np.percentile(timings, 99))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare IVF similar-case search with brute force.")
+    parser.add_argument("--cases", type=int, default=20000, help="Indexed images")
+    parser.add_argument("--dimensions", type=int, default=1280, help="Embedding size (1280 for MobileNetV2)")
+    parser.add_argument("--clusters", type=int, default=300, help="Groups of look-alike images")
+    parser.add_argument("--lists", type=int, help="IVF lists (default: as case_index.py)")
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    args = parser.parse_args()
+
+    vectors, assignment = synthetic_embeddings(args.cases + args.queries, args.dimensions, args.clusters)
+    indexed, queries = vectors[:args.cases], vectors[args.cases:]
+    labels = assignment[:args.cases] % 5
+    paths = [f"class_{label}/{i}.jpg" for i, label in enumerate(labels)]
+
+    with tempfile.TemporaryDirectory() as model_dir:
+        os.makedirs(os.path.join(model_dir, "cassava"))
+        start = time.perf_counter()
+        build_index(indexed, labels, paths, [f"class_{i}" for i in range(5)], "synthetic", model_dir, "cassava",
+                    lists=args.lists)
+        index = CaseIndex.load(model_dir, "cassava")
+        print(f"🏗️  Indexed {args.cases} x {args.dimensions} into {len(index.centroids)} lists "
+              f"in {time.perf_counter() - start:.1f} s")
+        exact = index.exact_search(queries, args.k)
+
+        print(f"{'search':<20} | {'median ms':>9} | {'p99 ms':>7} | {f'recall@{args.k}':>9}")
+        print("-" * 55)
+        in_memory = normalize(indexed)
+        median, p99 = time_queries(lambda q: np.argpartition(-(in_memory @ normalize(q[np.newaxis])[0]), args.k), queries)
+        print(f"{'brute force float32':<20} | {median:>9.3f} | {p99:>7.3f} | {1.0:>9.1%}")
+        median, p99 = time_queries(
+            lambda q: np.argpartition(-(index.vectors.astype(np.float32) @ normalize(q[np.newaxis])[0]), args.k), queries)
+        print(f"{'brute force float16':<20} | {median:>9.3f} | {p99:>7.3f} | {1.0:>9.1%}")
+
+        for nprobe in args.nprobe:
+            found = [{case["case_id"] for case in index.search(q[np.newaxis], args.k, nprobe)[0]} for q in queries]
+            recall = np.mean([len(f & set(truth.tolist())) / args.k for f, truth in zip(found, exact)])
+            median, p99 = time_queries(lambda q: index.search(q[np.newaxis], args.k, nprobe), queries)
+            print(f"{f'IVF nprobe {nprobe}':<20} | {median:>9.3f} | {p99:>7.3f} | {recall:>9.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for prediction postprocessing and response encoding.
+
+Compares the original per-class dict comprehension with the vectorized
+postprocessing in postprocessing.py, and the standard json encoder with
+orjson and MessagePack, at several batch sizes. Runs without TensorFlow or a
+server; model outputs are random softmax rows.
+
+    python benchmark_postprocess.py --batch-sizes 1 32 256
+"""
+
+import json
+import timeit
+import argparse
+import numpy as np
+
+from postprocessing import LabelSet, postprocess_batch
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+TOMATO_CLASSES = [
+    'bacterial_spot', 'early_blight', 'healthy', 'late_blight', 'leaf_mold',
+    'mosaic_virus', 'septoria_spot', 'spider_mites', 'target_spot', 'yellow_leaf_curl_virus'
+]
+
+
+def legacy_postprocess(predictions, class_names, crop_type):
+    """The original predict_disease loop, applied image by image"""
+    results = []
+    for row in predictions:
+        predicted_class_idx = np.argmax(row)
+        confidence = float(row[predicted_class_idx])
+        predicted_class = class_names[predicted_class_idx]
+        all_probabilities = {
+            class_names[i]: float(row[i])
+            for i in range(len(class_names))
+        }
+        results.append({
+            "crop_type": crop_type,
+            "predicted_disease": predicted_class,
+            "confidence": confidence,
+            "all_probabilities": all_probabilities,
+            "status": "healthy" if predicted_class == "healthy" else "diseased"
+        })
+    return results
+
+
+def random_probabilities(batch_size, num_classes, seed=0):
+    logits = np.random.default_rng(seed).normal(size=(batch_size, num_classes)).astype(np.float32)
+    exp = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def best_time_us(func, repeat):
+    """Best-of-5 time per call in microseconds"""
+    timings = timeit.repeat(func, number=repeat, repeat=5)
+    return min(timings) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark postprocessing and response encoding.")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 32, 256])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    labels = LabelSet(TOMATO_CLASSES)
+    print(f"{'batch':>6} | {'stage':<22} | {'µs/batch':>10} | {'µs/image':>9} | {'bytes':>8}")
+    print("-" * 68)
+
+    for batch_size in args.batch_sizes:
+        predictions = random_probabilities(batch_size, len(TOMATO_CLASSES))
+        payload = {"results": postprocess_batch(predictions, labels, "tomato")}
+
+        stages = [
+            ("postprocess (legacy)", lambda: legacy_postprocess(predictions, TOMATO_CLASSES, "tomato"), None),
+            ("postprocess (numpy)", lambda: postprocess_batch(predictions, labels, "tomato"), None),
+            ("postprocess + top-3", lambda: postprocess_batch(predictions, labels, "tomato", top_k=3), None),
+            ("encode json", lambda: json.dumps(payload).encode("utf-8"), json.dumps(payload).encode("utf-8")),
+        ]
+        if orjson is not None:
+            stages.append(("encode orjson", lambda: orjson.dumps(payload), orjson.dumps(payload)))
+        if msgpack is not None:
+            stages.append(("encode msgpack", lambda: msgpack.packb(payload, use_bin_type=True),
+                           msgpack.packb(payload, use_bin_type=True)))
+
+        for name, func, encoded in stages:
+            elapsed = best_time_us(func, args.repeat)
+            size = f"{len(encoded):>8}" if encoded is not None else f"{'':>8}"
+            print(f"{batch_size:>6} | {name:<22} | {elapsed:>10.1f} | {elapsed / batch_size:>9.2f} | {size}")
+        print("-" * 68)
+
+    if orjson is None or msgpack is None:
+        print("ℹ️  Install orjson and msgpack to include them in the comparison")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the prediction log.
+
+Measures what logging adds to a request (the time of one ``record`` call, as
+p50/p99) and how many rows per second the background writer persists, with and
+without image storage. Runs without TensorFlow or a server; results are random
+softmax rows and images are random 224x224 pixels, a quarter of them repeats.
+
+The loop records as fast as it can, far faster than any server, so it also
+shows the log shedding load: once ``VERDSCAN_LOG_QUEUE_SIZE`` entries are
+waiting, further ones are dropped and counted instead of slowing the caller.
+
+    python benchmark_prediction_log.py --rows 20000
+"""
+
+import time
+import shutil
+import argparse
+import tempfile
+import numpy as np
+from PIL import Image
+
+from postprocessing import LabelSet, postprocess_batch
+from prediction_log import PredictionLog
+from benchmark_postprocess import TOMATO_CLASSES, random_probabilities
+
+
+def run(rows, log_images, log_format, images):
+    log_dir = tempfile.mkdtemp(prefix="prediction_log_")
+    log = PredictionLog(log_dir, log_images=log_images, log_format=log_format)
+    log.start()
+    results = postprocess_batch(random_probabilities(rows, len(TOMATO_CLASSES)), LabelSet(TOMATO_CLASSES), "tomato")
+
+    timings = np.empty(rows)
+    start = time.perf_counter()
+    for i, result in enumerate(results):
+        began = time.perf_counter()
+        log.record(result, "tomato_best_model.h5@benchmark", 42.0, images[i % len(images)])
+        timings[i] = time.perf_counter() - began
+    log.stop()
+    elapsed = time.perf_counter() - start
+
+    shutil.rmtree(log_dir, ignore_errors=True)
+    return timings * 1e6, log.counters, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the asynchronous prediction log.")
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--format", type=str, default="sqlite", choices=["sqlite", "parquet"])
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    unique = [Image.fromarray(rng.integers(0, 256, (224, 224, 3), dtype=np.uint8)) for _ in range(48)]
+    images = unique + unique[:16]
+
+    print(f"{'mode':<16} | {'record p50 µs':>13} | {'record p99 µs':>13} | {'rows/s':>8} | counters")
+    print("-" * 100)
+    for name, log_images in (("rows only", False), ("rows + images", True)):
+        timings, counters, elapsed = run(args.rows, log_images, args.format, images)
+        shown = {key: value for key, value in counters.items() if value}
+        print(f"{name:<16} | {np.percentile(timings, 50):>13.1f} | {np.percentile(timings, 99):>13.1f} | "
+              f"{counters['written'] / elapsed:>8.0f} | {shown}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+"""
+Streaming vs REST throughput
+============================
+
+Sends the same images to a running server (``python main.py``) three ways and
+reports images/second and response bytes per image:
+
+- REST: one ``/detect/{crop}`` multipart request per image, from ``--concurrency``
+  keep-alive connections
+- REST batch: ``/detect/{crop}/batch`` requests of ``--batch-size`` images
+- stream: one ``/stream/{crop}`` WebSocket, all frames pipelined, binary responses
+
+REST requests use a different ``X-Client-ID`` each so the per-client rate limits
+do not decide the comparison; that needs ``VERDSCAN_API_KEY`` set to a key from
+the server's ``VERDSCAN_TRUSTED_KEYS``. On a small machine client and server share the
+CPU, so the client's own cost shows up in every row. Needs ``websockets`` 13 or
+newer (``uvicorn[standard]`` installs it).
+
+    python benchmark_stream.py --crop cassava --images 2000
+"""
+
+import io
+import os
+import time
+import struct
+import asyncio
+import argparse
+import threading
+import requests
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from websockets.asyncio.client import connect
+except ImportError:  # optional dependency
+    connect = None
+
+BASE_URL = "http://localhost:8000"
+FRAME_HEADER = struct.Struct("<IB")
+RESULT_HEADER = struct.Struct("<IH")
+API_KEY = os.environ.get("VERDSCAN_API_KEY")
+
+
+def client_headers(client_id):
+    headers = {"X-Priority": "bulk", "X-Client-ID": client_id}
+    if API_KEY:
+        headers["X-API-Key"] = API_KEY
+    return headers
+
+
+def create_test_images(count, size=224):
+    images = []
+    for seed in range(count):
+        img_array = np.random.default_rng(seed).integers(0, 255, (size, size, 3), dtype=np.uint8)
+        img_bytes = io.BytesIO()
+        Image.fromarray(img_array).save(img_bytes, format='JPEG', quality=85)
+        images.append(img_bytes.getvalue())
+    return images
+
+
+def run_rest(crop, images, total, concurrency):
+    sessions = threading.local()
+    response_bytes = []
+
+    def one(i):
+        if not hasattr(sessions, "session"):
+            sessions.session = requests.Session()
+        response = sessions.session.post(
+            f"{BASE_URL}/detect/{crop}",
+            files={'file': ('leaf.jpg', images[i % len(images)], 'image/jpeg')},
+            headers=client_headers(f"rest-benchmark-{i}"),
+        )
+        response.raise_for_status()
+        response_bytes.append(len(response.content))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total)))
+    return total / (time.perf_counter() - start), float(np.mean(response_bytes))
+
+
+def run_rest_batch(crop, images, total, batch_size, concurrency):
+    response_bytes = []
+
+    def one(b):
+        files = [('files', (f'leaf{i}.jpg', images[(b * batch_size + i) % len(images)], 'image/jpeg'))
+                 for i in range(batch_size)]
+        response = requests.post(f"{BASE_URL}/detect/{crop}/batch", files=files,
+                                 headers=client_headers(f"batch-benchmark-{b}"))
+        response.raise_for_status()
+        response_bytes.append(len(response.content) / batch_size)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(total // batch_size)))
+    return (total // batch_size) * batch_size / (time.perf_counter() - start), float(np.mean(response_bytes))
+
+
+async def stream_images(url, images, total):
+    response_bytes = 0
+    # Images are already compressed; permessage-deflate would only burn CPU on both ends
+    async with connect(url, max_size=None, compression=None,
+                       additional_headers=client_headers("stream-benchmark")) as websocket:
+        async def sender():
+            for i in range(total):
+                await websocket.send(FRAME_HEADER.pack(i, 0) + images[i % len(images)])
+
+        sending = asyncio.create_task(sender())
+        answered = set()
+        while len(answered) < total:
+            message = await websocket.recv()
+            request_id, status = RESULT_HEADER.unpack_from(message)
+            if status != 200:
+                raise RuntimeError(f"Frame {request_id} failed with {status}: {message[RESULT_HEADER.size:].decode()}")
+            answered.add(request_id)
+            response_bytes += len(message)
+        await sending
+    return response_bytes
+
+
+def run_stream(crop, images, total):
+    url = BASE_URL.replace("http", "ws", 1) + f"/stream/{crop}"
+    start = time.perf_counter()
+    response_bytes = asyncio.run(stream_images(url, images, total))
+    return total / (time.perf_counter() - start), response_bytes / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare REST and WebSocket streaming throughput on localhost.")
+    parser.add_argument("--crop", type=str, default="cassava")
+    parser.add_argument("--images", type=int, default=2000, help="Images sent per path")
+    parser.add_argument("--concurrency", type=int, default=8, help="Parallel REST connections")
+    parser.add_argument("--batch-size", type=int, default=32, help="Images per /batch request")
+    args = parser.parse_args()
+
+    if connect is None:
+        raise SystemExit("❌ Install websockets (pip install websockets) to run the stream benchmark")
+
+    images = create_test_images(64)
+    print(f"🏃 {args.images} images of {np.mean([len(i) for i in images]) / 1024:.1f} KB per path...")
+    rows = [
+        (f"REST x{args.concurrency}", run_rest(args.crop, images, args.images, args.concurrency)),
+        (f"REST batch of {args.batch_size}", run_rest_batch(args.crop, images, args.images, args.batch_size, 2)),
+        ("stream (binary)", run_stream(args.crop, images, args.images)),
+    ]
+
+    print(f"{'path':<20} | {'images/s':>9} | {'response bytes/image':>20}")
+    print("-" * 56)
+    for name, (throughput, response_bytes) in rows:
+        print(f"{name:<20} | {throughput:>9.1f} | {response_bytes:>20.0f}")
+
+
+if __name__ == "__main__":
+    main()
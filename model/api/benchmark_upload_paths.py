@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Bytes on the wire and server CPU per request for each upload path.
+
+- full photo: what the app sends today, a phone-camera JPEG, streamed through
+  ``read_image_upload`` (decoded at a reduced JPEG scale and shrunk to the model
+  input) and then scaled like ``prepare_batch``
+- compact JPEG: the photo resized on-device to the model input and re-encoded
+  at ``COMPACT_JPEG_QUALITY``, read by ``compact_jpeg_pixels`` (decode only)
+- raw: the resized uint8 RGB pixels, read by ``raw_pixels`` (no decode, no resize)
+
+Server CPU is the process time of that handling code; inference costs the same
+on every path and is left out. Runs without TensorFlow or a server.
+
+    python benchmark_upload_paths.py --photo-size 4032 3024
+"""
+
+import io
+import time
+import asyncio
+import argparse
+import numpy as np
+from PIL import Image
+from starlette.datastructures import Headers, UploadFile
+
+from upload import COMPACT_JPEG_QUALITY, compact_jpeg_pixels, raw_pixels, read_image_upload
+
+INPUT_SIZE = (224, 224)
+
+
+def field_photo(width, height, seed=0):
+    """A leaf-like photo: smooth shading, texture and a few blotches, so it compresses like a real one"""
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    green = 110 + 60 * np.sin(x / 97.0) * np.cos(y / 131.0)
+    pixels = np.stack([green * 0.45, green, green * 0.35], axis=-1)
+    for _ in range(12):
+        cy, cx, radius = rng.integers(0, height), rng.integers(0, width), rng.integers(20, 120)
+        pixels[(y - cy) ** 2 + (x - cx) ** 2 < radius ** 2] = (120, 90, 30)
+    pixels += rng.normal(0, 6, pixels.shape)
+    return Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+
+def encode_jpeg(image, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality)
+    return buffer.getvalue()
+
+
+def full_photo_path(data):
+    upload = UploadFile(io.BytesIO(data), headers=Headers({"content-type": "image/jpeg"}))
+    height, width = INPUT_SIZE
+    image = asyncio.run(read_image_upload(upload, (width, height)))
+    batch = np.asarray(image.resize((width, height)))[np.newaxis].astype(np.float32)
+    batch *= np.array(1.0 / 255, dtype=np.float32)
+    return batch
+
+
+def compact_jpeg_path(data):
+    batch = compact_jpeg_pixels(data, *INPUT_SIZE).astype(np.float32)
+    batch *= np.array(1.0 / 255, dtype=np.float32)
+    return batch
+
+
+def raw_path(data):
+    batch = raw_pixels(data, *INPUT_SIZE).astype(np.float32)
+    batch *= np.array(1.0 / 255, dtype=np.float32)
+    return batch
+
+
+def cpu_ms(func, data, repeat):
+    """Median process time of one call in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        start = time.process_time()
+        func(data)
+        timings.append(time.process_time() - start)
+    return float(np.median(timings)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare upload paths by payload size and server CPU.")
+    parser.add_argument("--photo-size", type=int, nargs=2, default=[4032, 3024], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--photo-quality", type=int, default=92, help="JPEG quality of the camera photo")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    camera_jpeg = encode_jpeg(field_photo(*args.photo_size), args.photo_quality)
+    height, width = INPUT_SIZE
+    # What the app would do on-device: the server's own resize of the camera photo, then raw bytes or a small JPEG
+    resized = Image.open(io.BytesIO(camera_jpeg)).convert("RGB").resize((width, height))
+    payloads = [
+        (f"full photo {args.photo_size[0]}x{args.photo_size[1]}", full_photo_path, camera_jpeg),
+        (f"compact JPEG q{COMPACT_JPEG_QUALITY}", compact_jpeg_path, encode_jpeg(resized, COMPACT_JPEG_QUALITY)),
+        ("raw uint8", raw_path, np.asarray(resized).tobytes()),
+    ]
+
+    print(f"{'path':<26} | {'bytes':>10} | {'2G seconds':>10} | {'server CPU ms':>13}")
+    print("-" * 70)
+    for name, func, data in payloads:
+        # 2G (EDGE) uplink at roughly 100 kbit/s
+        seconds = len(data) * 8 / 100_000
+        print(f"{name:<26} | {len(data):>10} | {seconds:>10.1f} | {cpu_ms(func, data, args.repeat):>13.2f}")
+
+    full = full_photo_path(payloads[0][2])
+    raw = raw_path(payloads[2][2])
+    print(f"ℹ️  Largest difference between the full-photo and raw batches: {np.abs(full - raw).max():.4f} "
+          f"(0 means the raw path gives the model exactly the same input)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+"""
+Similar-case retrieval
+======================
+
+Agronomists want to see confirmed reference images that look like a farmer's
+upload. Comparing an upload against every image in ``data/{crop}`` on each
+request is far too slow, so this module indexes the training images once:
+
+- every image goes through the crop model the API serves (its export when there
+  is one) and the GlobalAveragePooling output, the embedding the classification
+  head works from, is kept
+- embeddings are L2-normalised and stored as a float16 matrix in
+  ``{crop}_cases.npy`` next to the model, memory-mapped by the API
+- an inverted-file (IVF) index groups them: spherical k-means gives
+  ``--lists`` centroids (default 4 x sqrt(images), with at least
+  ``MIN_LIST_SIZE`` images per list), and the rows of the matrix are ordered by
+  centroid so each list is one contiguous slice
+  (``{crop}_cases.npz``: centroids, list offsets, labels)
+- ``{crop}_cases.json`` records the class names, image paths relative to the
+  data directory and the ``model_version`` the embeddings came from
+
+A query compares its embedding with the centroids, then scores only the rows of
+the ``VERDSCAN_SIMILAR_NPROBE`` closest lists (cosine similarity), probing further
+lists while they hold fewer than the requested number of cases. Casting the
+float16 rows to float32 dominates the search time (numpy wheels built without
+F16C cast element by element), so lists are kept small: with 20k images a query
+reads about a hundred rows instead of all of them. ``python
+benchmark_case_index.py`` shows time and recall for other ``nprobe`` values.
+
+The API loads the index at startup when its model version matches the loaded
+model and adds ``similar_cases`` to a prediction when asked (``?similar=5``).
+The embedding comes from the same forward pass as the prediction.
+
+    python case_index.py --crop cassava --data ../data/cassava
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Dict, List, Optional
+import numpy as np
+
+CASES_SUFFIX = "_cases"
+SIMILAR_NPROBE = int(os.environ.get("VERDSCAN_SIMILAR_NPROBE", "2"))
+MAX_SIMILAR_CASES = 20
+# Fewer images per list train poor centroids and give too few candidates per probe
+MIN_LIST_SIZE = 40
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def case_index_paths(model_dir: str, crop_type: str) -> Dict[str, str]:
+    """Files of a crop's index: float16 vectors, IVF lists and metadata"""
+    base = os.path.join(model_dir, crop_type, f"{crop_type}{CASES_SUFFIX}")
+    return {"vectors": base + ".npy", "lists": base + ".npz", "meta": base + ".json"}
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    """Rows scaled to unit length, as float32, so dot products are cosine similarities"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk: int = 8192) -> np.ndarray:
+    """Index of the most similar centroid for every (normalised) row"""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), chunk):
+        assignment[start:start + chunk] = (vectors[start:start + chunk] @ centroids.T).argmax(axis=1)
+    return assignment
+
+
+def spherical_kmeans(vectors: np.ndarray, lists: int, iterations: int = 20, sample: int = 256,
+                     seed: int = 0) -> np.ndarray:
+    """Unit-length centroids of normalised rows, trained on at most ``sample`` rows per list"""
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample * lists:
+        vectors = vectors[rng.choice(len(vectors), sample * lists, replace=False)]
+    centroids = vectors[rng.choice(len(vectors), lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(vectors, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=lists)
+        # An empty list restarts from a random row instead of staying empty
+        empty = counts == 0
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+def build_index(embeddings: np.ndarray, labels: np.ndarray, paths: List[str], class_names: List[str],
+                model_version: str, model_dir: str, crop_type: str, lists: Optional[int] = None,
+                data_dir: Optional[str] = None) -> Dict[str, str]:
+    """Cluster the embeddings, write the three index files and return their paths"""
+    vectors = normalize(embeddings)
+    if lists is None:
+        lists = max(1, min(int(round(4 * np.sqrt(len(vectors)))), len(vectors) // MIN_LIST_SIZE))
+    lists = min(lists, len(vectors))
+    centroids = spherical_kmeans(vectors, lists)
+    assignment = nearest_centroids(vectors, centroids)
+    order = np.argsort(assignment, kind="stable")
+    offsets = np.searchsorted(assignment[order], np.arange(lists + 1))
+
+    files = case_index_paths(model_dir, crop_type)
+    stored = np.lib.format.open_memmap(files["vectors"], mode="w+", dtype=np.float16, shape=vectors.shape)
+    stored[:] = vectors[order]
+    stored.flush()
+    del stored
+    np.savez(files["lists"], centroids=centroids, offsets=offsets.astype(np.int64),
+             labels=np.asarray(labels, dtype=np.int32)[order])
+    with open(files["meta"], "w") as f:
+        json.dump({
+            "crop": crop_type,
+            "model_version": model_version,
+            "class_names": list(class_names),
+            "count": int(len(vectors)),
+            "dimensions": int(vectors.shape[1]),
+            "lists": int(lists),
+            "data_dir": os.path.abspath(data_dir) if data_dir else None,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "paths": [paths[i] for i in order.tolist()],
+        }, f)
+    return files
+
+
+class CaseIndex:
+    """IVF index over the float16, memory-mapped embeddings of a crop's labelled images"""
+
+    def __init__(self, vectors: np.ndarray, centroids: np.ndarray, offsets: np.ndarray,
+                 labels: np.ndarray, meta: Dict):
+        self.vectors = vectors
+        self.centroids = centroids
+        self.offsets = offsets
+        self.labels = labels
+        self.meta = meta
+        self.model_version = meta["model_version"]
+        self.class_names = meta["class_names"]
+        self.paths = meta["paths"]
+
+    @classmethod
+    def load(cls, model_dir: str, crop_type: str) -> Optional["CaseIndex"]:
+        """The crop's index, or None if case_index.py was not run for it"""
+        files = case_index_paths(model_dir, crop_type)
+        if not all(os.path.exists(path) for path in files.values()):
+            return None
+        with open(files["meta"]) as f:
+            meta = json.load(f)
+        with np.load(files["lists"]) as lists:
+            centroids, offsets, labels = lists["centroids"], lists["offsets"], lists["labels"]
+        return cls(np.load(files["vectors"], mmap_mode="r"), centroids, offsets, labels, meta)
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def score_lists(self, query: np.ndarray, centroid_scores: np.ndarray, nprobe: int, k: int = 1):
+        """(row ids, similarities) of the rows in the ``nprobe`` lists closest to one query
+
+        Keeps probing the next closest lists while fewer than ``k`` rows were found,
+        so empty or small lists never leave a query short of candidates.
+        """
+        rows, similarities = [np.arange(0)], [np.zeros(0, dtype=np.float32)]
+        found = 0
+        for probed, i in enumerate(np.argsort(-centroid_scores, kind="stable").tolist()):
+            if probed >= nprobe and found >= k:
+                break
+            # Each list is one contiguous slice of the memory map
+            start, end = int(self.offsets[i]), int(self.offsets[i + 1])
+            rows.append(np.arange(start, end))
+            similarities.append(self.vectors[start:end].astype(np.float32) @ query)
+            found += end - start
+        return np.concatenate(rows), np.concatenate(similarities)
+
+    def search(self, queries: np.ndarray, k: int, nprobe: int = SIMILAR_NPROBE) -> List[List[Dict]]:
+        """Top-``k`` most similar cases for each query embedding, best first"""
+        queries = normalize(queries)
+        centroid_scores = queries @ self.centroids.T
+        results = []
+        for query, scores in zip(queries, centroid_scores):
+            rows, similarities = self.score_lists(query, scores, nprobe, k)
+            count = min(k, len(rows))
+            if count == 0:
+                results.append([])
+                continue
+            best = np.argpartition(-similarities, count - 1)[:count]
+            best = best[np.argsort(-similarities[best], kind="stable")]
+            results.append([
+                {
+                    "case_id": int(rows[i]),
+                    "label": self.class_names[self.labels[rows[i]]],
+                    "path": self.paths[rows[i]],
+                    # float16 rounding can put an exact match just above 1
+                    "similarity": round(min(float(similarities[i]), 1.0), 4),
+                }
+                for i in best.tolist()
+            ])
+        return results
+
+    def exact_search(self, queries: np.ndarray, k: int) -> np.ndarray:
+        """Row ids of the true top-``k`` by brute force, for measuring recall"""
+        similarities = normalize(queries) @ self.vectors.astype(np.float32).T
+        return np.argsort(-similarities, axis=1, kind="stable")[:, :k]
+
+
+def list_images(data_dir: str, class_names: List[str]) -> List[tuple]:
+    """(path relative to the data directory, label) of every image in the class sub-directories"""
+    images = []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            print(f"⚠️  No {class_name} directory under {data_dir}")
+            continue
+        images.extend((f"{class_name}/{name}", label) for name in sorted(os.listdir(class_dir))
+                      if name.lower().endswith(IMAGE_EXTENSIONS))
+    return images
+
+
+def embed_images(embedding_model, signature: Dict, data_dir: str, images: List[tuple], batch_size: int):
+    """Embeddings of the readable images, preprocessed exactly as the API preprocesses uploads"""
+    from PIL import Image
+    from main import prepare_batch
+
+    embeddings, labels, paths = [], [], []
+    for start in range(0, len(images), batch_size):
+        decoded = []
+        for path, label in images[start:start + batch_size]:
+            try:
+                decoded.append(Image.open(os.path.join(data_dir, path)).convert("RGB"))
+            except OSError as e:
+                print(f"⚠️  Skipping {path}: {str(e)}")
+                continue
+            labels.append(label)
+            paths.append(path)
+        if decoded:
+            batch_embeddings, _ = embedding_model.predict(prepare_batch(decoded, signature), verbose=0)
+            embeddings.append(batch_embeddings)
+        print(f"   {min(start + batch_size, len(images))}/{len(images)} images", end="\r")
+    print()
+    return np.concatenate(embeddings), np.array(labels), paths
+
+
+def check_index(index: CaseIndex, k: int = 10, queries: int = 200, nprobe: int = SIMILAR_NPROBE):
+    """Recall@k against brute force and median search time, using indexed images as queries"""
+    rows = np.random.default_rng(0).choice(len(index), min(queries, len(index)), replace=False)
+    sample = index.vectors[np.sort(rows)].astype(np.float32)
+    exact = index.exact_search(sample, k)
+    timings, hits = [], 0
+    for query, truth in zip(sample, exact):
+        start = time.perf_counter()
+        found = index.search(query[np.newaxis], k, nprobe)[0]
+        timings.append((time.perf_counter() - start) * 1000)
+        hits += len({case["case_id"] for case in found} & set(truth.tolist()))
+    return hits / exact.size, float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Index a crop's labelled images for similar-case retrieval.")
+    parser.add_argument("--crop", type=str, required=True, help="Crop to index (a model must exist under VERDSCAN_MODEL_DIR)")
+    parser.add_argument("--data", type=str, help="Training data directory (default: ../data/<crop>)")
+    parser.add_argument("--lists", type=int, help="IVF lists (default: 4 x the square root of the image count)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    import tensorflow as tf
+    from main import MODEL_DIR, embedding_model, load_signature, model_file, verify_signature
+
+    model_path = model_file(args.crop)
+    if model_path is None:
+        sys.exit(f"❌ No {args.crop} model under {MODEL_DIR}")
+    data_dir = args.data or os.path.join("..", "data", args.crop)
+    signature = load_signature(model_path)
+    images = list_images(data_dir, signature["class_names"])
+    if not images:
+        sys.exit(f"❌ No images found under {data_dir}")
+
+    print(f"📥 Loading {model_path}...")
+    model = tf.keras.models.load_model(model_path)
+    verify_signature(model, signature, model_path)
+
+    print(f"🔍 Embedding {len(images)} images...")
+    embeddings, labels, paths = embed_images(embedding_model(model, signature), signature, data_dir,
+                                             images, args.batch_size)
+    files = build_index(embeddings, labels, paths, signature["class_names"], signature["model_version"],
+                        MODEL_DIR, args.crop, lists=args.lists, data_dir=data_dir)
+
+    index = CaseIndex.load(MODEL_DIR, args.crop)
+    recall, search_ms = check_index(index)
+    size_mb = os.path.getsize(files["vectors"]) / (1024 * 1024)
+    print(f"✅ {len(index)} cases x {embeddings.shape[1]} dimensions ({size_mb:.1f} MB float16) "
+          f"in {len(index.centroids)} lists, written to {files['vectors']}")
+    print(f"📊 Recall@10 {recall:.1%} at nprobe {SIMILAR_NPROBE}, median search {search_ms:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
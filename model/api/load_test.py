@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Scheduler load test
+===================
+
+Measures interactive latency on its own and while a bulk client floods the
+batch endpoint, then prints the per-class queue waits from ``/metrics``.
+With fair scheduling the interactive p99 under load should stay close to the
+baseline instead of growing with the bulk backlog. Set ``VERDSCAN_API_KEY`` to a
+key from the server's ``VERDSCAN_TRUSTED_KEYS``; without it every simulated
+client shares the bucket of 127.0.0.1.
+
+    python load_test.py --crop cassava --interactive 200 --bulk-clients 4
+"""
+
+import io
+import os
+import time
+import argparse
+import threading
+import requests
+import numpy as np
+from PIL import Image
+from concurrent.futures import ThreadPoolExecutor
+
+BASE_URL = "http://localhost:8000"
+# A key from the server's VERDSCAN_TRUSTED_KEYS, so X-Priority and X-Client-ID are honoured
+API_KEY = os.environ.get("VERDSCAN_API_KEY")
+
+
+def client_headers(priority, client_id):
+    headers = {"X-Priority": priority, "X-Client-ID": client_id}
+    if API_KEY:
+        headers["X-API-Key"] = API_KEY
+    return headers
+
+
+def create_test_image():
+    img_array = np.random.randint(0, 255, (224, 224, 3), dtype=np.uint8)
+    img_bytes = io.BytesIO()
+    Image.fromarray(img_array).save(img_bytes, format='JPEG')
+    return img_bytes.getvalue()
+
+
+def interactive_request(crop, image, client_id):
+    """One interactive prediction; returns (status code, latency in ms)"""
+    start = time.perf_counter()
+    response = requests.post(
+        f"{BASE_URL}/detect/{crop}",
+        files={'file': ('test.jpg', image, 'image/jpeg')},
+        headers=client_headers("interactive", client_id),
+    )
+    return response.status_code, (time.perf_counter() - start) * 1000
+
+
+def run_interactive(crop, image, count, clients):
+    """Spread interactive requests over several phone-like clients at a modest rate"""
+    def one(i):
+        # Stay under the per-client interactive rate limit
+        time.sleep((i // clients) * 0.25)
+        return interactive_request(crop, image, f"phone-{i % clients}")
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        results = list(executor.map(one, range(count)))
+    latencies = [ms for status, ms in results if status == 200]
+    statuses = {}
+    for status, _ in results:
+        statuses[status] = statuses.get(status, 0) + 1
+    return latencies, statuses
+
+
+def bulk_flood(crop, image, batch_size, client_id, stop, counts):
+    """Keep posting batches until stopped, backing off on 429/503"""
+    files = [('files', (f'bulk_{i}.jpg', image, 'image/jpeg')) for i in range(batch_size)]
+    while not stop.is_set():
+        response = requests.post(
+            f"{BASE_URL}/detect/{crop}/batch",
+            files=files,
+            headers=client_headers("bulk", client_id),
+        )
+        counts[response.status_code] = counts.get(response.status_code, 0) + 1
+        if response.status_code in (429, 503):
+            time.sleep(float(response.headers.get("Retry-After", "1")))
+
+
+def summarize(name, latencies, statuses):
+    if not latencies:
+        print(f"{name:>10}: no successful requests ({statuses})")
+        return
+    p50, p99 = np.percentile(latencies, [50, 99])
+    print(f"{name:>10}: p50 {p50:7.1f} ms   p99 {p99:7.1f} ms   statuses {statuses}")
+
+
+def print_queue_waits():
+    """Mean queue wait and depth per class from the Prometheus metrics"""
+    metrics = {}
+    for line in requests.get(f"{BASE_URL}/metrics").text.splitlines():
+        if line and not line.startswith("#"):
+            name, value = line.rsplit(" ", 1)
+            metrics[name] = float(value)
+
+    for priority in ("interactive", "bulk"):
+        count = metrics.get(f'verdscan_queue_wait_seconds_count{{priority="{priority}"}}', 0)
+        total = metrics.get(f'verdscan_queue_wait_seconds_sum{{priority="{priority}"}}', 0)
+        shed = metrics.get(f'verdscan_requests_shed_total{{priority="{priority}"}}', 0)
+        limited = metrics.get(f'verdscan_requests_rate_limited_total{{priority="{priority}"}}', 0)
+        mean_ms = total / count * 1000 if count else 0.0
+        print(f"{priority:>12}: {int(count)} jobs, mean queue wait {mean_ms:.1f} ms, "
+              f"{int(shed)} shed, {int(limited)} rate limited")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Interactive latency under a bulk flood.")
+    parser.add_argument("--crop", type=str, default="cassava")
+    parser.add_argument("--interactive", type=int, default=200, help="Interactive requests per phase")
+    parser.add_argument("--clients", type=int, default=4, help="Concurrent interactive clients")
+    parser.add_argument("--bulk-clients", type=int, default=4, help="Concurrent bulk clients during the flood")
+    parser.add_argument("--bulk-batch", type=int, default=16, help="Images per bulk request")
+    args = parser.parse_args()
+
+    image = create_test_image()
+    interactive_request(args.crop, image, "warmup")
+
+    print("🧪 Baseline: interactive traffic only")
+    baseline = run_interactive(args.crop, image, args.interactive, args.clients)
+
+    print(f"🌊 Flood: {args.bulk_clients} bulk clients posting batches of {args.bulk_batch}")
+    stop = threading.Event()
+    bulk_counts = {}
+    flooders = [
+        threading.Thread(target=bulk_flood,
+                         args=(args.crop, image, args.bulk_batch, f"backlog-{i}", stop, bulk_counts))
+        for i in range(args.bulk_clients)
+    ]
+    for thread in flooders:
+        thread.start()
+    time.sleep(2)  # let the bulk backlog build up
+    loaded = run_interactive(args.crop, image, args.interactive, args.clients)
+    stop.set()
+    for thread in flooders:
+        thread.join()
+
+    print("\n📊 Interactive latency")
+    summarize("baseline", *baseline)
+    summarize("flood", *loaded)
+    print(f"📦 Bulk responses during flood: {bulk_counts}")
+    print("\n⏱️  Queue waits (/metrics)")
+    print_queue_waits()
+
+
+if __name__ == "__main__":
+    main()
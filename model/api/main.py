@@ -1,20 +1,35 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, WebSocket
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import FileResponse, PlainTextResponse
 import tensorflow as tf
 import numpy as np
 from PIL import Image
-import io
 import os
 import json
-from typing import Dict, List
+import time
+import resource
+from typing import Dict, List, Optional
 import uvicorn
 
+from postprocessing import LabelSet, postprocess_batch
+from responses import FastJSONResponse, encode_response
+from upload import (read_image_upload, read_encoded_upload, UploadLimitMiddleware, read_request_body,
+                    raw_pixels, compact_jpeg_pixels, decode_checked, retained_size, shrink_image,
+                    MAX_UPLOAD_BYTES, COMPACT_JPEG_QUALITY)
+from scheduler import InferenceScheduler, INFERENCE_WORKERS
+from thread_tuning import apply_tuning
+from streaming import KIND_RAW, ResultEncoder, serve_stream
+from shared_batches import DECODE_PROCESSES, SHARED_BATCH_SIZE, DecodePool, input_spec, region_bytes
+from prediction_log import PredictionLog
+from case_index import MAX_SIMILAR_CASES, CaseIndex
+from tiling import MAX_SCALES, MAX_TILES, DEFAULT_OVERLAP, plan_tiles, tile_batch, pool_tile_probabilities, heat_maps
+
 # Initialize FastAPI app
 app = FastAPI(
     title="Crop Disease Detection API",
     description="AI-powered API for detecting diseases in cassava, maize, and tomato crops",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # Add CORS middleware for React Native app
@@ -26,55 +41,146 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variables for models
+# Refuse oversized uploads from their Content-Length, or while they are received, before the body is parsed
+app.add_middleware(UploadLimitMiddleware)
+
+# Directory holding one sub-directory per crop: {MODEL_DIR}/{crop}/{crop}_best_model.h5
+MODEL_DIR = os.environ.get("VERDSCAN_MODEL_DIR", "..")
+SIGNATURE_SUFFIX = ".signature.json"
+
+# Cascaded (early-exit) inference: a calibrated {crop}_fast_model.h5 answers on its
+# own when confident and escalates to the full model otherwise
+CASCADE_ENABLED = os.environ.get("VERDSCAN_CASCADE", "1") == "1"
+
+# Serve {crop}_{variant}_export.h5 from scripts/export_inference_model.py when present
+USE_EXPORTED_MODELS = os.environ.get("VERDSCAN_USE_EXPORTED", "1") == "1"
+
+# Reference images for /cases/{crop}/{id}/image: {CASE_IMAGE_DIR}/{crop}/{class}/{file}.
+# Defaults to the data directory recorded when the index was built.
+CASE_IMAGE_DIR = os.environ.get("VERDSCAN_CASE_IMAGE_DIR")
+
+# Global variables for models and their signatures (class names, input spec)
 models = {}
-class_names = {}
+signatures = {}
+labels = {}
+fast_models = {}
+fast_signatures = {}
+
+# Similar-case indexes from case_index.py and the full models with their embedding as a second output
+case_indexes = {}
+embedding_models = {}
+
+# Priority-aware admission control and fair queueing in front of inference
+scheduler = InferenceScheduler()
+
+# Asynchronous log of served predictions (and optionally images) for relabelling
+prediction_log = PredictionLog()
+
+# Thread pools, CPU pinning and predict batch size from thread_tuning.py, if it was run
+thread_settings = None
+
+# Decode processes writing into shared-memory batch slots (VERDSCAN_DECODE_PROCESSES > 0)
+decode_pool = None
+
+def load_signature(model_path: str) -> Dict:
+    """Load the signature file written next to a model by the training scripts"""
+    signature_path = os.path.splitext(model_path)[0] + SIGNATURE_SUFFIX
+    if not os.path.exists(signature_path):
+        raise FileNotFoundError(
+            f"No signature found at {signature_path}. "
+            f"Create one with: python scripts/model_signature.py --model {model_path} --data data/<crop>"
+        )
+    
+    with open(signature_path) as f:
+        signature = json.load(f)
+    
+    for key in ("class_names", "input_size", "input_dtype", "rescale"):
+        if key not in signature:
+            raise ValueError(f"Signature {signature_path} is missing '{key}'")
+    
+    signature["input_size"] = tuple(signature["input_size"])
+    # Identifies the exact model behind a logged prediction
+    signature["model_version"] = f"{os.path.basename(model_path)}@{signature.get('created', 'unknown')}"
+    return signature
+
+def verify_signature(model, signature: Dict, model_path: str):
+    """Check that a signature matches the loaded model's input and output shapes"""
+    num_outputs = model.output_shape[-1]
+    if num_outputs != len(signature["class_names"]):
+        raise ValueError(
+            f"{model_path} has {num_outputs} outputs but its signature lists "
+            f"{len(signature['class_names'])} classes"
+        )
+    
+    input_size = tuple(model.input_shape[1:3])
+    if None not in input_size and input_size != signature["input_size"]:
+        raise ValueError(
+            f"{model_path} expects {input_size} inputs but its signature specifies {signature['input_size']}"
+        )
+
+def embedding_model(model, signature: Dict):
+    """The model rebuilt to also output its GlobalAveragePooling embedding, from the same forward pass"""
+    height, width = signature["input_size"]
+    inputs = tf.keras.Input(shape=(height, width, 3), dtype=signature["input_dtype"])
+    x = inputs
+    embedding = None
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            continue
+        x = layer(x)
+        if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D):
+            embedding = x
+    if embedding is None:
+        raise ValueError(f"{model.name} has no GlobalAveragePooling2D layer to take embeddings from")
+    return tf.keras.Model(inputs, [embedding, x], name=f"{model.name}_embedding")
+
+def model_file(crop_type: str, variant: str = "best") -> Optional[str]:
+    """Path of a crop's model, preferring the serving export (uint8 input, folded graph)"""
+    candidates = [f"{crop_type}_{variant}_model.h5"]
+    if USE_EXPORTED_MODELS:
+        candidates.insert(0, f"{crop_type}_{variant}_export.h5")
+    
+    for filename in candidates:
+        path = os.path.join(MODEL_DIR, crop_type, filename)
+        if os.path.exists(path):
+            return path
+    return None
+
+def discover_model_paths() -> Dict[str, str]:
+    """Find {crop}/{crop}_best_model.h5 (or its export) under MODEL_DIR"""
+    model_paths = {}
+    if not os.path.isdir(MODEL_DIR):
+        return model_paths
+    
+    for crop_type in sorted(os.listdir(MODEL_DIR)):
+        model_path = model_file(crop_type)
+        if model_path is not None:
+            model_paths[crop_type] = model_path
+    return model_paths
 
 def load_models():
-    """Load all trained models and their class names"""
+    """Load all trained models together with their signatures"""
     try:
-        # Cassava model
-        cassava_model_path = "../cassava/cassava_best_model.h5"
-        if os.path.exists(cassava_model_path):
-            models['cassava'] = tf.keras.models.load_model(cassava_model_path)
-            class_names['cassava'] = [
-                'bacterial_blight',
-                'brown_streak_disease', 
-                'green_mottle',
-                'healthy',
-                'mosaic_disease'
-            ]
-            print("✅ Cassava model loaded successfully")
-        
-        # Maize model
-        maize_model_path = "../maize/maize_best_model.h5"
-        if os.path.exists(maize_model_path):
-            models['maize'] = tf.keras.models.load_model(maize_model_path)
-            class_names['maize'] = [
-                'blight',
-                'common_rust',
-                'gray_leaf_spot',
-                'healthy'
-            ]
-            print("✅ Maize model loaded successfully")
-        
-        # Tomato model
-        tomato_model_path = "../tomato/tomato_best_model.h5"
-        if os.path.exists(tomato_model_path):
-            models['tomato'] = tf.keras.models.load_model(tomato_model_path)
-            class_names['tomato'] = [
-                'bacterial_spot',
-                'early_blight',
-                'healthy',
-                'late_blight',
-                'leaf_mold',
-                'mosaic_virus',
-                'septoria_spot',
-                'spider_mites',
-                'target_spot',
-                'yellow_leaf_curl_virus'
-            ]
-            print("✅ Tomato model loaded successfully")
+        for crop_type, model_path in discover_model_paths().items():
+            try:
+                signature = load_signature(model_path)
+            except (OSError, ValueError) as e:
+                print(f"⚠️  Skipping {crop_type} model: {str(e)}")
+                continue
+            
+            model = tf.keras.models.load_model(model_path)
+            verify_signature(model, signature, model_path)
+            
+            models[crop_type] = model
+            signatures[crop_type] = signature
+            labels[crop_type] = LabelSet(signature["class_names"])
+            print(f"✅ {crop_type.capitalize()} model loaded successfully "
+                  f"({len(signature['class_names'])} classes, input {signature['input_size']} "
+                  f"{signature['input_dtype']}, {os.path.basename(model_path)})")
+            
+            if CASCADE_ENABLED:
+                load_fast_model(crop_type)
+            load_case_index(crop_type)
             
         print(f"🎯 Loaded {len(models)} models successfully")
         
@@ -82,69 +188,285 @@ def load_models():
         print(f"❌ Error loading models: {str(e)}")
         raise e
 
-def preprocess_image(image_bytes: bytes, target_size: tuple = (224, 224)) -> np.ndarray:
-    """Preprocess image for model inference"""
-    try:
-        # Convert bytes to PIL Image
-        image = Image.open(io.BytesIO(image_bytes))
-        
-        # Convert to RGB if necessary
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        # Resize image
-        image = image.resize(target_size)
-        
-        # Convert to numpy array and normalize
-        image_array = np.array(image).astype(np.float32) / 255.0
-        
-        # Add batch dimension
-        image_array = np.expand_dims(image_array, axis=0)
-        
-        return image_array
-        
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Image preprocessing failed: {str(e)}")
+def load_fast_model(crop_type: str):
+    """Load the calibrated first-stage model of a crop's cascade, if there is one"""
+    fast_model_path = model_file(crop_type, "fast")
+    if fast_model_path is None:
+        return
+    
+    fast_signature = load_signature(fast_model_path)
+    threshold = fast_signature.get("cascade", {}).get("threshold")
+    if threshold is None:
+        print(f"⚠️  {crop_type.capitalize()} fast model is not calibrated; run scripts/calibrate_cascade.py")
+        return
+    if fast_signature["class_names"] != signatures[crop_type]["class_names"]:
+        print(f"⚠️  {crop_type.capitalize()} fast model classes differ from the full model; cascade disabled")
+        return
+    
+    fast_model = tf.keras.models.load_model(fast_model_path)
+    verify_signature(fast_model, fast_signature, fast_model_path)
+    
+    fast_models[crop_type] = fast_model
+    fast_signatures[crop_type] = fast_signature
+    print(f"⚡ {crop_type.capitalize()} cascade enabled "
+          f"(input {fast_signature['input_size']}, threshold {threshold:.3f})")
+
+def load_case_index(crop_type: str):
+    """Load the crop's similar-case index if it was built from the model that is being served"""
+    index = CaseIndex.load(MODEL_DIR, crop_type)
+    if index is None:
+        return
+    if index.model_version != signatures[crop_type]["model_version"]:
+        print(f"⚠️  {crop_type.capitalize()} similar-case index was built with {index.model_version}; "
+              f"rebuild it with: python case_index.py --crop {crop_type}")
+        return
+    
+    embedding_models[crop_type] = embedding_model(models[crop_type], signatures[crop_type])
+    case_indexes[crop_type] = index
+    print(f"🔎 {crop_type.capitalize()} similar cases enabled "
+          f"({len(index)} images in {len(index.centroids)} lists)")
+
+def check_top_k(top_k: Optional[int], min_probability: Optional[float]):
+    """Validate the ``top_k`` and ``min_probability`` query parameters"""
+    if top_k is not None and top_k < 1:
+        raise HTTPException(status_code=400, detail="top_k must be at least 1")
+    if min_probability is not None:
+        if top_k is None:
+            raise HTTPException(status_code=400, detail="min_probability filters top_k; send top_k as well")
+        if not 0 <= min_probability <= 1:
+            raise HTTPException(status_code=400, detail="min_probability must be between 0 and 1")
 
-def predict_disease(model, image_array: np.ndarray, crop_type: str) -> Dict:
-    """Make prediction using the loaded model"""
+def check_similar(crop_type: str, similar: Optional[int]):
+    """Validate the ``similar`` query parameter"""
+    if similar is None:
+        return
+    if not 1 <= similar <= MAX_SIMILAR_CASES:
+        raise HTTPException(status_code=400, detail=f"similar must be between 1 and {MAX_SIMILAR_CASES}")
+    if crop_type not in case_indexes:
+        raise HTTPException(status_code=503, detail=f"No similar-case index for {crop_type}")
+
+def prepare_batch(images: List[Image.Image], signature: Dict) -> np.ndarray:
+    """Resize and scale decoded images into one NHWC batch described by a model signature"""
+    # PIL sizes are (width, height); signatures store (height, width)
+    height, width = signature["input_size"]
+    batch = np.empty((len(images), height, width, 3), dtype=signature["input_dtype"])
+    for i, image in enumerate(images):
+        batch[i] = np.asarray(image.resize((width, height)))
+    
+    # Scale in place to avoid a second full-size copy
+    if signature["rescale"] != 1.0:
+        batch *= np.array(signature["rescale"], dtype=batch.dtype)
+    
+    return batch
+
+def predict_probabilities(model, image_batch: np.ndarray) -> np.ndarray:
+    """Run the model on a batch and return its (batch, classes) probabilities"""
     try:
-        # Make prediction
-        predictions = model.predict(image_array, verbose=0)
-        
-        # Get predicted class index
-        predicted_class_idx = np.argmax(predictions[0])
-        
-        # Get confidence score
-        confidence = float(predictions[0][predicted_class_idx])
-        
-        # Get class name
-        predicted_class = class_names[crop_type][predicted_class_idx]
-        
-        # Get all probabilities
-        all_probabilities = {
-            class_names[crop_type][i]: float(predictions[0][i])
-            for i in range(len(class_names[crop_type]))
-        }
-        
-        return {
-            "crop_type": crop_type,
-            "predicted_disease": predicted_class,
-            "confidence": confidence,
-            "all_probabilities": all_probabilities,
-            "status": "healthy" if predicted_class == "healthy" else "diseased"
-        }
-        
+        batch_size = thread_settings["batch_size"] if thread_settings else None
+        return model.predict(image_batch, batch_size=batch_size, verbose=0)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
 
+def predict_images(images: List[Image.Image], crop_type: str, top_k: Optional[int] = None,
+                   min_probability: Optional[float] = None, prepared: Optional[Dict[str, np.ndarray]] = None,
+                   similar: Optional[int] = None, logged: Optional[List[tuple]] = None) -> List[Dict]:
+    """Predict a batch of decoded images, trying the crop's fast model first when a cascade is loaded
+
+    ``prepared`` holds batches already preprocessed for the "fast" and "full"
+    models (the shared-memory decode path); ``images`` are then only logged,
+    or ``logged`` gives each one's (hash, jpeg) for the prediction log.
+    With ``similar``, every result gets that many ``similar_cases``; the
+    embeddings come from the full model, so the cascade is skipped.
+    """
+    start = time.perf_counter()
+    results = [None] * len(images)
+    pending = np.arange(len(images))
+    crop_labels = labels[crop_type]
+    
+    if crop_type in fast_models and not similar:
+        fast_signature = fast_signatures[crop_type]
+        fast_batch = prepared["fast"] if prepared is not None else prepare_batch(images, fast_signature)
+        probabilities = predict_probabilities(fast_models[crop_type], fast_batch)
+        confident = probabilities.max(axis=1) >= fast_signature["cascade"]["threshold"]
+        fast_results = postprocess_batch(probabilities[confident], crop_labels, crop_type, stage="fast",
+                                         top_k=top_k, min_probability=min_probability)
+        for i, result in zip(np.flatnonzero(confident).tolist(), fast_results):
+            results[i] = result
+        pending = np.flatnonzero(~confident)
+    
+    if len(pending):
+        if prepared is None:
+            full_batch = prepare_batch([images[i] for i in pending.tolist()], signatures[crop_type])
+        elif len(pending) == len(images):
+            full_batch = prepared["full"]
+        else:
+            full_batch = prepared["full"][pending]
+        if similar:
+            embeddings, probabilities = predict_probabilities(embedding_models[crop_type], full_batch)
+        else:
+            probabilities = predict_probabilities(models[crop_type], full_batch)
+        full_results = postprocess_batch(probabilities, crop_labels, crop_type,
+                                         top_k=top_k, min_probability=min_probability)
+        if similar:
+            for result, cases in zip(full_results, case_indexes[crop_type].search(embeddings, similar)):
+                result["similar_cases"] = cases
+        for i, result in zip(pending.tolist(), full_results):
+            results[i] = result
+    
+    if prediction_log.enabled:
+        latency_ms = (time.perf_counter() - start) * 1000
+        for i, (image, result) in enumerate(zip(images, results)):
+            signature = fast_signatures[crop_type] if result["stage"] == "fast" else signatures[crop_type]
+            digest, jpeg = logged[i] if logged else (None, None)
+            prediction_log.record(result, signature["model_version"], latency_ms, image, digest=digest, jpeg=jpeg)
+    
+    return results
+
+def decode_size(*crop_types: str):
+    """(width, height) uploads for these crops are shrunk to: the largest input of their models"""
+    sizes = [signatures[crop_type]["input_size"] for crop_type in crop_types]
+    sizes += [fast_signatures[crop_type]["input_size"] for crop_type in crop_types if crop_type in fast_signatures]
+    return retained_size(sizes)
+
+def predict_image(image: Image.Image, crop_type: str, top_k: Optional[int] = None,
+                  min_probability: Optional[float] = None, similar: Optional[int] = None) -> Dict:
+    """Predict a single decoded image"""
+    return predict_images([image], crop_type, top_k=top_k, min_probability=min_probability, similar=similar)[0]
+
+def predict_pixels(pixels: np.ndarray, crop_type: str, top_k: Optional[int] = None,
+                   min_probability: Optional[float] = None, similar: Optional[int] = None) -> List[Dict]:
+    """Predict (n, height, width, 3) uint8 RGB arrays already at the model's input size, without decoding or resizing"""
+    signature = signatures[crop_type]
+    full_batch = pixels.astype(signature["input_dtype"], copy=signature["rescale"] != 1.0)
+    if signature["rescale"] != 1.0:
+        full_batch *= np.array(signature["rescale"], dtype=full_batch.dtype)
+    
+    images = [Image.fromarray(image) for image in pixels]
+    prepared = {"full": full_batch}
+    if crop_type in fast_models and not similar:
+        # The cascade's first stage may be smaller; shrinking a model-sized image is cheap
+        prepared["fast"] = prepare_batch(images, fast_signatures[crop_type])
+    return predict_images(images, crop_type, top_k=top_k, min_probability=min_probability, prepared=prepared,
+                          similar=similar)
+
+def predict_frames(frames: List[tuple], crop_type: str, top_k: Optional[int] = None,
+                   min_probability: Optional[float] = None) -> List[tuple]:
+    """Decode stream frames one by one, predict the readable ones as one batch; (status, result or detail) per frame"""
+    height, width = signatures[crop_type]["input_size"]
+    images = []
+    outcomes = []
+    for kind, payload in frames:
+        try:
+            if kind == KIND_RAW:
+                images.append(Image.fromarray(raw_pixels(payload, height, width)[0]))
+            else:
+                images.append(decode_checked(payload, decode_size(crop_type)))
+            outcomes.append(None)
+        except HTTPException as e:
+            outcomes.append((e.status_code, e.detail))
+    
+    results = iter(predict_images(images, crop_type, top_k=top_k, min_probability=min_probability) if images else [])
+    return [(200, next(results)) if outcome is None else outcome for outcome in outcomes]
+
+def predict_encoded(encoded: List[bytes], crop_type: str, top_k: Optional[int] = None,
+                    min_probability: Optional[float] = None, similar: Optional[int] = None) -> List[Dict]:
+    """Predict still-encoded uploads, decoded by the decode processes into shared batch slots"""
+    specs = {"full": input_spec(signatures[crop_type])}
+    if crop_type in fast_models:
+        specs["fast"] = input_spec(fast_signatures[crop_type])
+    
+    # The decode processes hash (and for storage encode) the images the prediction log needs
+    log = ("jpeg" if prediction_log.log_images else "hash") if prediction_log.enabled else None
+    results = []
+    for start in range(0, len(encoded), decode_pool.capacity):
+        chunk = encoded[start:start + decode_pool.capacity]
+        with decode_pool.decode(chunk, specs, log) as (prepared, logged):
+            results.extend(predict_images([None] * len(chunk), crop_type, top_k=top_k, min_probability=min_probability,
+                                          prepared=prepared, similar=similar, logged=logged))
+    return results
+
+def start_decode_pool():
+    """Start the decode processes with slots big enough for every loaded model's inputs"""
+    global decode_pool
+    slot_bytes = max(
+        region_bytes(input_spec(signatures[crop_type]), SHARED_BATCH_SIZE)
+        + (region_bytes(input_spec(fast_signatures[crop_type]), SHARED_BATCH_SIZE) if crop_type in fast_signatures else 0)
+        for crop_type in models
+    )
+    # One slot per inference worker, so a job never waits for a slot
+    decode_pool = DecodePool(DECODE_PROCESSES, INFERENCE_WORKERS, slot_bytes)
+    decode_pool.start()
+
+def parse_scales(scales: str) -> List[float]:
+    """Parse the comma-separated ``scales`` query parameter of tiled inference"""
+    try:
+        values = [float(value) for value in scales.split(",") if value.strip()]
+    except ValueError:
+        raise HTTPException(status_code=400, detail="scales must be comma-separated numbers, e.g. 1.0,0.5")
+    if not values or len(values) > MAX_SCALES or not all(0 < value <= 1 for value in values):
+        raise HTTPException(status_code=400, detail=f"scales must be 1 to {MAX_SCALES} values in (0, 1]")
+    return values
+
+def predict_tiled(tiles: np.ndarray, image: Image.Image, crop_type: str, plans: List[Dict], overlap: float,
+                  top_k: Optional[int] = None, min_probability: Optional[float] = None) -> Dict:
+    """Predict an image's uint8 tiles as one batch and pool them into one result plus heat maps
+
+    ``image`` is the photo shrunk to the model input, for the prediction log.
+    """
+    start = time.perf_counter()
+    signature = signatures[crop_type]
+    crop_labels = labels[crop_type]
+    
+    batch = tiles.astype(signature["input_dtype"], copy=False)
+    if signature["rescale"] != 1.0:
+        batch *= np.array(signature["rescale"], dtype=batch.dtype)
+    
+    probabilities = predict_probabilities(models[crop_type], batch)
+    pooled = pool_tile_probabilities(probabilities, crop_labels)
+    result = postprocess_batch(pooled[np.newaxis], crop_labels, crop_type, stage="tiled",
+                               top_k=top_k, min_probability=min_probability)[0]
+    result["tiles"] = {
+        "count": len(batch),
+        "tile_size": list(signature["input_size"]),
+        "overlap": overlap,
+        "heat_maps": heat_maps(probabilities, crop_labels, plans),
+    }
+    prediction_log.record(result, signature["model_version"], (time.perf_counter() - start) * 1000, image)
+    return result
+
+def predict_all_crops(image: Image.Image) -> Dict:
+    """Run a decoded image through every crop model, collecting per-crop errors"""
+    results = {}
+    for crop_type in models:
+        try:
+            result = predict_image(image, crop_type)
+            results[crop_type] = result
+        except Exception as e:
+            results[crop_type] = {"error": str(e)}
+    return results
+
 @app.on_event("startup")
 async def startup_event():
     """Load models when the API starts"""
+    global thread_settings
     print("🚀 Starting Crop Disease Detection API...")
+    # Thread pools have to be sized before TensorFlow runs its first op
+    thread_settings = apply_tuning()
     load_models()
+    scheduler.start()
+    prediction_log.start()
+    if DECODE_PROCESSES > 0 and models:
+        start_decode_pool()
     print("🎉 API is ready to serve predictions!")
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the inference workers and flush the prediction log"""
+    await scheduler.stop()
+    prediction_log.stop()
+    if decode_pool is not None:
+        decode_pool.stop()
+
 @app.get("/")
 async def root():
     """Root endpoint with API information"""
@@ -153,104 +475,249 @@ async def root():
         "version": "1.0.0",
         "available_crops": list(models.keys()),
         "endpoints": {
-            "detect_cassava": "/detect/cassava",
-            "detect_maize": "/detect/maize", 
-            "detect_tomato": "/detect/tomato",
+            **{f"detect_{crop_type}": f"/detect/{crop_type}" for crop_type in models},
+            "detect_tiled": "/detect/{crop}/tiled",
+            "detect_raw": "/detect/{crop}/raw",
+            "stream": "/stream/{crop}",
+            "model_spec": "/models/{crop}/spec",
+            "case_image": "/cases/{crop}/{case_id}/image",
             "detect_auto": "/detect/auto",
-            "health": "/health"
+            "health": "/health",
+            "metrics": "/metrics"
         }
     }
 
+def current_rss_mb() -> Optional[float]:
+    """Resident memory right now (peak_rss_mb never falls), or None where /proc is unavailable"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
 @app.get("/health")
 async def health_check():
     """Health check endpoint"""
     return {
         "status": "healthy",
         "models_loaded": len(models),
-        "available_crops": list(models.keys())
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_mb": current_rss_mb(),
+        "available_crops": list(models.keys()),
+        "cascade_crops": list(fast_models.keys()),
+        "similar_case_crops": list(case_indexes.keys()),
+        "threads": thread_settings
     }
 
-@app.post("/detect/cassava")
-async def detect_cassava_disease(file: UploadFile = File(...)):
-    """Detect diseases in cassava leaves"""
-    if 'cassava' not in models:
-        raise HTTPException(status_code=503, detail="Cassava model not available")
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Scheduler and prediction log metrics in Prometheus format"""
+    return scheduler.prometheus_metrics() + prediction_log.prometheus_metrics()
+
+@app.get("/models/{crop_type}/spec")
+async def model_spec(crop_type: str):
+    """Input spec of a crop's model, for clients that resize on-device and use /detect/{crop}/raw"""
+    if crop_type not in models:
+        raise HTTPException(status_code=503, detail=f"{crop_type.capitalize()} model not available")
     
-    # Validate file type
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    signature = signatures[crop_type]
+    height, width = signature["input_size"]
+    return {
+        "crop_type": crop_type,
+        "model_version": signature["model_version"],
+        "class_names": signature["class_names"],
+        "input": {
+            "height": height,
+            "width": width,
+            "channels": 3,
+            "color": "RGB",
+            "layout": "HWC",
+            "resample": "bicubic",
+        },
+        "uploads": {
+            "raw": {
+                "endpoint": f"/detect/{crop_type}/raw",
+                "content_type": "application/octet-stream",
+                "dtype": "uint8",
+                "bytes": height * width * 3,
+            },
+            "jpeg": {
+                "endpoint": f"/detect/{crop_type}/raw",
+                "content_type": "image/jpeg",
+                "size": [width, height],
+                "quality": COMPACT_JPEG_QUALITY,
+            },
+        },
+    }
+
+@app.get("/cases/{crop_type}/{case_id}/image")
+async def similar_case_image(crop_type: str, case_id: int):
+    """Reference image of a case returned in ``similar_cases``"""
+    if crop_type not in case_indexes:
+        raise HTTPException(status_code=503, detail=f"No similar-case index for {crop_type}")
+    index = case_indexes[crop_type]
+    if not 0 <= case_id < len(index):
+        raise HTTPException(status_code=404, detail=f"No case {case_id} for {crop_type}")
     
-    # Read and preprocess image
-    image_bytes = await file.read()
-    image_array = preprocess_image(image_bytes)
+    image_dir = os.path.join(CASE_IMAGE_DIR, crop_type) if CASE_IMAGE_DIR else index.meta.get("data_dir")
+    path = os.path.join(image_dir or "", *index.paths[case_id].split("/"))
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail=f"Image of case {case_id} is not available on this server")
+    return FileResponse(path)
+
+@app.post("/detect/auto")
+async def detect_disease_auto(request: Request, file: UploadFile = File(...)):
+    """Automatically detect crop type and disease (experimental)"""
+    # One model call per crop, charged like that many images
+    ticket = scheduler.admit(request, cost=len(models))
     
-    # Make prediction
-    result = predict_disease(models['cassava'], image_array, 'cassava')
+    # Stream and decode once, at the largest model input; each model gets its own resize/scaling
+    image = await read_image_upload(file, decode_size(*models))
     
-    return JSONResponse(content=result)
+    # Try all models and return the one with highest confidence
+    results = await scheduler.submit(ticket, predict_all_crops, image, cost=len(models))
+    
+    return encode_response({
+        "message": "Auto-detection results for all crop types",
+        "results": results
+    }, request)
 
-@app.post("/detect/maize")
-async def detect_maize_disease(file: UploadFile = File(...)):
-    """Detect diseases in maize leaves"""
-    if 'maize' not in models:
-        raise HTTPException(status_code=503, detail="Maize model not available")
+@app.post("/detect/{crop_type}")
+async def detect_crop_disease(crop_type: str, request: Request, file: UploadFile = File(...),
+                              top_k: Optional[int] = None, min_probability: Optional[float] = None,
+                              similar: Optional[int] = None):
+    """Detect diseases in leaves of the given crop, optionally with the most similar labelled cases"""
+    if crop_type not in models:
+        raise HTTPException(status_code=503, detail=f"{crop_type.capitalize()} model not available")
+    check_top_k(top_k, min_probability)
+    check_similar(crop_type, similar)
+    
+    # Rate-limit before spending any work on the upload
+    ticket = scheduler.admit(request)
     
-    # Validate file type
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    if decode_pool is not None:
+        # Decoded in a decode process, straight into a shared batch slot
+        encoded = await read_encoded_upload(file)
+        results = await scheduler.submit(ticket, predict_encoded, [encoded], crop_type,
+                                         top_k=top_k, min_probability=min_probability, similar=similar)
+        return encode_response(results[0], request)
     
-    # Read and preprocess image
-    image_bytes = await file.read()
-    image_array = preprocess_image(image_bytes)
+    # Stream and decode image, rejecting oversized or non-image uploads early
+    image = await read_image_upload(file, decode_size(crop_type))
     
-    # Make prediction
-    result = predict_disease(models['maize'], image_array, 'maize')
+    # Make prediction on a scheduler worker
+    result = await scheduler.submit(ticket, predict_image, image, crop_type,
+                                    top_k=top_k, min_probability=min_probability, similar=similar)
     
-    return JSONResponse(content=result)
+    return encode_response(result, request)
 
-@app.post("/detect/tomato")
-async def detect_tomato_disease(file: UploadFile = File(...)):
-    """Detect diseases in tomato leaves"""
-    if 'tomato' not in models:
-        raise HTTPException(status_code=503, detail="Tomato model not available")
+@app.post("/detect/{crop_type}/raw")
+async def detect_crop_disease_raw(crop_type: str, request: Request, top_k: Optional[int] = None,
+                                  min_probability: Optional[float] = None, similar: Optional[int] = None):
+    """Detect diseases in a leaf the client already resized to the model input (see /models/{crop}/spec)
+
+    The body is either the raw uint8 RGB pixels (``application/octet-stream``)
+    or a JPEG of exactly the input size (``image/jpeg``); neither is resized.
+    """
+    if crop_type not in models:
+        raise HTTPException(status_code=503, detail=f"{crop_type.capitalize()} model not available")
+    check_top_k(top_k, min_probability)
+    check_similar(crop_type, similar)
     
-    # Validate file type
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
+    ticket = scheduler.admit(request)
+    height, width = signatures[crop_type]["input_size"]
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type == "application/octet-stream":
+        pixels = raw_pixels(await read_request_body(request, height * width * 3), height, width)
+    elif content_type == "image/jpeg":
+        pixels = compact_jpeg_pixels(await read_request_body(request, MAX_UPLOAD_BYTES), height, width)
+    else:
+        raise HTTPException(status_code=415, detail="Send application/octet-stream (raw RGB) or image/jpeg")
     
-    # Read and preprocess image
-    image_bytes = await file.read()
-    image_array = preprocess_image(image_bytes)
+    results = await scheduler.submit(ticket, predict_pixels, pixels, crop_type,
+                                     top_k=top_k, min_probability=min_probability, similar=similar)
+    return encode_response(results[0], request)
+
+@app.websocket("/stream/{crop_type}")
+async def stream_crop_disease(websocket: WebSocket, crop_type: str, format: str = "binary",
+                              top_k: Optional[int] = None, min_probability: Optional[float] = None):
+    """Pipeline many images over one WebSocket; frames are micro-batched through the scheduler (see streaming.py)"""
+    if crop_type not in models or format not in ("binary", "json"):
+        await websocket.close(code=1008, reason=f"Unknown crop {crop_type}" if crop_type not in models else "format must be binary or json")
+        return
+    try:
+        check_top_k(top_k, min_probability)
+    except HTTPException as e:
+        await websocket.close(code=1008, reason=e.detail)
+        return
     
-    # Make prediction
-    result = predict_disease(models['tomato'], image_array, 'tomato')
+    encoder = ResultEncoder(signatures[crop_type]["class_names"], binary=format == "binary")
+    await serve_stream(websocket, scheduler,
+                       lambda frames: predict_frames(frames, crop_type, top_k=top_k, min_probability=min_probability),
+                       encoder)
+
+@app.post("/detect/{crop_type}/tiled")
+async def detect_crop_disease_tiled(crop_type: str, request: Request, file: UploadFile = File(...),
+                                    scales: str = "1.0", overlap: float = DEFAULT_OVERLAP,
+                                    top_k: Optional[int] = None, min_probability: Optional[float] = None):
+    """Detect diseases in a high-resolution photo from overlapping model-sized tiles"""
+    if crop_type not in models:
+        raise HTTPException(status_code=503, detail=f"{crop_type.capitalize()} model not available")
+    if not 0 <= overlap <= 0.9:
+        raise HTTPException(status_code=400, detail="overlap must be between 0 and 0.9")
+    check_top_k(top_k, min_probability)
+    scale_values = parse_scales(scales)
+    
+    ticket = scheduler.admit(request)
+    tile_size = signatures[crop_type]["input_size"]
+    
+    def cut_tiles(image: Image.Image):
+        # Runs in the decode slot, so only the uint8 tiles and a model-sized copy outlive the full photo
+        plans = plan_tiles(image.size, tile_size, scale_values, overlap, MAX_TILES)
+        tile_count = sum(len(plan["ys"]) * len(plan["xs"]) for plan in plans)
+        if tile_count > MAX_TILES:
+            raise HTTPException(status_code=413, detail=f"Image needs {tile_count} tiles; at most {MAX_TILES} are allowed")
+        return plans, tile_batch(image, plans, tile_size), shrink_image(image, decode_size(crop_type))
+    
+    plans, tiles, image = await read_image_upload(file, prepare=cut_tiles)
     
-    return JSONResponse(content=result)
+    # The tile count is known before inference, so the scheduler can charge for it
+    scheduler.charge(ticket, len(tiles) - 1)
+    result = await scheduler.submit(ticket, predict_tiled, tiles, image, crop_type, plans, overlap, cost=len(tiles),
+                                    top_k=top_k, min_probability=min_probability)
+    
+    return encode_response(result, request)
 
-@app.post("/detect/auto")
-async def detect_disease_auto(file: UploadFile = File(...)):
-    """Automatically detect crop type and disease (experimental)"""
-    # Validate file type
-    if not file.content_type.startswith('image/'):
-        raise HTTPException(status_code=400, detail="File must be an image")
+@app.post("/detect/{crop_type}/batch")
+async def detect_crop_disease_batch(crop_type: str, request: Request, files: List[UploadFile] = File(...),
+                                    top_k: Optional[int] = None, min_probability: Optional[float] = None,
+                                    similar: Optional[int] = None):
+    """Detect diseases in several leaves of the given crop with one model call"""
+    if crop_type not in models:
+        raise HTTPException(status_code=503, detail=f"{crop_type.capitalize()} model not available")
+    check_top_k(top_k, min_probability)
+    check_similar(crop_type, similar)
     
-    # Read and preprocess image
-    image_bytes = await file.read()
-    image_array = preprocess_image(image_bytes)
+    # Batch uploads are bulk traffic unless a trusted client says otherwise; each image costs a token
+    ticket = scheduler.admit(request, default_priority="bulk", cost=len(files))
     
-    # Try all models and return the one with highest confidence
-    results = {}
-    for crop_type, model in models.items():
-        try:
-            result = predict_disease(model, image_array, crop_type)
-            results[crop_type] = result
-        except Exception as e:
-            results[crop_type] = {"error": str(e)}
+    if decode_pool is not None:
+        # Decode processes fill a shared batch slot that the model reads without a copy
+        encoded = [await read_encoded_upload(file) for file in files]
+        results = await scheduler.submit(ticket, predict_encoded, encoded, crop_type, cost=len(encoded),
+                                         top_k=top_k, min_probability=min_probability, similar=similar)
+    else:
+        # Stream and decode all images at the model input size, then predict them as one batch
+        images = [await read_image_upload(file, decode_size(crop_type)) for file in files]
+        results = await scheduler.submit(ticket, predict_images, images, crop_type, cost=len(images),
+                                         top_k=top_k, min_probability=min_probability, similar=similar)
     
-    return JSONResponse(content={
-        "message": "Auto-detection results for all crop types",
+    return encode_response({
+        "crop_type": crop_type,
+        "count": len(results),
         "results": results
-    })
+    }, request)
 
 if __name__ == "__main__":
     uvicorn.run(
@@ -0,0 +1,78 @@
+"""
+Vectorized postprocessing of model outputs.
+
+All per-class work (argmax, top-k, thresholding) runs in NumPy over the whole
+batch; Python only touches each result once, when the response dict is built.
+Probabilities are turned into Python floats with ``ndarray.tolist()`` instead
+of one ``float()`` call per class.
+"""
+
+from typing import Dict, List, Optional
+import numpy as np
+
+
+class LabelSet:
+    """Class names of one model, prepared once at load time"""
+
+    def __init__(self, class_names: List[str]):
+        self.names = list(class_names)
+        self.array = np.array(self.names, dtype=object)
+        self.healthy_index = self.names.index("healthy") if "healthy" in self.names else -1
+
+    def __len__(self):
+        return len(self.names)
+
+
+def top_k_indices(probabilities: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k largest probabilities per row, highest first"""
+    k = min(k, probabilities.shape[1])
+    if k == probabilities.shape[1]:
+        candidates = np.broadcast_to(np.arange(k), probabilities.shape)
+    else:
+        candidates = np.argpartition(-probabilities, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(probabilities, candidates, axis=1), axis=1, kind="stable")
+    return np.take_along_axis(candidates, order, axis=1)
+
+
+def postprocess_batch(probabilities: np.ndarray, labels: LabelSet, crop_type: str,
+                      stage: str = "full", top_k: Optional[int] = None,
+                      min_probability: Optional[float] = None) -> List[Dict]:
+    """Turn a (batch, classes) probability matrix into API result dicts"""
+    probabilities = np.asarray(probabilities)
+    predicted = probabilities.argmax(axis=1)
+    confidence = np.take_along_axis(probabilities, predicted[:, np.newaxis], axis=1)[:, 0]
+    healthy = predicted == labels.healthy_index
+
+    predicted_names = labels.array[predicted].tolist()
+    confidence_list = confidence.tolist()
+    healthy_list = healthy.tolist()
+    rows = probabilities.tolist()
+
+    if top_k is not None:
+        top_indices = top_k_indices(probabilities, top_k)
+        top_probabilities = np.take_along_axis(probabilities, top_indices, axis=1)
+        keep = np.ones(top_indices.shape, dtype=bool)
+        if min_probability is not None:
+            keep = top_probabilities >= min_probability
+        top_names = labels.array[top_indices].tolist()
+        top_values = top_probabilities.tolist()
+        keep = keep.tolist()
+
+    results = []
+    for i, row in enumerate(rows):
+        result = {
+            "crop_type": crop_type,
+            "predicted_disease": predicted_names[i],
+            "confidence": confidence_list[i],
+            "all_probabilities": dict(zip(labels.names, row)),
+            "status": "healthy" if healthy_list[i] else "diseased",
+            "stage": stage
+        }
+        if top_k is not None:
+            result["top_k"] = [
+                {"disease": name, "probability": value}
+                for name, value, kept in zip(top_names[i], top_values[i], keep[i])
+                if kept
+            ]
+        results.append(result)
+    return results
@@ -0,0 +1,278 @@
+"""
+Append-only prediction log for relabelling and retraining.
+
+Request handlers only call ``PredictionLog.record``, which puts a small tuple
+(references to the result dict and the decoded image) on a bounded in-memory
+queue with ``put_nowait``. It never blocks and never does I/O; when the queue is
+full the entry is dropped and counted. While more than
+``VERDSCAN_LOG_MAX_PENDING_IMAGES`` images wait for the writer, new rows are
+queued without their image (no hash, nothing stored) and counted as
+``images_dropped``. Callers that decoded
+the upload elsewhere (the shared-memory decode processes) pass its hash and,
+for storage, its JPEG instead of the image.
+
+A background thread drains the queue and, in batches:
+
+- serialises the rows into the current segment, a SQLite database or, with
+  ``pyarrow`` installed, a Parquet file with one row group per batch. Segments
+  rotate after ``VERDSCAN_LOG_SEGMENT_ROWS`` rows or ``VERDSCAN_LOG_SEGMENT_SECONDS``
+- hashes every row's image (SHA-256 of the decoded pixels) and, with
+  ``VERDSCAN_LOG_IMAGES=1``, stores each one once as
+  ``images/<2 hex>/<hash>.jpg``, so repeated uploads of the same photo cost one
+  file
+
+Enable it with ``VERDSCAN_PREDICTION_LOG=/path/to/log`` (``VERDSCAN_LOG_IMAGES=1``
+to keep the images as well).
+"""
+
+import os
+import json
+import time
+import queue
+import sqlite3
+import hashlib
+import threading
+from typing import Dict, List, Optional
+from PIL import Image
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # optional dependency
+    pyarrow = None
+
+LOG_DIR = os.environ.get("VERDSCAN_PREDICTION_LOG", "")
+LOG_IMAGES = os.environ.get("VERDSCAN_LOG_IMAGES", "0") == "1"
+LOG_FORMAT = os.environ.get("VERDSCAN_LOG_FORMAT", "sqlite")
+QUEUE_SIZE = int(os.environ.get("VERDSCAN_LOG_QUEUE_SIZE", "10000"))
+MAX_PENDING_IMAGES = int(os.environ.get("VERDSCAN_LOG_MAX_PENDING_IMAGES", "64"))
+BATCH_SIZE = int(os.environ.get("VERDSCAN_LOG_BATCH_SIZE", "256"))
+FLUSH_SECONDS = float(os.environ.get("VERDSCAN_LOG_FLUSH_SECONDS", "1.0"))
+SEGMENT_ROWS = int(os.environ.get("VERDSCAN_LOG_SEGMENT_ROWS", "100000"))
+SEGMENT_SECONDS = float(os.environ.get("VERDSCAN_LOG_SEGMENT_SECONDS", "86400"))
+IMAGE_QUALITY = 95
+MAX_KNOWN_IMAGES = 100000
+
+COLUMNS = ("timestamp", "crop_type", "model_version", "stage", "predicted_disease", "confidence",
+           "probabilities", "latency_ms", "image_hash")
+
+
+def image_hash(image: Image.Image) -> str:
+    """Content address of a decoded image (pixels and size, not the upload's encoding)"""
+    digest = hashlib.sha256(f"{image.mode}:{image.size[0]}x{image.size[1]}:".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+class SqliteSegment:
+    """One SQLite database file holding a run of log rows"""
+
+    extension = ".sqlite"
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "timestamp REAL, crop_type TEXT, model_version TEXT, stage TEXT, predicted_disease TEXT, "
+            "confidence REAL, probabilities TEXT, latency_ms REAL, image_hash TEXT)"
+        )
+
+    def write(self, rows: List[Dict]):
+        placeholders = ", ".join("?" for _ in COLUMNS)
+        with self.connection:
+            self.connection.executemany(
+                f"INSERT INTO predictions ({', '.join(COLUMNS)}) VALUES ({placeholders})",
+                [tuple(row[column] for column in COLUMNS) for row in rows]
+            )
+
+    def close(self):
+        self.connection.close()
+
+
+class ParquetSegment:
+    """One Parquet file; every flushed batch becomes a row group"""
+
+    extension = ".parquet"
+
+    def __init__(self, path: str):
+        self.schema = pyarrow.schema([
+            ("timestamp", pyarrow.float64()), ("crop_type", pyarrow.string()),
+            ("model_version", pyarrow.string()), ("stage", pyarrow.string()),
+            ("predicted_disease", pyarrow.string()), ("confidence", pyarrow.float64()),
+            ("probabilities", pyarrow.string()), ("latency_ms", pyarrow.float64()),
+            ("image_hash", pyarrow.string()),
+        ])
+        self.writer = pyarrow.parquet.ParquetWriter(path, self.schema)
+
+    def write(self, rows: List[Dict]):
+        self.writer.write_table(pyarrow.Table.from_pylist(rows, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+
+class PredictionLog:
+    """Bounded queue in front of a background segment writer"""
+
+    def __init__(self, log_dir: str = LOG_DIR, log_images: bool = LOG_IMAGES, log_format: str = LOG_FORMAT):
+        self.log_dir = log_dir
+        self.log_images = log_images
+        self.segment_class = ParquetSegment if log_format == "parquet" and pyarrow is not None else SqliteSegment
+        self.queue = queue.Queue(maxsize=QUEUE_SIZE)
+        self.lock = threading.Lock()
+        self.pending_images = 0
+        self.counters = {"recorded": 0, "dropped": 0, "written": 0, "images_stored": 0,
+                         "images_deduplicated": 0, "images_dropped": 0, "write_errors": 0}
+        self.segment = None
+        self.segment_rows = 0
+        self.segment_started = 0.0
+        self.known_images = set()
+        self.thread = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.log_dir)
+
+    def start(self):
+        if not self.enabled:
+            return
+        if self.segment_class is SqliteSegment and LOG_FORMAT == "parquet":
+            print("⚠️  pyarrow is not installed; prediction log falls back to SQLite segments")
+        os.makedirs(os.path.join(self.log_dir, "images"), exist_ok=True)
+        self.thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self.thread.start()
+        print(f"📝 Logging predictions to {self.log_dir}{' (with images)' if self.log_images else ''}")
+
+    def stop(self):
+        """Flush everything still queued and close the current segment"""
+        if self.thread is None:
+            return
+        self.queue.put(None)
+        self.thread.join()
+        self.thread = None
+
+    def record(self, result: Dict, model_version: str, latency_ms: float, image: Optional[Image.Image] = None,
+               digest: Optional[str] = None, jpeg: Optional[bytes] = None):
+        """Queue one prediction; never blocks, drops the entry when the queue is full"""
+        if not self.enabled:
+            return
+        if not self.log_images:
+            jpeg = None
+        elif jpeg is not None:
+            # Already encoded for storage; treat it like a pending image
+            image = jpeg
+        with self.lock:
+            backlogged = image is not None and self.pending_images >= MAX_PENDING_IMAGES
+            if backlogged:
+                # Keep memory bounded without slowing the request: the row goes without its image
+                image = None
+            try:
+                self.queue.put_nowait((time.time(), result, model_version, latency_ms, image, digest))
+            except queue.Full:
+                self.counters["dropped"] += 1
+                return
+            if image is not None:
+                self.pending_images += 1
+            if backlogged:
+                self.counters["images_dropped"] += 1
+            self.counters["recorded"] += 1
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch = []
+            deadline = time.monotonic() + FLUSH_SECONDS
+            while len(batch) < BATCH_SIZE:
+                try:
+                    entry = self.queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    with self.lock:
+                        self.counters["write_errors"] += 1
+                    print(f"⚠️  Prediction log write failed: {str(e)}")
+                finally:
+                    # Release the batch's images whether or not it was written
+                    with self.lock:
+                        self.pending_images -= sum(1 for entry in batch if entry[4] is not None)
+
+        if self.segment is not None:
+            self.segment.close()
+            self.segment = None
+
+    def _write(self, batch: List[tuple]):
+        rows = []
+        for timestamp, result, model_version, latency_ms, image, digest in batch:
+            if isinstance(image, bytes):
+                self._store_image(image, digest)
+            elif image is not None:
+                digest = image_hash(image)
+                if self.log_images:
+                    self._store_image(image, digest)
+            rows.append({
+                "timestamp": timestamp,
+                "crop_type": result["crop_type"],
+                "model_version": model_version,
+                "stage": result.get("stage", "full"),
+                "predicted_disease": result["predicted_disease"],
+                "confidence": result["confidence"],
+                "probabilities": json.dumps(result["all_probabilities"], separators=(",", ":")),
+                "latency_ms": latency_ms,
+                "image_hash": digest,
+            })
+
+        self._rotate_if_needed()
+        self.segment.write(rows)
+        self.segment_rows += len(rows)
+        with self.lock:
+            self.counters["written"] += len(rows)
+
+    def _rotate_if_needed(self):
+        now = time.time()
+        if self.segment is not None and (self.segment_rows >= SEGMENT_ROWS or now - self.segment_started >= SEGMENT_SECONDS):
+            self.segment.close()
+            self.segment = None
+        if self.segment is None:
+            name = time.strftime("predictions-%Y%m%d-%H%M%S", time.localtime(now)) + f"-{int(now * 1000) % 1000:03d}"
+            self.segment = self.segment_class(os.path.join(self.log_dir, name + self.segment_class.extension))
+            self.segment_rows = 0
+            self.segment_started = now
+
+    def _store_image(self, image, digest: str):
+        """Store a PIL image or ready JPEG bytes once under its hash"""
+        path = os.path.join(self.log_dir, "images", digest[:2], digest + ".jpg")
+        if digest in self.known_images or os.path.exists(path):
+            counter = "images_deduplicated"
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write under a temporary name so a crash never leaves a truncated image behind
+            if isinstance(image, bytes):
+                with open(path + ".tmp", "wb") as f:
+                    f.write(image)
+            else:
+                image.save(path + ".tmp", format="JPEG", quality=IMAGE_QUALITY)
+            os.replace(path + ".tmp", path)
+            counter = "images_stored"
+        with self.lock:
+            self.counters[counter] += 1
+        if len(self.known_images) >= MAX_KNOWN_IMAGES:
+            self.known_images.clear()
+        self.known_images.add(digest)
+
+    def prometheus_metrics(self) -> str:
+        """Counters in the Prometheus text exposition format"""
+        lines = ["# TYPE verdscan_prediction_log_queue_depth gauge",
+                 f"verdscan_prediction_log_queue_depth {self.queue.qsize()}"]
+        for name, value in self.counters.items():
+            lines.append(f"# TYPE verdscan_prediction_log_{name}_total counter")
+            lines.append(f"verdscan_prediction_log_{name}_total {value}")
+        return "\n".join(lines) + "\n"
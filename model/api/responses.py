@@ -0,0 +1,60 @@
+"""
+Response classes for prediction results.
+
+JSON is encoded with orjson when it is installed (several times faster than the
+standard library for float-heavy payloads). Clients that send
+``Accept: application/msgpack`` get a compact binary MessagePack body instead.
+Both libraries are optional; without them the API falls back to plain JSON.
+"""
+
+import json
+from typing import Any
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # optional dependency
+    msgpack = None
+
+MSGPACK_MEDIA_TYPE = "application/msgpack"
+
+
+def encode_json(content: Any) -> bytes:
+    """Compact JSON bytes, with orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":")).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse that uses orjson when available"""
+
+    def render(self, content: Any) -> bytes:
+        return encode_json(content)
+
+
+class MsgpackResponse(Response):
+    """MessagePack-encoded response for bandwidth-constrained clients"""
+
+    media_type = MSGPACK_MEDIA_TYPE
+
+    def render(self, content: Any) -> bytes:
+        return msgpack.packb(content, use_bin_type=True)
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True if the client asked for MessagePack and it can be produced"""
+    return msgpack is not None and MSGPACK_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def encode_response(content: Any, request: Request) -> Response:
+    """Pick the response encoding from the request's Accept header"""
+    if wants_msgpack(request):
+        return MsgpackResponse(content=content)
+    return FastJSONResponse(content=content)
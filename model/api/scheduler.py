@@ -0,0 +1,310 @@
+"""
+Admission control and fair scheduling in front of the inference workers.
+
+Every prediction goes through an ``InferenceScheduler``:
+
+- requests carry a priority class (``interactive`` for the mobile app,
+  ``bulk`` for backlog uploads) and a client id. The client is the remote
+  address; a request may only lower its priority with ``X-Priority``. Callers
+  with a key from ``VERDSCAN_TRUSTED_KEYS`` (``X-API-Key``), such as a gateway
+  forwarding app traffic, may also raise it and name sub-clients with
+  ``X-Client-ID``
+- each client has a token bucket per priority class, charged one token per
+  image of the job; empty buckets are answered with 429 before the upload is
+  even decoded
+- admitted jobs wait in a weighted fair queue (self-clocked fair queueing):
+  every (class, client) flow gets a share proportional to its class weight, so
+  a bulk flood cannot starve interactive requests or other bulk clients
+- a fixed number of workers run jobs in a thread pool; a job whose deadline
+  passed while it was queued is shed instead of run
+- queue wait per class, shed and rejected counts are exported at ``/metrics``
+"""
+
+import os
+import hmac
+import time
+import heapq
+import asyncio
+import itertools
+from typing import Callable, Dict, Tuple
+from fastapi import HTTPException, Request
+
+PRIORITIES = ("interactive", "bulk")
+
+# WFQ weights: an interactive image costs 1/8 of the virtual time of a bulk one
+CLASS_WEIGHTS = {
+    "interactive": float(os.environ.get("VERDSCAN_INTERACTIVE_WEIGHT", "8")),
+    "bulk": float(os.environ.get("VERDSCAN_BULK_WEIGHT", "1")),
+}
+
+# Token bucket per client and class: (requests per second, burst)
+RATE_LIMITS = {
+    "interactive": (float(os.environ.get("VERDSCAN_INTERACTIVE_RATE", "5")),
+                    float(os.environ.get("VERDSCAN_INTERACTIVE_BURST", "10"))),
+    "bulk": (float(os.environ.get("VERDSCAN_BULK_RATE", "20")),
+             float(os.environ.get("VERDSCAN_BULK_BURST", "40"))),
+}
+
+# Default time budget when the client sends no X-Deadline-Ms header
+DEFAULT_DEADLINES_MS = {
+    "interactive": float(os.environ.get("VERDSCAN_INTERACTIVE_DEADLINE_MS", "10000")),
+    "bulk": float(os.environ.get("VERDSCAN_BULK_DEADLINE_MS", "120000")),
+}
+
+# Callers allowed to choose their priority and client ids: "gateway=<key>,loadtest=<key>"
+TRUSTED_KEYS = {
+    name.strip(): key.strip()
+    for name, _, key in (entry.partition("=") for entry in os.environ.get("VERDSCAN_TRUSTED_KEYS", "").split(","))
+    if name.strip() and key.strip()
+}
+
+MAX_QUEUED_JOBS = int(os.environ.get("VERDSCAN_MAX_QUEUED_JOBS", "256"))
+INFERENCE_WORKERS = int(os.environ.get("VERDSCAN_INFERENCE_WORKERS", "2"))
+MAX_TRACKED_CLIENTS = 10000
+
+# Upper bounds (seconds) of the queue wait histogram buckets
+WAIT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at ``rate`` tokens per second"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self, now: float, cost: float = 1.0) -> bool:
+        """Take ``cost`` tokens; a job bigger than the burst needs a full bucket and leaves it in debt"""
+        self.refill(now)
+        if self.tokens >= min(cost, self.burst):
+            self.charge(now, cost)
+            return True
+        return False
+
+    def charge(self, now: float, cost: float):
+        """Take tokens unconditionally; the debt is capped at one burst, so a client waits at most 2 * burst / rate"""
+        self.refill(now)
+        self.tokens = max(-self.burst, self.tokens - cost)
+
+    def retry_after(self, cost: float = 1.0) -> float:
+        """Seconds until ``cost`` tokens are available"""
+        return max(0.0, (min(cost, self.burst) - self.tokens) / self.rate)
+
+
+class Ticket:
+    """Admission decision for one request"""
+
+    def __init__(self, priority: str, client_id: str, deadline: float):
+        self.priority = priority
+        self.client_id = client_id
+        self.deadline = deadline
+        self.enqueued_at = None
+
+
+def identify_client(request: Request) -> Tuple[str, bool]:
+    """(client id, trusted) from the API key if one is sent, otherwise from the remote address"""
+    api_key = request.headers.get("x-api-key")
+    if api_key is not None:
+        for name, key in TRUSTED_KEYS.items():
+            if hmac.compare_digest(api_key, key):
+                sub_client = request.headers.get("x-client-id")
+                return (f"{name}/{sub_client}" if sub_client else name), True
+        raise HTTPException(status_code=401, detail="Unknown API key")
+    # Behind a proxy, run uvicorn with --forwarded-allow-ips so this is the real client
+    return (request.client.host if request.client else "unknown"), False
+
+
+class ClassMetrics:
+    """Counters and queue wait histogram for one priority class"""
+
+    def __init__(self):
+        self.admitted = 0
+        self.rate_limited = 0
+        self.queue_full = 0
+        self.shed = 0
+        self.completed = 0
+        self.wait_count = 0
+        self.wait_sum = 0.0
+        self.wait_buckets = [0] * len(WAIT_BUCKETS)
+
+    def observe_wait(self, seconds: float):
+        self.wait_count += 1
+        self.wait_sum += seconds
+        for i, bound in enumerate(WAIT_BUCKETS):
+            if seconds <= bound:
+                self.wait_buckets[i] += 1
+
+
+class InferenceScheduler:
+    """Weighted fair queue with token-bucket admission in front of a worker pool"""
+
+    def __init__(self, workers: int = INFERENCE_WORKERS):
+        self.workers = workers
+        self.queue = []
+        self.sequence = itertools.count()
+        self.virtual_time = 0.0
+        self.flow_finish: Dict[tuple, float] = {}
+        self.buckets: Dict[tuple, TokenBucket] = {}
+        self.metrics = {priority: ClassMetrics() for priority in PRIORITIES}
+        self.available = None
+        self.tasks = []
+
+    def start(self):
+        """Start the worker tasks on the running event loop"""
+        self.available = asyncio.Condition()
+        self.tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def admit(self, request: Request, default_priority: str = "interactive", cost: float = 1.0) -> Ticket:
+        """Classify a request and charge ``cost`` tokens (one per image) to its client's bucket, or raise 429"""
+        client_id, trusted = identify_client(request)
+        requested = request.headers.get("x-priority")
+        if requested is not None and requested.lower() not in PRIORITIES:
+            raise HTTPException(status_code=400, detail=f"X-Priority must be one of {', '.join(PRIORITIES)}")
+        if trusted:
+            priority = requested.lower() if requested else default_priority
+        else:
+            # Anyone may step down to bulk; only trusted callers may step up
+            priority = "bulk" if requested and requested.lower() == "bulk" else default_priority
+
+        deadline_ms = request.headers.get("x-deadline-ms")
+        try:
+            budget_ms = float(deadline_ms) if deadline_ms else DEFAULT_DEADLINES_MS[priority]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="X-Deadline-Ms must be a number")
+        if not trusted:
+            budget_ms = min(budget_ms, DEFAULT_DEADLINES_MS[priority])
+
+        now = time.monotonic()
+        bucket = self._bucket(priority, client_id)
+        if not bucket.try_acquire(now, cost):
+            self.metrics[priority].rate_limited += 1
+            raise HTTPException(
+                status_code=429,
+                detail=f"Rate limit exceeded for {priority} requests",
+                headers={"Retry-After": str(max(1, round(bucket.retry_after(cost))))}
+            )
+
+        self.metrics[priority].admitted += 1
+        return Ticket(priority, client_id, now + budget_ms / 1000)
+
+    def charge(self, ticket: Ticket, cost: float):
+        """Charge an admitted request for images it turned out to need (e.g. tiles)
+
+        The extra images are bulk-sized work and go to the client's bulk
+        bucket, so one tiled photo does not lock its interactive requests out.
+        """
+        if cost > 0:
+            self._bucket("bulk", ticket.client_id).charge(time.monotonic(), cost)
+
+    async def submit(self, ticket: Ticket, func: Callable, *args, cost: float = 1.0, **kwargs):
+        """Queue ``func(*args, **kwargs)`` and wait for a worker to run it"""
+        if len(self.queue) >= MAX_QUEUED_JOBS:
+            self.metrics[ticket.priority].queue_full += 1
+            raise HTTPException(status_code=503, detail="Inference queue is full", headers={"Retry-After": "1"})
+
+        # Self-clocked fair queueing: finish tag = start tag + cost / weight
+        flow = (ticket.priority, ticket.client_id)
+        start_tag = max(self.virtual_time, self.flow_finish.get(flow, 0.0))
+        finish_tag = start_tag + cost / CLASS_WEIGHTS[ticket.priority]
+        self.flow_finish[flow] = finish_tag
+
+        future = asyncio.get_running_loop().create_future()
+        ticket.enqueued_at = time.monotonic()
+        async with self.available:
+            heapq.heappush(self.queue, (finish_tag, next(self.sequence), ticket, func, args, kwargs, future))
+            self.available.notify()
+        return await future
+
+    def _bucket(self, priority: str, client_id: str) -> TokenBucket:
+        key = (priority, client_id)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= MAX_TRACKED_CLIENTS:
+                self._forget_idle_clients()
+            bucket = self.buckets[key] = TokenBucket(*RATE_LIMITS[priority])
+        return bucket
+
+    def _forget_idle_clients(self):
+        """Drop full buckets and finished flows; they carry no state worth keeping"""
+        now = time.monotonic()
+        for key, bucket in list(self.buckets.items()):
+            bucket.refill(now)
+            if bucket.tokens >= bucket.burst:
+                del self.buckets[key]
+        for flow, finish_tag in list(self.flow_finish.items()):
+            if finish_tag <= self.virtual_time:
+                del self.flow_finish[flow]
+
+    async def _worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self.available:
+                while not self.queue:
+                    await self.available.wait()
+                finish_tag, _, ticket, func, args, kwargs, future = heapq.heappop(self.queue)
+            self.virtual_time = finish_tag
+
+            if future.cancelled():
+                continue
+
+            now = time.monotonic()
+            metrics = self.metrics[ticket.priority]
+            metrics.observe_wait(now - ticket.enqueued_at)
+            if now > ticket.deadline:
+                metrics.shed += 1
+                future.set_exception(HTTPException(status_code=504, detail="Deadline exceeded before inference started"))
+                continue
+
+            try:
+                result = await loop.run_in_executor(None, lambda: func(*args, **kwargs))
+                metrics.completed += 1
+                if not future.cancelled():
+                    future.set_result(result)
+            except Exception as e:
+                if not future.cancelled():
+                    future.set_exception(e)
+
+    def queue_depths(self) -> Dict[str, int]:
+        depths = {priority: 0 for priority in PRIORITIES}
+        for entry in self.queue:
+            depths[entry[2].priority] += 1
+        return depths
+
+    def prometheus_metrics(self) -> str:
+        """Metrics in the Prometheus text exposition format"""
+        lines = []
+        depths = self.queue_depths()
+        counters = ("admitted", "rate_limited", "queue_full", "shed", "completed")
+
+        lines.append("# TYPE verdscan_queue_depth gauge")
+        for priority in PRIORITIES:
+            lines.append(f'verdscan_queue_depth{{priority="{priority}"}} {depths[priority]}')
+
+        for counter in counters:
+            lines.append(f"# TYPE verdscan_requests_{counter}_total counter")
+            for priority in PRIORITIES:
+                value = getattr(self.metrics[priority], counter)
+                lines.append(f'verdscan_requests_{counter}_total{{priority="{priority}"}} {value}')
+
+        lines.append("# TYPE verdscan_queue_wait_seconds histogram")
+        for priority in PRIORITIES:
+            metrics = self.metrics[priority]
+            for bound, count in zip(WAIT_BUCKETS, metrics.wait_buckets):
+                lines.append(f'verdscan_queue_wait_seconds_bucket{{priority="{priority}",le="{bound}"}} {count}')
+            lines.append(f'verdscan_queue_wait_seconds_bucket{{priority="{priority}",le="+Inf"}} {metrics.wait_count}')
+            lines.append(f'verdscan_queue_wait_seconds_sum{{priority="{priority}"}} {metrics.wait_sum:.6f}')
+            lines.append(f'verdscan_queue_wait_seconds_count{{priority="{priority}"}} {metrics.wait_count}')
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,282 @@
+"""
+Shared-memory batch ring between decode processes and the inference engine.
+
+Decoding and resizing in separate processes gets them out of the GIL, but
+sending each preprocessed image back through a ``multiprocessing.Queue``
+pickles it (a 224x224x3 float32 array is ~600 KB), copies it through a pipe,
+unpickles it and copies it once more into the batch.
+
+Here one ``multiprocessing.shared_memory`` block is split into preallocated
+batch slots, each with one region per model input (the cascade's fast model
+and the full model can differ in size). The engine acquires a free slot and
+sends the decode processes only the encoded upload and the slot/row to fill;
+they write the preprocessed pixels straight into the shared rows and answer
+with a few bytes. The engine then predicts on NumPy views of the slot, with no
+copy, and releases it.
+
+Every use of a slot has a generation number. When a decode hangs or its process
+dies, the slot's generation is bumped and the process still working on it is
+replaced; stale tasks and replies of the old generation are ignored, so the
+slot goes straight back to the pool. For the prediction log the decode
+processes also hash each image (and JPEG-encode it when images are stored).
+
+Enable it with ``VERDSCAN_DECODE_PROCESSES=<n>``. ``benchmark_shared_batches.py``
+compares it with pickled queues.
+"""
+
+import io
+import os
+import time
+import queue
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from fastapi import HTTPException
+from upload import decode_checked, retained_size
+from prediction_log import IMAGE_QUALITY, image_hash
+
+DECODE_PROCESSES = int(os.environ.get("VERDSCAN_DECODE_PROCESSES", "0"))
+SHARED_BATCH_SIZE = int(os.environ.get("VERDSCAN_SHARED_BATCH_SIZE", "32"))
+DECODE_TIMEOUT_SECONDS = 30.0
+SLOT_WAIT_SECONDS = 10.0
+ALIGNMENT = 64
+
+# (height, width, dtype, rescale): how one model wants its input
+InputSpec = Tuple[int, int, str, float]
+
+
+def input_spec(signature: Dict) -> InputSpec:
+    """The preprocessing a model signature describes, in a form that pickles cheaply"""
+    height, width = signature["input_size"]
+    return height, width, signature["input_dtype"], float(signature["rescale"])
+
+
+def region_bytes(spec: InputSpec, capacity: int) -> int:
+    """Bytes of one slot region holding ``capacity`` images, padded to the alignment"""
+    height, width, dtype, _ = spec
+    size = capacity * height * width * 3 * np.dtype(dtype).itemsize
+    return -(-size // ALIGNMENT) * ALIGNMENT
+
+
+def slot_views(buffer, slot_bytes: int, slot: int, specs: Dict[str, InputSpec],
+               capacity: int, count: int) -> Dict[str, np.ndarray]:
+    """(count, height, width, 3) arrays over a slot's regions, laid out one after another"""
+    views = {}
+    offset = slot * slot_bytes
+    for name, spec in specs.items():
+        height, width, dtype, _ = spec
+        views[name] = np.ndarray((count, height, width, 3), dtype=dtype, buffer=buffer, offset=offset)
+        offset += region_bytes(spec, capacity)
+    return views
+
+
+def _fill_row(memory, slot_bytes: int, capacity: int, slot: int, row: int, specs: Dict[str, InputSpec], data: bytes,
+              log: Optional[str]) -> Tuple[Optional[str], Optional[bytes]]:
+    """Decode one upload and write it, preprocessed for every model input, into its shared row
+
+    Returns the image's prediction-log hash (``log`` "hash" or "jpeg") and its
+    JPEG for storage ("jpeg"), so the server never needs the decoded pixels.
+    """
+    # Shrunk like read_image_upload, so hashes match the in-process path
+    image = decode_checked(data, retained_size([spec[:2] for spec in specs.values()]))
+    digest, jpeg = None, None
+    if log:
+        digest = image_hash(image)
+    if log == "jpeg":
+        buffer = io.BytesIO()
+        image.save(buffer, format="JPEG", quality=IMAGE_QUALITY)
+        jpeg = buffer.getvalue()
+    views = slot_views(memory.buf, slot_bytes, slot, specs, capacity, capacity)
+    # Same resize and scaling as prepare_batch in main.py, written in place
+    for name, (height, width, dtype, rescale) in specs.items():
+        target = views[name][row]
+        target[...] = np.asarray(image.resize((width, height)))
+        if rescale != 1.0:
+            target *= np.array(rescale, dtype=target.dtype)
+    return digest, jpeg
+
+
+def _decode_worker(index: int, memory_name: str, slot_bytes: int, capacity: int, tasks, done_queues,
+                   generations, busy):
+    """Decode process: fill shared rows and report (generation, row, error, hash, jpeg) per task
+
+    ``busy[2 * index:2 * index + 2]`` holds the slot and generation being
+    filled, so the server can replace this process if that use is abandoned.
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, generation, row, specs, data, log = task
+            with generations.get_lock():
+                if generations[slot] != generation:
+                    # The request gave up on this slot; nobody reads the row any more
+                    continue
+                busy[2 * index], busy[2 * index + 1] = slot, generation
+            try:
+                reply = (generation, row, None, *_fill_row(memory, slot_bytes, capacity, slot, row, specs, data, log))
+            except HTTPException as e:
+                reply = (generation, row, (e.status_code, e.detail), None, None)
+            except Exception as e:
+                reply = (generation, row, (400, f"Image preprocessing failed: {str(e)}"), None, None)
+            finally:
+                with generations.get_lock():
+                    busy[2 * index] = -1
+            done_queues[slot].put(reply)
+    finally:
+        memory.close()
+
+
+class DecodePool:
+    """Decode processes filling batch slots of one shared-memory block"""
+
+    def __init__(self, processes: int, slots: int, slot_bytes: int, capacity: int = SHARED_BATCH_SIZE):
+        self.processes = processes
+        self.slots = slots
+        self.slot_bytes = slot_bytes
+        self.capacity = capacity
+        # Spawned rather than forked: the server process holds TensorFlow's threads
+        self.context = multiprocessing.get_context("spawn")
+        self.memory = None
+        self.tasks = None
+        self.done_queues = []
+        self.free_slots = queue.Queue()
+        self.workers = []
+        # Current generation of every slot, and the (slot, generation) each process is filling
+        self.generations = self.context.Array("q", slots)
+        self.busy = self.context.Array("q", [-1] * (2 * processes), lock=False)
+        self.workers_lock = threading.Lock()
+        self.lost = set()
+
+    def start(self):
+        self.memory = shared_memory.SharedMemory(create=True, size=self.slots * self.slot_bytes)
+        self.tasks = self.context.Queue()
+        self.done_queues = [self.context.Queue() for _ in range(self.slots)]
+        for slot in range(self.slots):
+            self.free_slots.put(slot)
+        self.workers = [self._spawn(i) for i in range(self.processes)]
+        print(f"🧵 {self.processes} decode processes, {self.slots} shared batch slots of "
+              f"{self.capacity} images ({self.slots * self.slot_bytes / 1024 / 1024:.0f} MB)")
+
+    def _spawn(self, index: int):
+        worker = self.context.Process(target=_decode_worker, name=f"decode-{index}", daemon=True,
+                                      args=(index, self.memory.name, self.slot_bytes, self.capacity, self.tasks,
+                                            self.done_queues, self.generations, self.busy))
+        worker.start()
+        return worker
+
+    def _respawn_dead(self):
+        """Replace exited decode processes, remembering the slot uses they took down with them"""
+        with self.workers_lock:
+            for index, worker in enumerate(self.workers):
+                if worker.is_alive():
+                    continue
+                with self.generations.get_lock():
+                    if self.busy[2 * index] != -1:
+                        self.lost.add((self.busy[2 * index], self.busy[2 * index + 1]))
+                    self.busy[2 * index] = -1
+                print(f"⚠️  Decode process {worker.name} exited with code {worker.exitcode}; restarting it")
+                self.workers[index] = self._spawn(index)
+
+    def _abandon(self, slot: int):
+        """Give up on the slot's current use so it can go back to the pool
+
+        Queued tasks of the old generation are skipped; processes still filling
+        it are replaced, so nothing writes into the slot after it is reused.
+        """
+        with self.workers_lock:
+            with self.generations.get_lock():
+                generation = self.generations[slot]
+                self.generations[slot] = generation + 1
+                stuck = [index for index in range(len(self.workers))
+                         if (self.busy[2 * index], self.busy[2 * index + 1]) == (slot, generation)]
+                for index in stuck:
+                    self.busy[2 * index] = -1
+            self.lost.discard((slot, generation))
+            for index in stuck:
+                worker = self.workers[index]
+                worker.terminate()
+                worker.join(timeout=5)
+                print(f"⚠️  Decode process {worker.name} was stuck on an image; restarting it")
+                self.workers[index] = self._spawn(index)
+
+    def stop(self):
+        for _ in self.workers:
+            self.tasks.put(None)
+        for worker in self.workers:
+            worker.join(timeout=5)
+            if worker.is_alive():
+                worker.terminate()
+        self.workers = []
+        if self.memory is not None:
+            self.memory.unlink()
+            try:
+                self.memory.close()
+            except BufferError:
+                # A view is still referenced somewhere; the mapping goes with the process
+                pass
+            self.memory = None
+
+    @contextmanager
+    def decode(self, encoded: List[bytes], specs: Dict[str, InputSpec], log: Optional[str] = None):
+        """Decode up to ``capacity`` uploads into a free slot and yield (views, logged)
+
+        ``logged`` has a (hash, jpeg) pair per upload for the prediction log:
+        hashes with ``log="hash"``, hashes and JPEGs with ``log="jpeg"``. The
+        views are only valid inside the ``with`` block; the slot is reused as
+        soon as it exits.
+        """
+        if len(encoded) > self.capacity:
+            raise ValueError(f"At most {self.capacity} images fit in a shared batch slot")
+        try:
+            slot = self.free_slots.get(timeout=SLOT_WAIT_SECONDS)
+        except queue.Empty:
+            raise HTTPException(status_code=503, detail="Image decoding is busy, try again later",
+                                headers={"Retry-After": "1"})
+        try:
+            self._respawn_dead()
+            generation = self.generations[slot]
+            for row, data in enumerate(encoded):
+                self.tasks.put((slot, generation, row, specs, data, log))
+
+            errors = []
+            logged = [(None, None)] * len(encoded)
+            remaining = len(encoded)
+            deadline = time.monotonic() + DECODE_TIMEOUT_SECONDS
+            while remaining:
+                try:
+                    reply = self.done_queues[slot].get(timeout=min(1.0, max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    self._respawn_dead()
+                    if (slot, generation) in self.lost:
+                        self._abandon(slot)
+                        raise HTTPException(status_code=500, detail="Image decoding crashed")
+                    if time.monotonic() >= deadline:
+                        self._abandon(slot)
+                        raise HTTPException(status_code=500, detail="Image decoding timed out")
+                    continue
+                reply_generation, row, error, digest, jpeg = reply
+                if reply_generation != generation:
+                    # Late answer to an earlier, abandoned use of this slot
+                    continue
+                remaining -= 1
+                if error is not None:
+                    errors.append((row, error))
+                logged[row] = (digest, jpeg)
+            if errors:
+                # Report the first failing upload, as the in-process path does
+                status_code, detail = min(errors)[1]
+                raise HTTPException(status_code=status_code, detail=detail)
+
+            views = slot_views(self.memory.buf, self.slot_bytes, slot, specs, self.capacity, len(encoded))
+            try:
+                yield views, logged
+            finally:
+                views.clear()
+        finally:
+            self.free_slots.put(slot)
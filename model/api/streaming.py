@@ -0,0 +1,208 @@
+"""
+Persistent WebSocket stream for high-volume clients.
+
+Partner integrations and bulk scoring jobs send thousands of images. Over the
+REST endpoints every image pays for an HTTP request, multipart parsing and a
+JSON body. On ``/stream/{crop}`` a client opens one WebSocket and pipelines
+binary frames; it does not wait for an answer before sending the next image.
+
+Request frame (binary): ``<u32 request id><u8 kind><payload>``, little-endian
+
+- kind 0: an encoded image file (JPEG, PNG, ...), decoded and resized like uploads
+- kind 1: raw uint8 RGB pixels at the model's input size (see ``/models/{crop}/spec``)
+
+Response frame, sent when the image's batch is done (so possibly out of order):
+
+- ``format=binary`` (default): ``<u32 request id><u16 status>``, then for status
+  200 ``<u8 stage (0 full, 1 fast)><u16 predicted class><f32 probability> * classes``
+  in the class order of the spec, otherwise the UTF-8 error detail
+- ``format=json``: a text frame with the usual result plus ``id`` (or ``id``,
+  ``status`` and ``detail``)
+
+Frames are gathered into micro-batches (up to ``VERDSCAN_STREAM_BATCH_SIZE``,
+waiting at most ``VERDSCAN_STREAM_LINGER_MS`` for more). A connection has at most
+``VERDSCAN_STREAM_MAX_BATCHES`` batches queued or running; meanwhile new frames
+wait, so batches grow with the load. They go through the same
+scheduler and ``predict_images`` as ``/detect/{crop}/batch``, as bulk traffic
+unless a trusted caller's ``X-Priority`` says otherwise, and each image costs a
+rate-limit token. Rate limits and a full queue slow the stream down instead of
+failing it, for at most ``VERDSCAN_STREAM_MAX_WAIT_SECONDS`` per batch; after that
+its frames are answered with the 429 or 503. At most ``VERDSCAN_STREAM_MAX_IN_FLIGHT``
+images per connection are unanswered; past that the server stops reading and
+TCP pushes back on the client.
+"""
+
+import os
+import struct
+import asyncio
+from typing import Callable, List, Tuple
+import numpy as np
+from fastapi import HTTPException, WebSocket
+from upload import MAX_UPLOAD_BYTES
+from responses import encode_json
+
+STREAM_BATCH_SIZE = int(os.environ.get("VERDSCAN_STREAM_BATCH_SIZE", "32"))
+STREAM_LINGER_MS = float(os.environ.get("VERDSCAN_STREAM_LINGER_MS", "5"))
+STREAM_MAX_IN_FLIGHT = int(os.environ.get("VERDSCAN_STREAM_MAX_IN_FLIGHT", "256"))
+STREAM_MAX_BATCHES = int(os.environ.get("VERDSCAN_STREAM_MAX_BATCHES", "2"))
+STREAM_MAX_WAIT_SECONDS = float(os.environ.get("VERDSCAN_STREAM_MAX_WAIT_SECONDS", "30"))
+
+KIND_ENCODED = 0
+KIND_RAW = 1
+
+FRAME_HEADER = struct.Struct("<IB")
+RESULT_HEADER = struct.Struct("<IH")
+PREDICTION_HEADER = struct.Struct("<BH")
+STAGE_CODES = {"full": 0, "fast": 1}
+
+# Queued by the reader when the client disconnects
+_END = object()
+
+
+def parse_frame(data: bytes) -> Tuple[int, int, bytes]:
+    """(request id, kind, payload) of a request frame"""
+    if len(data) < FRAME_HEADER.size:
+        raise HTTPException(status_code=400, detail="Frame is shorter than its header")
+    request_id, kind = FRAME_HEADER.unpack_from(data)
+    if kind not in (KIND_ENCODED, KIND_RAW):
+        raise HTTPException(status_code=400, detail=f"Unknown frame kind {kind}")
+    if len(data) - FRAME_HEADER.size > MAX_UPLOAD_BYTES:
+        raise HTTPException(status_code=413, detail=f"Frame exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit")
+    return request_id, kind, data[FRAME_HEADER.size:]
+
+
+class ResultEncoder:
+    """Turns per-frame outcomes into response frames in the connection's format"""
+
+    def __init__(self, class_names: List[str], binary: bool = True):
+        self.class_names = class_names
+        self.class_index = {name: i for i, name in enumerate(class_names)}
+        self.binary = binary
+
+    def encode(self, request_id: int, status: int, content) -> bytes:
+        if self.binary:
+            if status != 200:
+                return RESULT_HEADER.pack(request_id, status) + str(content).encode("utf-8")
+            probabilities = np.array([content["all_probabilities"][name] for name in self.class_names], dtype="<f4")
+            return (RESULT_HEADER.pack(request_id, status)
+                    + PREDICTION_HEADER.pack(STAGE_CODES.get(content.get("stage"), 0), self.class_index[content["predicted_disease"]])
+                    + probabilities.tobytes())
+
+        message = {"id": request_id, **content} if status == 200 else {"id": request_id, "status": status, "detail": content}
+        return encode_json(message)
+
+
+async def _admit_and_submit(scheduler, websocket: WebSocket, func: Callable, frames: List, cost: float,
+                            max_wait: float = STREAM_MAX_WAIT_SECONDS):
+    """Run one micro-batch through the scheduler, waiting out rate limits and a full queue for up to ``max_wait`` s"""
+    loop = asyncio.get_running_loop()
+    give_up = loop.time() + max_wait
+    while True:
+        try:
+            ticket = scheduler.admit(websocket, default_priority="bulk", cost=cost)
+            return await scheduler.submit(ticket, func, frames, cost=cost)
+        except HTTPException as e:
+            if e.status_code not in (429, 503):
+                raise
+            delay = float((e.headers or {}).get("Retry-After", "1"))
+            if loop.time() + delay > give_up:
+                # Still limited when the wait is up: the frames get the 429/503 instead
+                raise
+            await asyncio.sleep(delay)
+
+
+async def serve_stream(websocket: WebSocket, scheduler, predict_frames: Callable, encoder: ResultEncoder,
+                       batch_size: int = STREAM_BATCH_SIZE, linger_ms: float = STREAM_LINGER_MS,
+                       max_in_flight: int = STREAM_MAX_IN_FLIGHT, max_batches: int = STREAM_MAX_BATCHES):
+    """Read frames, predict them in micro-batches and answer each one until the client disconnects
+
+    ``predict_frames`` gets a list of (kind, payload) and returns one
+    (status, result or error detail) per frame; it runs on a scheduler worker.
+    """
+    await websocket.accept()
+    frames: asyncio.Queue = asyncio.Queue()
+    in_flight = asyncio.Semaphore(max_in_flight)
+    batch_slots = asyncio.Semaphore(max_batches)
+    send_lock = asyncio.Lock()
+    batches = set()
+
+    async def send(request_id: int, status: int, content):
+        message = encoder.encode(request_id, status, content)
+        async with send_lock:
+            if encoder.binary:
+                await websocket.send_bytes(message)
+            else:
+                await websocket.send_text(message.decode("utf-8"))
+        in_flight.release()
+
+    async def reader():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                await in_flight.acquire()
+                await frames.put(message.get("bytes"))
+        finally:
+            await frames.put(_END)
+
+    async def run_batch(batch: List[Tuple[int, int, bytes]]):
+        try:
+            outcomes = await _admit_and_submit(scheduler, websocket, predict_frames,
+                                               [(kind, payload) for _, kind, payload in batch], cost=len(batch))
+        except HTTPException as e:
+            outcomes = [(e.status_code, e.detail)] * len(batch)
+        except Exception as e:
+            outcomes = [(500, f"Prediction failed: {str(e)}")] * len(batch)
+        finally:
+            batch_slots.release()
+        for (request_id, _, _), (status, content) in zip(batch, outcomes):
+            await send(request_id, status, content)
+
+    reading = asyncio.create_task(reader())
+    try:
+        done = False
+        while not done:
+            data = await frames.get()
+            if data is _END:
+                break
+            # While this connection's batches are busy, frames pile up and the next batch grows
+            await batch_slots.acquire()
+            pending = [data]
+            # Linger briefly so frames that are already on their way join this batch
+            deadline = asyncio.get_running_loop().time() + linger_ms / 1000
+            while len(pending) < batch_size:
+                timeout = deadline - asyncio.get_running_loop().time()
+                try:
+                    data = frames.get_nowait() if timeout <= 0 else await asyncio.wait_for(frames.get(), timeout)
+                except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                    break
+                if data is _END:
+                    done = True
+                    break
+                pending.append(data)
+
+            batch = []
+            for data in pending:
+                try:
+                    if data is None:
+                        raise HTTPException(status_code=400, detail="Frames must be binary")
+                    batch.append(parse_frame(data))
+                except HTTPException as e:
+                    # Without a readable header the answer goes to request id 0
+                    request_id = FRAME_HEADER.unpack_from(data)[0] if data and len(data) >= FRAME_HEADER.size else 0
+                    await send(request_id, e.status_code, e.detail)
+            if batch:
+                task = asyncio.create_task(run_batch(batch))
+                batches.add(task)
+                task.add_done_callback(batches.discard)
+            else:
+                batch_slots.release()
+
+        # Answer everything already received before closing
+        if batches:
+            await asyncio.gather(*batches, return_exceptions=True)
+    finally:
+        reading.cancel()
+        for task in batches:
+            task.cancel()
@@ -2,7 +2,11 @@ import requests
 import json
 from PIL import Image
 import io
+import struct
+import zlib
+import threading
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
 
 def create_test_image():
     """Create a simple test image for testing"""
@@ -17,6 +21,126 @@ def create_test_image():
     
     return img_bytes
 
+def create_large_test_image(megabytes=20):
+    """Create a noise PNG of roughly the given size (noise does not compress)"""
+    side = int((megabytes * 1024 * 1024 / 3) ** 0.5)
+    img_array = np.random.randint(0, 255, (side, side, 3), dtype=np.uint8)
+    img_bytes = io.BytesIO()
+    Image.fromarray(img_array).save(img_bytes, format='PNG', compress_level=0)
+    return img_bytes.getvalue()
+
+def create_oversized_header_image(width=30000, height=30000):
+    """Create a tiny PNG whose header claims huge dimensions"""
+    def chunk(chunk_type, data):
+        return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+    
+    header = chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+    return b"\x89PNG\r\n\x1a\n" + header + chunk(b"IDAT", zlib.compress(b"\0" * 100000))
+
+def post_upload(url, data, content_type='image/png'):
+    """POST a file and return the status code (413 if the server closed the connection mid-upload)"""
+    try:
+        files = {'file': ('upload.png', data, content_type)}
+        return requests.post(url, files=files).status_code
+    except requests.exceptions.ConnectionError:
+        return 413
+
+def post_chunked_upload(url, data, content_type='image/png', chunk_size=1024 * 1024):
+    """POST a multipart file with chunked transfer encoding, so no Content-Length is sent"""
+    boundary = "verdscanboundary"
+    prefix = (f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"upload.png\"\r\n"
+              f"Content-Type: {content_type}\r\n\r\n").encode()
+    suffix = f"\r\n--{boundary}--\r\n".encode()
+    
+    def body():
+        yield prefix
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+        yield suffix
+    
+    try:
+        headers = {'Content-Type': f'multipart/form-data; boundary={boundary}'}
+        return requests.post(url, data=body(), headers=headers).status_code
+    except requests.exceptions.ConnectionError:
+        return 413
+
+def sample_rss(base_url, stop, samples, interval=0.05):
+    """Poll the server's current RSS from /health until ``stop`` is set"""
+    while not stop.is_set():
+        rss = requests.get(f"{base_url}/health").json().get("rss_mb")
+        if rss is not None:
+            samples.append(rss)
+        stop.wait(interval)
+
+def test_upload_limits(crop='cassava', concurrent_uploads=8):
+    """Check that oversized and malformed uploads are rejected and accepted large ones keep memory bounded"""
+    base_url = "http://localhost:8000"
+    url = f"{base_url}/detect/{crop}"
+    
+    print("\n🧪 Testing upload limits...")
+    print("=" * 50)
+    
+
+    # Test 1: concurrent 20 MB uploads are refused
+    print(f"\n1️⃣ Sending {concurrent_uploads} concurrent 20 MB uploads...")
+    large_image = create_large_test_image(20)
+    with ThreadPoolExecutor(max_workers=concurrent_uploads) as executor:
+        statuses = list(executor.map(lambda _: post_upload(url, large_image), range(concurrent_uploads)))
+    if all(status == 413 for status in statuses):
+        print("✅ All large uploads rejected with 413")
+    else:
+        print(f"❌ Unexpected status codes: {statuses}")
+    
+    # Test 1b: without a Content-Length the limit is enforced while the body is received
+    print(f"\n1️⃣b Sending {concurrent_uploads} concurrent chunked 20 MB uploads...")
+    with ThreadPoolExecutor(max_workers=concurrent_uploads) as executor:
+        statuses = list(executor.map(lambda _: post_chunked_upload(url, large_image), range(concurrent_uploads)))
+    if all(status == 413 for status in statuses):
+        print("✅ All chunked uploads rejected with 413 while streaming")
+    else:
+        print(f"❌ Unexpected status codes: {statuses}")
+    
+    # Test 1c: large uploads under the limit are accepted with bounded memory. Reading
+    # each one fully and decoding them all at once would hold about 2 x 8 MB per upload.
+    # A first round warms up the server's thread pools and allocator; the second is measured.
+    print(f"\n1️⃣c Sending 2 x {concurrent_uploads} concurrent 8 MB uploads under the limit, half of them chunked...")
+    accepted_image = create_large_test_image(8)
+    
+    def upload_round():
+        with ThreadPoolExecutor(max_workers=concurrent_uploads) as executor:
+            return list(executor.map(lambda i: (post_chunked_upload if i % 2 else post_upload)(url, accepted_image),
+                                     range(concurrent_uploads)))
+    
+    statuses = upload_round()
+    rss_before = requests.get(f"{base_url}/health").json().get("rss_mb")
+    stop, samples = threading.Event(), []
+    sampler = threading.Thread(target=sample_rss, args=(base_url, stop, samples))
+    sampler.start()
+    statuses += upload_round()
+    stop.set()
+    sampler.join()
+    if all(status == 200 for status in statuses):
+        print("✅ All large uploads under the limit accepted")
+    else:
+        print(f"❌ Unexpected status codes: {statuses}")
+    if rss_before is None or not samples:
+        print("ℹ️  Server does not report its current RSS; memory not checked")
+    else:
+        growth = max(samples) - rss_before
+        budget = 2 * 8 * concurrent_uploads / 2
+        print(f"{'✅' if growth < budget else '❌'} Server RSS grew by at most {growth:.1f} MB "
+              f"while they were processed (budget {budget:.0f} MB, {len(samples)} samples)")
+    
+    # Test 2: a small file claiming huge dimensions is rejected from its header
+    print("\n2️⃣ Sending an image header claiming 30000x30000 pixels...")
+    status = post_upload(url, create_oversized_header_image())
+    print(f"{'✅' if status == 413 else '❌'} Oversized dimensions: {status}")
+    
+    # Test 3: a non-image with an image content type is rejected by sniffing
+    print("\n3️⃣ Sending a text file labelled image/jpeg...")
+    status = post_upload(url, b"definitely not an image" * 100, 'image/jpeg')
+    print(f"{'✅' if status == 415 else '❌'} Non-image upload: {status}")
+
 def test_api_endpoints():
     """Test all API endpoints"""
     base_url = "http://localhost:8000"
@@ -110,5 +234,146 @@ def test_api_endpoints():
     print("\n" + "=" * 50)
     print("🎯 API testing completed!")
 
+def test_tiled_inference(crop='cassava'):
+    """Check tiled inference on a large photo with one small lesion-coloured patch"""
+    base_url = "http://localhost:8000"
+    
+    print("\n🧪 Testing tiled inference...")
+    print("=" * 50)
+    
+    img_array = np.full((1500, 2000, 3), (40, 140, 40), dtype=np.uint8)
+    img_array[600:700, 900:1000] = (120, 80, 20)
+    img_bytes = io.BytesIO()
+    Image.fromarray(img_array).save(img_bytes, format='JPEG')
+    
+    files = {'file': ('field_photo.jpg', img_bytes.getvalue(), 'image/jpeg')}
+    response = requests.post(f"{base_url}/detect/{crop}/tiled?scales=1.0,0.5", files=files)
+    if response.status_code != 200:
+        print(f"❌ Tiled detection failed: {response.status_code}")
+        print(f"   Error: {response.text}")
+        return
+    
+    result = response.json()
+    tiles = result['tiles']
+    grids = [(grid['scale'], grid['rows'], grid['cols']) for grid in tiles['heat_maps']]
+    if tiles['count'] == sum(rows * cols for _, rows, cols in grids):
+        print(f"✅ Tiled detection passed: {tiles['count']} tiles, grids (scale, rows, cols) {grids}")
+    else:
+        print(f"❌ Tile count {tiles['count']} does not match heat map grids {grids}")
+    print(f"   Predicted: {result['predicted_disease']} ({result['confidence']:.3f})")
+    
+    response = requests.post(f"{base_url}/detect/{crop}/tiled?scales=2", files=files)
+    if response.status_code == 400:
+        print("✅ Invalid scales rejected with 400")
+    else:
+        print(f"❌ Invalid scales returned {response.status_code}")
+
+def test_query_validation(crop='cassava'):
+    """Check that out-of-range top_k / min_probability are rejected with 400"""
+    base_url = "http://localhost:8000"
+    
+    print("\n🧪 Testing query parameter validation...")
+    print("=" * 50)
+    
+    files = {'file': ('test_leaf.png', create_test_image().getvalue(), 'image/png')}
+    for query in ("top_k=0", "top_k=-5", "top_k=2&min_probability=1.5", "min_probability=0.2"):
+        status = requests.post(f"{base_url}/detect/{crop}?{query}", files=files).status_code
+        print(f"{'✅' if status == 400 else '❌'} {query}: {status}")
+    
+    result = requests.post(f"{base_url}/detect/{crop}?top_k=2&min_probability=0", files=files).json()
+    print(f"{'✅' if len(result.get('top_k', [])) == 2 else '❌'} top_k=2: {result.get('top_k')}")
+
+def test_compact_uploads(crop='cassava'):
+    """Check that on-device resized uploads (raw and small JPEG) match the full-photo path"""
+    base_url = "http://localhost:8000"
+    
+    print("\n🧪 Testing compact uploads...")
+    print("=" * 50)
+    
+    response = requests.get(f"{base_url}/models/{crop}/spec")
+    if response.status_code != 200:
+        print(f"❌ Model spec failed: {response.status_code}")
+        return
+    spec = response.json()
+    height, width = spec['input']['height'], spec['input']['width']
+    print(f"✅ Model spec: {width}x{height} {spec['input']['color']}, {len(spec['class_names'])} classes")
+    
+    photo = Image.fromarray(np.random.randint(0, 255, (1200, 1600, 3), dtype=np.uint8))
+    photo_bytes = io.BytesIO()
+    photo.save(photo_bytes, format='JPEG', quality=92)
+    # Resize the decoded photo the way the server does (JPEG draft scale, then bicubic), as the app would on-device
+    decoded = Image.open(io.BytesIO(photo_bytes.getvalue()))
+    decoded.draft(None, (width, height))
+    resized = decoded.convert('RGB').resize((width, height))
+    compact_bytes = io.BytesIO()
+    resized.save(compact_bytes, format='JPEG', quality=spec['uploads']['jpeg']['quality'])
+    
+    full = requests.post(f"{base_url}/detect/{crop}",
+                         files={'file': ('photo.jpg', photo_bytes.getvalue(), 'image/jpeg')}).json()
+    raw_payload = np.asarray(resized).tobytes()
+    raw = requests.post(f"{base_url}/detect/{crop}/raw", data=raw_payload,
+                        headers={'Content-Type': 'application/octet-stream'}).json()
+    compact = requests.post(f"{base_url}/detect/{crop}/raw", data=compact_bytes.getvalue(),
+                            headers={'Content-Type': 'image/jpeg'}).json()
+    
+    print(f"   Bytes sent: full photo {len(photo_bytes.getvalue())}, raw {len(raw_payload)}, "
+          f"compact JPEG {len(compact_bytes.getvalue())}")
+    if raw['all_probabilities'] == full['all_probabilities']:
+        print("✅ Raw upload gives the same prediction as the full photo")
+    else:
+        print(f"❌ Raw upload differs: {raw['predicted_disease']} vs {full['predicted_disease']}")
+    print(f"   Compact JPEG: {compact['predicted_disease']} ({compact['confidence']:.3f}), "
+          f"full photo: {full['predicted_disease']} ({full['confidence']:.3f})")
+    
+    response = requests.post(f"{base_url}/detect/{crop}/raw", data=raw_payload[:-1],
+                             headers={'Content-Type': 'application/octet-stream'})
+    if response.status_code == 400:
+        print("✅ Truncated raw payload rejected with 400")
+    else:
+        print(f"❌ Truncated raw payload returned {response.status_code}")
+
+def test_similar_cases(crop='cassava'):
+    """Check similar-case retrieval and reference images (needs python case_index.py --crop <crop>)"""
+    base_url = "http://localhost:8000"
+    
+    print("\n🧪 Testing similar cases...")
+    print("=" * 50)
+    
+    if crop not in requests.get(f"{base_url}/health").json().get('similar_case_crops', []):
+        print(f"ℹ️  No similar-case index for {crop}; run python case_index.py --crop {crop}")
+        return
+    
+    img_bytes = io.BytesIO()
+    Image.fromarray(np.random.randint(0, 255, (224, 224, 3), dtype=np.uint8)).save(img_bytes, format='JPEG')
+    files = {'file': ('leaf.jpg', img_bytes.getvalue(), 'image/jpeg')}
+    response = requests.post(f"{base_url}/detect/{crop}?similar=5", files=files)
+    if response.status_code != 200:
+        print(f"❌ Detection with similar cases failed: {response.status_code}")
+        print(f"   Error: {response.text}")
+        return
+    
+    cases = response.json()['similar_cases']
+    similarities = [case['similarity'] for case in cases]
+    if len(cases) == 5 and similarities == sorted(similarities, reverse=True):
+        print(f"✅ {len(cases)} similar cases, best first: "
+              f"{[(case['label'], case['similarity']) for case in cases]}")
+    else:
+        print(f"❌ Unexpected similar cases: {cases}")
+    
+    response = requests.get(f"{base_url}/cases/{crop}/{cases[0]['case_id']}/image")
+    print(f"{'✅' if response.status_code in (200, 404) else '❌'} Reference image: {response.status_code} "
+          f"({len(response.content)} bytes)")
+    
+    response = requests.post(f"{base_url}/detect/{crop}?similar=0", files=files)
+    if response.status_code == 400:
+        print("✅ Invalid similar count rejected with 400")
+    else:
+        print(f"❌ Invalid similar count returned {response.status_code}")
+
 if __name__ == "__main__":
     test_api_endpoints()
+    test_upload_limits()
+    test_tiled_inference()
+    test_query_validation()
+    test_compact_uploads()
+    test_similar_cases()
@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+CPU thread tuning for inference workers
+=======================================
+
+TensorFlow sizes its intra-op pool to every core of the machine in each
+process, so N server workers start N x cores threads that fight over the same
+cores and caches. This module benchmarks the loaded crop models over
+combinations of worker processes x intra-op threads x predict batch size on the
+current machine, writes the best one to ``thread_tuning.json`` and applies it
+when a server worker starts.
+
+The benchmark replays the request sizes the server sees rather than fixed large
+batches: ``--request-mix`` weights single-image requests (``/detect``, the bulk
+of the traffic) against ``/batch`` uploads, each request is one
+``model.predict`` call as in ``main.py``, and latencies are per request. The
+batch size only splits requests bigger than it. Each benchmark process keeps
+``--inference-workers`` predicts in flight (default ``VERDSCAN_INFERENCE_WORKERS``),
+as the scheduler does in every server worker.
+
+
+- TensorFlow's intra-op and inter-op pools are sized from the file
+- each worker claims a worker slot (a lock file, so restarts reuse free slots)
+  and, with ``pin_cpus``, is pinned to its own CPU set; CPU sets take one
+  hardware thread per physical core before using SMT siblings, and keep a
+  worker's cores within one socket where possible
+- ``model.predict`` uses the tuned batch size
+
+    python thread_tuning.py                                   # default grid
+    python thread_tuning.py --workers 1 2 4 --intra-op 1 2 4 --batch-sizes 8 32
+    python thread_tuning.py --request-mix 1:0.7 16:0.2 64:0.1     # sizes seen in production
+    uvicorn main:app --workers <workers from the file>
+
+The server reads ``VERDSCAN_THREAD_TUNING`` (default ``thread_tuning.json``);
+``VERDSCAN_PIN_CPUS=0`` disables pinning whatever the file says.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import itertools
+import threading
+import platform
+import subprocess
+from typing import Dict, List, Optional
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+TUNING_FILE = os.environ.get("VERDSCAN_THREAD_TUNING", "thread_tuning.json")
+PIN_CPUS = os.environ.get("VERDSCAN_PIN_CPUS")
+
+# Kept open for the life of the worker; closing it would release the slot
+_slot_lock = None
+
+
+def available_cpus() -> List[int]:
+    """Logical CPUs this process may run on"""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _read_topology(cpu: int, name: str) -> int:
+    try:
+        with open(f"/sys/devices/system/cpu/cpu{cpu}/topology/{name}") as f:
+            return int(f.read())
+    except (OSError, ValueError):
+        return -1
+
+
+def cpu_order(cpus: Optional[List[int]] = None) -> List[int]:
+    """Logical CPUs ordered for handing out: socket by socket, one thread per core before siblings"""
+    cpus = available_cpus() if cpus is None else cpus
+    cores = {}
+    for cpu in cpus:
+        key = (_read_topology(cpu, "physical_package_id"), _read_topology(cpu, "core_id"))
+        cores.setdefault(key, []).append(cpu)
+
+    order = []
+    for thread in range(max(len(siblings) for siblings in cores.values())):
+        for key in sorted(cores):
+            if thread < len(cores[key]):
+                order.append(cores[key][thread])
+    return order
+
+
+def cpu_sets(workers: int, threads: int, cpus: Optional[List[int]] = None) -> List[List[int]]:
+    """Disjoint CPU sets of ``threads`` CPUs per worker, wrapping around when there are too few"""
+    order = cpu_order(cpus)
+    return [[order[(worker * threads + i) % len(order)] for i in range(threads)] for worker in range(workers)]
+
+
+def physical_cores(cpus: Optional[List[int]] = None) -> int:
+    cpus = available_cpus() if cpus is None else cpus
+    return len({(_read_topology(cpu, "physical_package_id"), _read_topology(cpu, "core_id")) for cpu in cpus})
+
+
+def load_tuning(path: str = TUNING_FILE) -> Optional[Dict]:
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def claim_worker_slot(workers: int, lock_dir: str) -> Optional[int]:
+    """Index of a free worker slot, held until this process exits; None when all are taken"""
+    global _slot_lock
+    if fcntl is None:
+        return 0
+    os.makedirs(lock_dir, exist_ok=True)
+    for index in range(workers):
+        handle = open(os.path.join(lock_dir, f"worker-{index}.lock"), "w")
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            continue
+        _slot_lock = handle
+        return index
+    return None
+
+
+def configure_threads(intra_op_threads: int, inter_op_threads: int, cpus: Optional[List[int]] = None):
+    """Size TensorFlow's pools and optionally pin the process; must run before TensorFlow executes anything"""
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(intra_op_threads)
+    tf.config.threading.set_inter_op_parallelism_threads(inter_op_threads)
+    if cpus and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cpus)
+
+
+def apply_tuning(path: str = TUNING_FILE) -> Optional[Dict]:
+    """Apply a tuning file to this server worker; returns what was applied, or None without a file"""
+    tuning = load_tuning(path)
+    if tuning is None:
+        return None
+
+    pin = tuning.get("pin_cpus", False) if PIN_CPUS is None else PIN_CPUS == "1"
+    index = claim_worker_slot(tuning["workers"], os.path.join(os.path.dirname(os.path.abspath(path)), ".worker_slots"))
+    cpus = None
+    if index is None:
+        print(f"⚠️  More server workers than the {tuning['workers']} tuned for; this one is not pinned")
+    elif pin:
+        cpus = tuning["cpu_sets"][index] if index < len(tuning.get("cpu_sets", [])) else None
+
+    configure_threads(tuning["intra_op_threads"], tuning["inter_op_threads"], cpus)
+    applied = {
+        "worker_slot": index,
+        "workers": tuning["workers"],
+        "intra_op_threads": tuning["intra_op_threads"],
+        "inter_op_threads": tuning["inter_op_threads"],
+        "batch_size": tuning["batch_size"],
+        "cpus": cpus,
+    }
+    print(f"🧮 Thread tuning: worker slot {index}/{tuning['workers']}, {tuning['intra_op_threads']} intra-op / "
+          f"{tuning['inter_op_threads']} inter-op threads, batch {tuning['batch_size']}"
+          f"{f', pinned to CPUs {cpus}' if cpus else ''}")
+    return applied
+
+
+def parse_request_mix(entries: List[str]) -> List[tuple]:
+    """``size:weight`` strings into (images per request, share) pairs"""
+    mix = []
+    for entry in entries:
+        size, _, weight = entry.partition(":")
+        try:
+            mix.append((int(size), float(weight or 1)))
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"--request-mix entries look like 1:0.9, not {entry}")
+    if not mix or any(size < 1 or weight <= 0 for size, weight in mix):
+        raise argparse.ArgumentTypeError("--request-mix needs positive sizes and weights")
+    total = sum(weight for _, weight in mix)
+    return [(size, weight / total) for size, weight in mix]
+
+
+def request_sizes(mix: List[tuple], count: int = 100, seed: int = 0) -> List[int]:
+    """A shuffled sequence of request sizes in the mix's proportions"""
+    import numpy as np
+    sizes = [size for size, share in mix for _ in range(max(1, round(share * count)))]
+    np.random.default_rng(seed).shuffle(sizes)
+    return sizes
+
+
+def benchmark_worker(args):
+    """One benchmark process: load every crop model, wait for the go signal, serve the request mix for --duration seconds"""
+    cpus = json.loads(args.cpus) if args.cpus else None
+    configure_threads(args.intra_op_threads, args.inter_op_threads, cpus)
+
+    import numpy as np
+    import tensorflow as tf
+    import main
+
+    sizes = request_sizes(json.loads(args.request_mix))
+    batches = []
+    for crop_type, model_path in main.discover_model_paths().items():
+        signature = main.load_signature(model_path)
+        model = tf.keras.models.load_model(model_path)
+        height, width = signature["input_size"]
+        batch = np.random.default_rng(0).integers(0, 256, (max(sizes), height, width, 3)).astype(signature["input_dtype"])
+        if signature["rescale"] != 1.0:
+            batch *= np.array(signature["rescale"], dtype=batch.dtype)
+        # Warm up every request shape, as a running server would have
+        for size in set(sizes):
+            model.predict(batch[:size], batch_size=args.batch_size, verbose=0)
+        batches.append((model, batch))
+    if not batches:
+        sys.exit(f"No models found under {main.MODEL_DIR}")
+
+    print("ready", flush=True)
+    sys.stdin.readline()
+
+    latencies = []
+    images = [0]
+    lock = threading.Lock()
+    start = time.perf_counter()
+
+    def caller(offset: int):
+        # One predict call per request, the way predict_probabilities serves it
+        requests = zip(itertools.cycle(batches), itertools.islice(itertools.cycle(sizes), offset, None))
+        for (model, batch), size in requests:
+            began = time.perf_counter()
+            model.predict(batch[:size], batch_size=args.batch_size, verbose=0)
+            with lock:
+                latencies.append(time.perf_counter() - began)
+                images[0] += size
+            if began - start >= args.duration:
+                break
+
+    # The server runs INFERENCE_WORKERS predicts at once in every process, so the benchmark does too
+    callers = [threading.Thread(target=caller, args=(index * len(sizes) // args.inference_workers,))
+               for index in range(args.inference_workers)]
+    for thread in callers:
+        thread.start()
+    for thread in callers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    print(json.dumps({"images_per_second": images[0] / elapsed, "requests_per_second": len(latencies) / elapsed,
+                      "latencies": latencies}), flush=True)
+
+
+def _read_until(process, matches) -> Optional[str]:
+    """Next stdout line of a benchmark worker that matches, skipping anything else it prints"""
+    for line in process.stdout:
+        if matches(line.strip()):
+            return line.strip()
+    return None
+
+
+def run_combination(workers: int, threads: int, batch_size: int, args, pin: bool) -> Dict:
+    """Start ``workers`` benchmark processes together and combine their results"""
+    sets = cpu_sets(workers, threads)
+    processes = []
+    for index in range(workers):
+        command = [sys.executable, os.path.abspath(__file__), "--benchmark-worker",
+                   "--intra-op-threads", str(threads), "--inter-op-threads", str(args.inter_op_threads),
+                   "--batch-size", str(batch_size), "--duration", str(args.duration),
+                   "--inference-workers", str(args.inference_workers), "--request-mix", json.dumps(args.request_mix)]
+        if pin:
+            command += ["--cpus", json.dumps(sets[index])]
+        env = dict(os.environ, TF_CPP_MIN_LOG_LEVEL="3", CUDA_VISIBLE_DEVICES="")
+        processes.append(subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                          stderr=subprocess.DEVNULL, text=True, env=env))
+
+    # Start measuring only when every worker has its models loaded
+    for process in processes:
+        if _read_until(process, lambda line: line == "ready") is None:
+            sys.exit("❌ A benchmark worker failed to load the models")
+    for process in processes:
+        process.stdin.write("go\n")
+        process.stdin.flush()
+
+    throughput = 0.0
+    requests = 0
+    latencies = []
+    for process in processes:
+        line = _read_until(process, lambda line: line.startswith("{"))
+        process.wait()
+        if line is None:
+            sys.exit("❌ A benchmark worker failed")
+        result = json.loads(line)
+        throughput += result["images_per_second"]
+        requests += result["requests_per_second"]
+        latencies += result["latencies"]
+
+    latencies_ms = [latency * 1000 for latency in sorted(latencies)]
+    return {
+        "workers": workers,
+        "intra_op_threads": threads,
+        "batch_size": batch_size,
+        "images_per_second": round(throughput, 1),
+        "requests_per_second": round(requests, 1),
+        "p50_request_ms": round(latencies_ms[len(latencies_ms) // 2], 1),
+        "p99_request_ms": round(latencies_ms[min(len(latencies_ms) - 1, int(len(latencies_ms) * 0.99))], 1),
+        "cpu_sets": sets,
+    }
+
+
+def main():
+    from scheduler import INFERENCE_WORKERS
+    parser = argparse.ArgumentParser(description="Benchmark worker x thread x batch-size combinations and write the best.")
+    cpus = len(available_cpus())
+    parser.add_argument("--workers", type=int, nargs="+", help="Server worker processes to try (default: 1, 2, 4, ... up to the CPUs)")
+    parser.add_argument("--intra-op", type=int, nargs="+", help="Intra-op threads per worker to try (default: 1, 2, 4, ... up to the CPUs)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[8, 32],
+                        help="model.predict batch sizes to try; only requests with more images are split")
+    parser.add_argument("--request-mix", type=str, nargs="+", default=["1:0.9", "32:0.1"],
+                        help="Images per request and share of requests, e.g. 1:0.9 32:0.1 (default: 90%% single images)")
+    parser.add_argument("--inter-op-threads", type=int, default=1)
+    parser.add_argument("--inference-workers", type=int, default=INFERENCE_WORKERS,
+                        help="Concurrent predict calls per worker, as VERDSCAN_INFERENCE_WORKERS in the server (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds measured per combination")
+    parser.add_argument("--max-p99-ms", type=float, help="Only pick combinations whose p99 request latency is below this")
+    parser.add_argument("--no-pin", action="store_true", help="Do not pin workers to CPU sets")
+    parser.add_argument("--oversubscribe", action="store_true", help="Also try workers x threads above the CPU count")
+    parser.add_argument("--output", type=str, default=TUNING_FILE)
+    parser.add_argument("--benchmark-worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--intra-op-threads", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--batch-size", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--cpus", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.benchmark_worker:
+        args.request_mix = args.request_mix[0]
+        benchmark_worker(args)
+        return
+    try:
+        args.request_mix = parse_request_mix(args.request_mix)
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    powers = [2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus]
+    workers_options = args.workers or powers
+    thread_options = args.intra_op or powers
+    combinations = [(w, t, b) for w, t, b in itertools.product(workers_options, thread_options, args.batch_sizes)
+                    if args.oversubscribe or w * t <= cpus]
+    mix = ", ".join(f"{share:.0%} x {size}" for size, share in args.request_mix)
+    print(f"🖥️  {cpus} CPUs ({physical_cores()} physical cores); {len(combinations)} combinations x {args.duration:g}s; "
+          f"{args.inference_workers} concurrent requests per worker: {mix} images")
+
+    results = []
+    print(f"{'workers':>7} | {'intra-op':>8} | {'batch':>5} | {'images/s':>9} | {'requests/s':>10} | {'p50 ms':>8} | {'p99 ms':>8}")
+    print("-" * 73)
+    for workers, threads, batch_size in combinations:
+        result = run_combination(workers, threads, batch_size, args, pin=not args.no_pin)
+        results.append(result)
+        print(f"{workers:>7} | {threads:>8} | {batch_size:>5} | {result['images_per_second']:>9.1f} | "
+              f"{result['requests_per_second']:>10.1f} | {result['p50_request_ms']:>8.1f} | {result['p99_request_ms']:>8.1f}")
+
+    eligible = [r for r in results if args.max_p99_ms is None or r["p99_request_ms"] <= args.max_p99_ms]
+    if not eligible:
+        sys.exit(f"❌ No combination has a p99 below {args.max_p99_ms} ms")
+    best = max(eligible, key=lambda r: r["images_per_second"])
+
+    tuning = {
+        "workers": best["workers"],
+        "intra_op_threads": best["intra_op_threads"],
+        "inter_op_threads": args.inter_op_threads,
+        "batch_size": best["batch_size"],
+        "pin_cpus": not args.no_pin,
+        "inference_workers": args.inference_workers,
+        "request_mix": [[size, round(share, 4)] for size, share in args.request_mix],
+        "cpu_sets": best["cpu_sets"],
+        "machine": {"cpus": cpus, "physical_cores": physical_cores(), "hostname": platform.node()},
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(tuning, f, indent=2)
+
+    print(f"✅ Best: {best['workers']} workers x {best['intra_op_threads']} intra-op threads, batch {best['batch_size']} "
+          f"({best['images_per_second']:.1f} images/s); saved to {args.output}")
+    print(f"   Start the server with: uvicorn main:app --workers {best['workers']}")
+
+
+if __name__ == "__main__":
+    main()
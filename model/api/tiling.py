@@ -0,0 +1,129 @@
+"""
+Tiled inference for high-resolution field photos.
+
+Squashing a whole-plant photo into one 224x224 frame loses small lesions.
+In tiled mode the decoded image is cut into overlapping model-sized tiles,
+optionally at several scales, and all tiles go through the model as one batch.
+
+Tiles are taken from a ``sliding_window_view`` of the pixel array and gathered
+with a single fancy-indexing copy; no per-tile PIL crop is made. The only PIL
+work is one resize per scale.
+
+The overall prediction is pooled so that one diseased tile is enough to flag
+the plant: every disease gets its highest tile probability, ``healthy`` gets
+its lowest, and the result is renormalised. The per-tile disease probability
+is also returned as a coarse heat map per scale.
+"""
+
+import os
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from PIL import Image
+from postprocessing import LabelSet
+
+MAX_TILES = int(os.environ.get("VERDSCAN_MAX_TILES", "64"))
+DEFAULT_OVERLAP = 0.25
+MAX_SCALES = 4
+
+
+def tile_positions(length: int, tile: int, stride: int) -> np.ndarray:
+    """Tile start offsets along one axis; the last tile is flush with the edge"""
+    positions = np.arange(0, length - tile + 1, stride)
+    if positions[-1] != length - tile:
+        positions = np.append(positions, length - tile)
+    return positions
+
+
+def plan_tiles(image_size: Tuple[int, int], tile_size: Tuple[int, int], scales: Sequence[float],
+               overlap: float = DEFAULT_OVERLAP, max_tiles: int = MAX_TILES) -> List[Dict]:
+    """Work out the resized image and tile grid for every scale, within the tile budget
+
+    ``image_size`` is PIL's (width, height); ``tile_size`` is (height, width).
+    A scale whose grid would exceed its share of ``max_tiles`` is shrunk
+    further; no scale goes below the size at which the image covers one tile.
+    """
+    width, height = image_size
+    tile_height, tile_width = tile_size
+    stride_y = max(1, int(round(tile_height * (1 - overlap))))
+    stride_x = max(1, int(round(tile_width * (1 - overlap))))
+    budget = max(1, max_tiles // len(scales))
+
+    # Smallest scale at which the image still covers one whole tile
+    min_scale = max(tile_height / height, tile_width / width)
+
+    plans = []
+    for scale in scales:
+        effective = max(scale, min_scale)
+        while True:
+            scaled_height = max(tile_height, int(round(height * effective)))
+            scaled_width = max(tile_width, int(round(width * effective)))
+            ys = tile_positions(scaled_height, tile_height, stride_y)
+            xs = tile_positions(scaled_width, tile_width, stride_x)
+            if len(ys) * len(xs) <= budget or effective <= min_scale:
+                break
+            effective = max(min_scale, effective * 0.9 * (budget / (len(ys) * len(xs))) ** 0.5)
+
+        # Scales clamped to the same size would only repeat the same tiles
+        if any(plan["size"] == (scaled_width, scaled_height) for plan in plans):
+            continue
+        plans.append({
+            "scale": scale,
+            "effective_scale": round(min(scaled_width / width, scaled_height / height), 4),
+            "size": (scaled_width, scaled_height),
+            "ys": ys,
+            "xs": xs,
+        })
+    return plans
+
+
+def extract_tiles(pixels: np.ndarray, tile_size: Tuple[int, int], ys: np.ndarray, xs: np.ndarray) -> np.ndarray:
+    """Gather (len(ys) * len(xs), tile_h, tile_w, 3) tiles from an HWC array in one copy"""
+    # Zero-copy view of every possible window: (H - th + 1, W - tw + 1, C, th, tw)
+    windows = sliding_window_view(pixels, tile_size, axis=(0, 1))
+    windows = np.moveaxis(windows, 2, -1)
+    tiles = windows[np.ix_(ys, xs)]
+    return tiles.reshape((-1,) + tiles.shape[2:])
+
+
+def tile_batch(image: Image.Image, plans: List[Dict], tile_size: Tuple[int, int]) -> np.ndarray:
+    """uint8 batch with the tiles of every planned scale, in plan order"""
+    batches = []
+    for plan in plans:
+        scaled = image if plan["size"] == image.size else image.resize(plan["size"], Image.BILINEAR)
+        batches.append(extract_tiles(np.asarray(scaled), tile_size, plan["ys"], plan["xs"]))
+    return batches[0] if len(batches) == 1 else np.concatenate(batches)
+
+
+def pool_tile_probabilities(probabilities: np.ndarray, labels: LabelSet) -> np.ndarray:
+    """Combine (tiles, classes) probabilities into one (classes,) distribution"""
+    if labels.healthy_index < 0:
+        return probabilities.mean(axis=0)
+    pooled = probabilities.max(axis=0)
+    pooled[labels.healthy_index] = probabilities[:, labels.healthy_index].min()
+    return pooled / pooled.sum()
+
+
+def heat_maps(probabilities: np.ndarray, labels: LabelSet, plans: List[Dict]) -> List[Dict]:
+    """Per-scale grids of the tiles' disease probability and predicted class"""
+    if labels.healthy_index < 0:
+        disease = probabilities.max(axis=1)
+    else:
+        disease = 1.0 - probabilities[:, labels.healthy_index]
+    predicted = labels.array[probabilities.argmax(axis=1)]
+
+    maps = []
+    offset = 0
+    for plan in plans:
+        rows, cols = len(plan["ys"]), len(plan["xs"])
+        count = rows * cols
+        maps.append({
+            "scale": plan["scale"],
+            "effective_scale": plan["effective_scale"],
+            "rows": rows,
+            "cols": cols,
+            "disease_probability": np.round(disease[offset:offset + count].astype(np.float64), 3).reshape(rows, cols).tolist(),
+            "predicted_disease": predicted[offset:offset + count].reshape(rows, cols).tolist(),
+        })
+        offset += count
+    return maps
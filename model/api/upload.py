@@ -0,0 +1,258 @@
+"""
+Streaming image upload handling.
+
+Uploads are read in small chunks instead of being pulled into memory with
+``await file.read()``, and checked while they are read:
+
+- requests whose Content-Length already exceeds the limit are refused before
+  the multipart body is parsed; bodies without one (chunked uploads) are cut
+  off with a 413 as soon as the bytes received pass the limit, before the
+  multipart parser has spooled the rest (``UploadLimitMiddleware``)
+- the first bytes are sniffed and anything that is not a supported image
+  format is rejected without reading further
+- the total number of bytes read is capped while streaming
+- once the image header has been parsed, images whose dimensions exceed the
+  limit are rejected before any pixel data is decoded
+- only ``MAX_CONCURRENT_DECODES`` uploads are decoded at once, and each one is
+  shrunk to the model's input size before its decode slot is released (JPEGs
+  are decoded at a reduced scale with ``Image.draft`` to begin with). Full
+  resolution pixels therefore exist for at most that many images at a time;
+  what waits in the scheduler queue or a stream batch is model-sized. Tiled
+  inference, which needs the full resolution, cuts its tiles inside the slot
+
+Clients that resize on-device can instead send the model-sized pixels, raw or
+as a small JPEG (``raw_pixels`` / ``compact_jpeg_pixels``); those are never
+resized on the server.
+"""
+
+import io
+import os
+import asyncio
+import numpy as np
+from typing import Callable, Optional, Sequence, Tuple
+from fastapi import HTTPException, UploadFile
+from fastapi.responses import JSONResponse
+from PIL import Image
+
+# Limits, configurable through the environment
+MAX_UPLOAD_BYTES = int(os.environ.get("VERDSCAN_MAX_UPLOAD_MB", "10")) * 1024 * 1024
+MAX_IMAGE_DIMENSION = int(os.environ.get("VERDSCAN_MAX_IMAGE_DIMENSION", "8000"))
+MAX_IMAGE_PIXELS = int(os.environ.get("VERDSCAN_MAX_IMAGE_MEGAPIXELS", "16")) * 1000 * 1000
+MAX_CONCURRENT_DECODES = int(os.environ.get("VERDSCAN_MAX_CONCURRENT_DECODES", "2"))
+MAX_BATCH_REQUEST_BYTES = int(os.environ.get("VERDSCAN_MAX_BATCH_REQUEST_MB", "64")) * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+
+# Quality advertised for compact (pre-resized) JPEG uploads; any quality is accepted
+COMPACT_JPEG_QUALITY = 85
+
+# Room for the multipart boundaries and headers around the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+# Leading bytes of the image formats the API accepts
+IMAGE_SIGNATURES = {
+    b"\xff\xd8\xff": "JPEG",
+    b"\x89PNG\r\n\x1a\n": "PNG",
+    b"GIF87a": "GIF",
+    b"GIF89a": "GIF",
+    b"BM": "BMP",
+    b"II*\x00": "TIFF",
+    b"MM\x00*": "TIFF",
+}
+SNIFF_BYTES = 12
+
+decode_slots = asyncio.Semaphore(MAX_CONCURRENT_DECODES)
+
+
+def sniff_image_format(header: bytes):
+    """Return the image format for the first bytes of a file, or None"""
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "WEBP"
+    for magic, image_format in IMAGE_SIGNATURES.items():
+        if header.startswith(magic):
+            return image_format
+    return None
+
+
+def check_dimensions(width: int, height: int):
+    """Reject images that would be too expensive to decode"""
+    if width > MAX_IMAGE_DIMENSION or height > MAX_IMAGE_DIMENSION:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image is {width}x{height}; the maximum is {MAX_IMAGE_DIMENSION} pixels per side"
+        )
+    if width * height > MAX_IMAGE_PIXELS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Image has {width * height} pixels; the maximum is {MAX_IMAGE_PIXELS}"
+        )
+
+
+def retained_size(input_sizes: Sequence[Sequence[int]]) -> Tuple[int, int]:
+    """PIL (width, height) to keep a decoded image at: the largest of the models' (height, width) inputs"""
+    return max(width for _, width in input_sizes), max(height for height, _ in input_sizes)
+
+
+def shrink_image(image: Image.Image, size: Optional[Tuple[int, int]]) -> Image.Image:
+    """Resize an image larger than ``size`` to it, as ``prepare_batch`` would; smaller ones are kept"""
+    if size is None or (image.width <= size[0] and image.height <= size[1]):
+        return image
+    return image.resize(size)
+
+
+async def read_image_upload(file: UploadFile, size: Optional[Tuple[int, int]] = None,
+                            prepare: Optional[Callable] = None):
+    """Stream an uploaded file into an RGB PIL image of at most ``size``, enforcing size limits
+
+    Without ``size`` the image keeps its full resolution; ``prepare`` then
+    gets it while the decode slot is still held and its result is returned
+    instead, so the full-size pixels never outlive the slot.
+    """
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+    async with decode_slots:
+        image = decode_checked(await read_encoded_upload(file), size)
+        return prepare(image) if prepare is not None else image
+
+
+async def read_encoded_upload(file: UploadFile) -> bytes:
+    """Stream an upload into memory still encoded, for decoding in another process
+
+    The byte limit and format sniffing apply while reading; the dimension
+    check happens in ``decode_checked`` once the header is parsed. Encoded
+    uploads are at most ``MAX_UPLOAD_BYTES``.
+    """
+    if not file.content_type or not file.content_type.startswith('image/'):
+        raise HTTPException(status_code=400, detail="File must be an image")
+
+    chunks = []
+    total_bytes = 0
+    while True:
+        chunk = await file.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        total_bytes += len(chunk)
+        if total_bytes > MAX_UPLOAD_BYTES:
+            raise HTTPException(
+                status_code=413,
+                detail=f"File exceeds the {MAX_UPLOAD_BYTES // (1024 * 1024)} MB upload limit"
+            )
+        if not chunks and sniff_image_format(chunk[:SNIFF_BYTES]) is None:
+            raise HTTPException(status_code=415, detail="Unsupported or invalid image format")
+        chunks.append(chunk)
+
+    if not chunks:
+        raise HTTPException(status_code=415, detail="Unsupported or invalid image format")
+    return b"".join(chunks)
+
+
+def decode_checked(data: bytes, size: Optional[Tuple[int, int]] = None) -> Image.Image:
+    """Decode encoded image bytes into RGB, refusing oversized images before the pixels are read
+
+    With ``size`` the result is shrunk to it (see ``shrink_image``); JPEGs are
+    decoded straight at the smallest DCT scale that still covers it.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        check_dimensions(*image.size)
+        if size is not None:
+            image.draft(None, size)
+        image.load()
+    except HTTPException:
+        raise
+    except Image.DecompressionBombError as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except Image.UnidentifiedImageError:
+        raise HTTPException(status_code=400, detail="Image preprocessing failed: cannot parse this image")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Image preprocessing failed: {str(e)}")
+
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    return shrink_image(image, size)
+
+
+async def read_request_body(request, limit: int) -> bytes:
+    """Stream a non-multipart request body into memory, refusing it once it exceeds ``limit`` bytes"""
+    chunks = []
+    total_bytes = 0
+    async for chunk in request.stream():
+        total_bytes += len(chunk)
+        if total_bytes > limit:
+            raise HTTPException(status_code=413, detail=f"Request body exceeds {limit} bytes")
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def raw_pixels(data: bytes, height: int, width: int) -> np.ndarray:
+    """(1, height, width, 3) uint8 view of a raw RGB buffer; no copy is made"""
+    if len(data) != height * width * 3:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Raw payload must be {height * width * 3} bytes ({height}x{width}x3 uint8 RGB), got {len(data)}"
+        )
+    return np.frombuffer(data, dtype=np.uint8).reshape(1, height, width, 3)
+
+
+def compact_jpeg_pixels(data: bytes, height: int, width: int) -> np.ndarray:
+    """(1, height, width, 3) uint8 pixels of a JPEG already at the model's input size; never resized"""
+    if sniff_image_format(data[:SNIFF_BYTES]) != "JPEG":
+        raise HTTPException(status_code=415, detail="Compact payload must be a JPEG")
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.size != (width, height):
+            raise HTTPException(
+                status_code=400,
+                detail=f"Compact JPEG must be {width}x{height}, got {image.size[0]}x{image.size[1]}"
+            )
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        return np.asarray(image)[np.newaxis]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Image preprocessing failed: {str(e)}")
+
+
+def request_limit(path: str) -> int:
+    """Largest request body accepted on a path, multipart overhead included"""
+    if path.endswith("/batch"):
+        return MAX_BATCH_REQUEST_BYTES
+    return MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD
+
+
+class UploadLimitMiddleware:
+    """ASGI middleware capping POST bodies: by Content-Length up front, by bytes received otherwise
+
+    The multipart parser spools a whole upload before the handler runs, so the
+    cap has to sit in front of it, on the ASGI ``receive`` channel.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST":
+            await self.app(scope, receive, send)
+            return
+
+        limit = request_limit(scope["path"])
+        detail = f"Request exceeds the {limit // (1024 * 1024)} MB upload limit"
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await JSONResponse(status_code=413, content={"detail": detail})(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    # Raised inside body parsing; the exception handlers turn it into the 413 response
+                    raise HTTPException(status_code=413, detail=detail)
+            return message
+
+        await self.app(scope, limited_receive, send)
@@ -48,7 +48,7 @@ if errorlevel 1 (
     echo ✓ All requirements installed successfully!
     echo.
     echo Installed packages:
-    pip list | findstr /i "tensorflow numpy pillow scikit-learn matplotlib seaborn opencv-python"
+    pip list | findstr /i "tensorflow numpy pillow scikit-learn matplotlib seaborn pandas opencv-python"
 )
 
 echo.
@@ -101,7 +101,7 @@ def install_requirements(python_exe=None):
         # Show installed packages
         print("\nInstalled packages:")
         packages = ['tensorflow', 'numpy', 'Pillow', 'scikit-learn', 
-                   'matplotlib', 'seaborn', 'opencv-python']
+                   'matplotlib', 'seaborn', 'pandas', 'opencv-python']
         
         for package in packages:
             try:
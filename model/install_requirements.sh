@@ -96,7 +96,7 @@ if $PIP_CMD install -r requirements.txt --verbose; then
     print_success "All requirements installed successfully!"
     echo
     echo "Installed packages:"
-    $PIP_CMD list | grep -E "(tensorflow|numpy|Pillow|scikit-learn|matplotlib|seaborn|opencv-python)"
+    $PIP_CMD list | grep -E "(tensorflow|numpy|Pillow|scikit-learn|matplotlib|seaborn|pandas|opencv-python)"
 else
     echo
     print_error "Failed to install some requirements"
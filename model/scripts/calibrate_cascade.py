@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+Cascade threshold calibration
+=============================
+
+Picks the confidence threshold for the API's two-stage (early-exit) inference.
+The cheap first-stage model (``{crop}_fast_model.h5``, e.g. trained with
+``--input-size 160 --alpha 0.5 --variant fast``) answers on its own when its top
+probability reaches the threshold; everything else is escalated to
+``{crop}_best_model.h5``.
+
+The threshold is the lowest one for which the cascade still reaches the target
+accuracy on the validation split, i.e. the one that lets the fast model answer
+as many requests as possible. It is stored in the fast model's signature and,
+if one exists, in the signature of its serving export.
+
+    python scripts/calibrate_cascade.py --crop cassava --max-accuracy-drop 0.005
+"""
+
+import time
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.preprocessing.image import ImageDataGenerator  # type: ignore
+from model_signature import read_signature, write_signature
+
+
+def predict_validation(model, signature, data_dir, batch_size):
+    """Run a model over the validation split using its own input spec"""
+    datagen = ImageDataGenerator(rescale=signature["rescale"], validation_split=0.2)
+    val_data = datagen.flow_from_directory(
+        data_dir,
+        target_size=tuple(signature["input_size"]),
+        batch_size=batch_size,
+        class_mode='categorical',
+        subset="validation",
+        shuffle=False
+    )
+    probabilities = model.predict(val_data, verbose=0)
+    return probabilities, val_data.classes
+
+
+def choose_threshold(fast_probs, full_probs, labels, target_accuracy):
+    """Return (threshold, cascade accuracy, fraction answered by the fast model)
+
+    Samples are sorted by fast-model confidence; accepting the k most confident
+    ones gives a cascade accuracy that can be computed for every k at once with
+    cumulative sums. The largest k that meets the target wins.
+    """
+    confidence = fast_probs.max(axis=1)
+    fast_correct = fast_probs.argmax(axis=1) == labels
+    full_correct = full_probs.argmax(axis=1) == labels
+
+    order = np.argsort(-confidence, kind="stable")
+    confidence = confidence[order]
+    fast_correct = fast_correct[order]
+    full_correct = full_correct[order]
+
+    n = len(labels)
+    # correct[k] = fast right on the first k samples + full model right on the rest
+    fast_cumsum = np.concatenate([[0], np.cumsum(fast_correct)])
+    full_suffix = np.concatenate([np.cumsum(full_correct[::-1])[::-1], [0]])
+    accuracy = (fast_cumsum + full_suffix) / n
+
+    # A threshold can only split between distinct confidence values
+    valid = np.ones(n + 1, dtype=bool)
+    valid[1:n] = confidence[:-1] > confidence[1:]
+    candidates = np.flatnonzero(valid & (accuracy >= target_accuracy))
+    k = int(candidates.max()) if len(candidates) else 0
+
+    if k == 0:
+        return None, float(accuracy[0]), 0.0
+    return float(confidence[k - 1]), float(accuracy[k]), k / n
+
+
+def time_single_image(model, signature, runs=20):
+    """Median latency of a batch-of-one prediction in milliseconds"""
+    height, width = signature["input_size"]
+    dummy = np.zeros((1, height, width, 3), dtype=signature["input_dtype"])
+    model.predict(dummy, verbose=0)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        model.predict(dummy, verbose=0)
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Calibrate the early-exit threshold of the inference cascade.")
+    parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type to calibrate.")
+    parser.add_argument("--target-accuracy", type=float, help="Minimum cascade accuracy on the validation split")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.005,
+                        help="Allowed drop below the full model's accuracy when --target-accuracy is not given (default: 0.005)")
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    data_dir = f"data/{args.crop}"
+    full_path = f"models/{args.crop}/{args.crop}_best_model.h5"
+    fast_path = f"models/{args.crop}/{args.crop}_fast_model.h5"
+
+    full_signature = read_signature(full_path)
+    fast_signature = read_signature(fast_path)
+    if full_signature is None or fast_signature is None:
+        raise SystemExit("❌ Both models need a signature file (see scripts/model_signature.py)")
+    if full_signature["class_names"] != fast_signature["class_names"]:
+        raise SystemExit("❌ Fast and full models were trained on different classes")
+
+    print(f"📥 Loading models for {args.crop}...")
+    full_model = tf.keras.models.load_model(full_path)
+    fast_model = tf.keras.models.load_model(fast_path)
+
+    print("🔍 Running both models over the validation split...")
+    full_probs, labels = predict_validation(full_model, full_signature, data_dir, args.batch_size)
+    fast_probs, _ = predict_validation(fast_model, fast_signature, data_dir, args.batch_size)
+
+    full_accuracy = float(np.mean(full_probs.argmax(axis=1) == labels))
+    fast_accuracy = float(np.mean(fast_probs.argmax(axis=1) == labels))
+    target = args.target_accuracy if args.target_accuracy is not None else full_accuracy - args.max_accuracy_drop
+
+    threshold, cascade_accuracy, fast_fraction = choose_threshold(fast_probs, full_probs, labels, target)
+
+    full_ms = time_single_image(full_model, full_signature)
+    fast_ms = time_single_image(fast_model, fast_signature)
+    expected_ms = fast_ms + (1 - fast_fraction) * full_ms
+
+    print(f"📊 Full model accuracy:  {full_accuracy:.4f} ({full_ms:.1f} ms/image)")
+    print(f"📊 Fast model accuracy:  {fast_accuracy:.4f} ({fast_ms:.1f} ms/image)")
+    print(f"🎯 Target accuracy:      {target:.4f}")
+
+    if threshold is None:
+        print("⚠️  No threshold meets the target; the cascade stays disabled for this crop")
+    else:
+        print(f"✅ Threshold {threshold:.4f}: cascade accuracy {cascade_accuracy:.4f}, "
+              f"{fast_fraction:.1%} answered by the fast model")
+        print(f"⚡ Expected latency {expected_ms:.1f} ms/image vs {full_ms:.1f} ms/image full-only")
+
+    fast_signature["cascade"] = {
+        "threshold": threshold,
+        "target_accuracy": target,
+        "validation_accuracy": cascade_accuracy,
+        "fast_fraction": fast_fraction,
+    }
+    write_signature(fast_path, fast_signature)
+    print(f"💾 Calibration saved to the signature of {fast_path}")
+
+    # Keep an existing serving export of the fast model in sync
+    export_path = f"models/{args.crop}/{args.crop}_fast_export.h5"
+    export_signature = read_signature(export_path)
+    if export_signature is not None:
+        export_signature["cascade"] = fast_signature["cascade"]
+        write_signature(export_path, export_signature)
+        print(f"💾 Calibration copied to the signature of {export_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""
+Distributed training scaling benchmark
+======================================
+
+Runs ``mobilenet_train.py --distributed`` with 1, 2 and 4 workers and reports
+throughput and scaling efficiency (throughput with N workers divided by N times
+the single-worker throughput).
+
+Workers are local processes standing in for nodes: each one gets its own
+``TF_CONFIG`` and the same fixed number of CPU threads in every run, so a
+worker looks like a node of the same size whatever the cluster size. The
+per-worker batch stays fixed (weak scaling), as in real multi-node training.
+
+    python scripts/distributed_benchmark.py --crop cassava
+    python scripts/distributed_benchmark.py --crop cassava --workers 1 2 4 --threads-per-worker 2
+
+On a real cluster, start the training script on every node with a TF_CONFIG
+listing all of them instead, e.g. for node 1 of 3:
+
+    TF_CONFIG='{"cluster": {"worker": ["node0:2222", "node1:2222", "node2:2222"]},
+                "task": {"type": "worker", "index": 1}}' \\
+        python scripts/mobilenet_train.py --crop cassava --distributed
+"""
+
+import os
+import sys
+import glob
+import json
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+
+def run_cluster(args, num_workers, result_dir):
+    """Start num_workers local training processes and return the chief's images/second"""
+    cluster = {"worker": [f"localhost:{args.base_port + i}" for i in range(num_workers)]}
+    throughput_file = os.path.join(result_dir, f"throughput_{num_workers}.json")
+    command = [
+        sys.executable, "scripts/mobilenet_train.py",
+        "--crop", args.crop,
+        "--distributed",
+        "--variant", "scaling_benchmark",
+        "--input-size", str(args.input_size),
+        "--epochs", str(args.epochs),
+        "--steps-per-epoch", str(args.steps_per_epoch),
+        "--batch-size", str(args.batch_size),
+        "--throughput-file", throughput_file,
+    ]
+
+    processes = []
+    for index in range(num_workers):
+        env = dict(os.environ)
+        env.update({
+            "TF_CONFIG": json.dumps({"cluster": cluster, "task": {"type": "worker", "index": index}}),
+            "TF_NUM_INTRAOP_THREADS": str(args.threads_per_worker),
+            "TF_NUM_INTEROP_THREADS": "2",
+            "OMP_NUM_THREADS": str(args.threads_per_worker),
+            "CUDA_VISIBLE_DEVICES": "",
+            "TF_CPP_MIN_LOG_LEVEL": "2",
+        })
+        log = open(os.path.join(result_dir, f"worker_{num_workers}_{index}.log"), "w")
+        processes.append((subprocess.Popen(command, env=env, stdout=log, stderr=subprocess.STDOUT), log))
+
+    failed = False
+    for process, log in processes:
+        failed |= process.wait() != 0
+        log.close()
+    if failed:
+        sys.exit(f"❌ A worker failed; see the logs in {result_dir}")
+
+    with open(throughput_file) as f:
+        epochs = json.load(f)["images_per_second"]
+    # The first epoch includes graph tracing and collective setup
+    return float(np.mean(epochs[1:] if len(epochs) > 1 else epochs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure data-parallel training scaling with local worker processes.")
+    parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type to train on.")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Cluster sizes to run (default: 1 2 4)")
+    parser.add_argument("--threads-per-worker", type=int, help="CPU threads per worker (default: cores / largest cluster)")
+    parser.add_argument("--input-size", type=int, default=224)
+    parser.add_argument("--batch-size", type=int, default=32, help="Batch size per worker (default: 32)")
+    parser.add_argument("--epochs", type=int, default=3)
+    parser.add_argument("--steps-per-epoch", type=int, default=20)
+    parser.add_argument("--base-port", type=int, default=23456)
+    args = parser.parse_args()
+
+    if args.threads_per_worker is None:
+        args.threads_per_worker = max(1, (os.cpu_count() or 1) // max(args.workers))
+
+    result_dir = tempfile.mkdtemp(prefix="scaling_benchmark_")
+    results = {}
+    for num_workers in sorted(args.workers):
+        print(f"🏃 {num_workers} worker(s) x {args.threads_per_worker} threads...")
+        results[num_workers] = run_cluster(args, num_workers, result_dir)
+        print(f"   {results[num_workers]:.1f} images/s")
+
+    single = results.get(1)
+    lines = [
+        "| Workers | Global batch | Images/s | Speed-up | Scaling efficiency |",
+        "|---------|--------------|----------|----------|--------------------|",
+    ]
+    for num_workers, throughput in results.items():
+        speedup = f"{throughput / single:.2f}x" if single else "-"
+        efficiency = f"{throughput / (num_workers * single):.1%}" if single else "-"
+        lines.append(f"| {num_workers} | {num_workers * args.batch_size} | {throughput:.1f} | {speedup} | {efficiency} |")
+    table = "\n".join(lines)
+    print(table)
+
+    report_path = f"models/{args.crop}/{args.crop}_scaling_benchmark.md"
+    with open(report_path, "w") as f:
+        f.write(f"{args.threads_per_worker} threads per worker, {args.input_size}px, "
+                f"{args.steps_per_epoch} steps x {args.epochs} epochs\n\n{table}\n")
+    print(f"✅ Results saved to {report_path} (worker logs in {result_dir})")
+
+    # Benchmark runs write throwaway models
+    for path in glob.glob(f"models/{args.crop}/{args.crop}_scaling_benchmark_*"):
+        os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
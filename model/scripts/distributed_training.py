@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+Data-parallel training across processes / nodes
+===============================================
+
+Helpers for ``mobilenet_train.py --distributed``. Every worker runs the same
+training script; the ``TF_CONFIG`` environment variable tells it the cluster
+and its own place in it. With ``MultiWorkerMirroredStrategy`` each worker keeps
+a full copy of the model, trains on its own shard of the images and gradients
+are all-reduced after every step.
+
+- input is sharded by file, so each worker decodes only its own images
+- the per-worker batch stays fixed; the global batch and the learning rate grow
+  with the number of workers (linear scaling rule)
+- only the chief (worker 0) writes checkpoints, the signature and results;
+  the other workers save to a scratch directory that is deleted afterwards
+
+The training loop uses ``strategy.run`` rather than ``model.fit``: Keras 3's
+``fit`` cannot feed a multi-worker strategy.
+"""
+
+import time
+import tensorflow as tf
+from mobilenet_distill import load_image
+
+
+def worker_role(resolver):
+    """(number of workers, this worker's index, is chief) from the TF_CONFIG cluster spec"""
+    cluster = resolver.cluster_spec()
+    if not cluster.jobs:
+        return 1, 0, True
+    chiefs = cluster.num_tasks("chief") if "chief" in cluster.jobs else 0
+    num_workers = chiefs + cluster.num_tasks("worker")
+    if resolver.task_type == "chief":
+        return num_workers, 0, True
+    # Without a dedicated chief, worker 0 takes that role
+    worker_index = chiefs + resolver.task_id
+    return num_workers, worker_index, worker_index == 0
+
+
+def make_training_dataset(samples, num_classes, img_size, global_batch_size, worker_index, num_workers, training):
+    """tf.data input for one worker; it reads only its own shard of the files"""
+    paths = [path for path, _ in samples]
+    labels = [label for _, label in samples]
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels)).shard(num_workers, worker_index)
+
+    def prepare(path, label):
+        if training:
+            # Shift / zoom via a random crop of a slightly larger image, then flips and brightness
+            image = load_image(path, (int(img_size[0] * 1.2), int(img_size[1] * 1.2)), 1.0)
+            image = tf.image.random_crop(image, tuple(img_size) + (3,))
+            image = tf.image.random_flip_left_right(image)
+            image = tf.image.random_flip_up_down(image)
+            image = tf.clip_by_value(image * tf.random.uniform([], 0.7, 1.3), 0.0, 255.0)
+        else:
+            image = load_image(path, img_size, 1.0)
+        return image / 255.0, tf.one_hot(label, num_classes)
+
+    if training:
+        dataset = dataset.shuffle(len(paths) // num_workers + 1, reshuffle_each_iteration=True)
+    dataset = dataset.map(prepare, num_parallel_calls=tf.data.AUTOTUNE)
+
+    # Shards are already split by file, so the strategy must not shard again.
+    # Repeating keeps every worker running the same number of steps.
+    options = tf.data.Options()
+    options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.OFF
+    return dataset.repeat().batch(global_batch_size).prefetch(tf.data.AUTOTUNE).with_options(options)
+
+
+def train_distributed(strategy, model, train_data, val_data, epochs, steps_per_epoch, validation_steps,
+                      global_batch_size, checkpoint_path, lr_patience=3, lr_factor=0.5):
+    """Train with strategy.run; returns (history dict with images/second per epoch, best weights)
+
+    Mirrors the callbacks of the single-process run: the model with the best
+    validation accuracy is saved to ``checkpoint_path`` and the learning rate is
+    halved when the validation loss stops improving.
+    """
+    with strategy.scope():
+        loss_fn = tf.keras.losses.CategoricalCrossentropy(reduction="none")
+        train_accuracy = tf.keras.metrics.CategoricalAccuracy()
+        val_accuracy = tf.keras.metrics.CategoricalAccuracy()
+        val_loss = tf.keras.metrics.Mean()
+    optimizer = model.optimizer
+
+    @tf.function
+    def train_step(iterator):
+        def step(images, labels):
+            with tf.GradientTape() as tape:
+                predictions = model(images, training=True)
+                loss = tf.nn.compute_average_loss(loss_fn(labels, predictions), global_batch_size=global_batch_size)
+            gradients = tape.gradient(loss, model.trainable_variables)
+            optimizer.apply_gradients(zip(gradients, model.trainable_variables))
+            train_accuracy.update_state(labels, predictions)
+            return loss
+        return strategy.reduce("SUM", strategy.run(step, args=next(iterator)), axis=None)
+
+    @tf.function
+    def val_step(iterator):
+        def step(images, labels):
+            predictions = model(images, training=False)
+            val_loss.update_state(loss_fn(labels, predictions))
+            val_accuracy.update_state(labels, predictions)
+        strategy.run(step, args=next(iterator))
+
+    train_iterator = iter(strategy.experimental_distribute_dataset(train_data))
+    val_iterator = iter(strategy.experimental_distribute_dataset(val_data))
+
+    history = {"loss": [], "accuracy": [], "val_loss": [], "val_accuracy": [], "images_per_second": []}
+    best_accuracy, best_loss, wait = -1.0, float("inf"), 0
+    best_weights = None
+    for epoch in range(epochs):
+        for metric in (train_accuracy, val_accuracy, val_loss):
+            metric.reset_state()
+
+        start = time.perf_counter()
+        total_loss = 0.0
+        for _ in range(steps_per_epoch):
+            total_loss += float(train_step(train_iterator))
+        images_per_second = steps_per_epoch * global_batch_size / (time.perf_counter() - start)
+
+        for _ in range(validation_steps):
+            val_step(val_iterator)
+
+        # Metric results are all-reduced, so every worker takes the same decisions below
+        epoch_val_accuracy = float(val_accuracy.result())
+        epoch_val_loss = float(val_loss.result())
+        history["loss"].append(total_loss / steps_per_epoch)
+        history["accuracy"].append(float(train_accuracy.result()))
+        history["val_loss"].append(epoch_val_loss)
+        history["val_accuracy"].append(epoch_val_accuracy)
+        history["images_per_second"].append(images_per_second)
+        print(f"Epoch {epoch + 1}/{epochs} - loss: {history['loss'][-1]:.4f} - accuracy: {history['accuracy'][-1]:.4f} - "
+              f"val_loss: {epoch_val_loss:.4f} - val_accuracy: {epoch_val_accuracy:.4f} - {images_per_second:.1f} images/s")
+
+        if epoch_val_accuracy > best_accuracy:
+            best_accuracy = epoch_val_accuracy
+            best_weights = model.get_weights()
+            model.save(checkpoint_path)
+
+        if epoch_val_loss < best_loss:
+            best_loss, wait = epoch_val_loss, 0
+        else:
+            wait += 1
+            if wait >= lr_patience:
+                learning_rate = float(optimizer.learning_rate) * lr_factor
+                optimizer.learning_rate.assign(learning_rate)
+                print(f"Reducing learning rate to {learning_rate:g}")
+                wait = 0
+
+    return history, best_weights
+
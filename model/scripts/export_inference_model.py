@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Inference model export
+======================
+
+Turns a trained ``{crop}_{variant}_model.h5`` into ``{crop}_{variant}_export.h5``,
+a graph tuned for serving:
+
+- the model takes raw uint8 RGB pixels; the 1/255 rescaling runs inside the
+  graph, so the API no longer builds a float32 copy of every image
+- every BatchNormalization that follows a Conv2D/DepthwiseConv2D is folded
+  into the convolution's kernel and bias
+- Dropout layers are removed
+
+After exporting, the script runs a parity check against the current serving
+path (float32 pixels / 255 fed to the original model) and fails if the
+probabilities differ by more than ``--tolerance``. The API picks up the
+exported model automatically when it exists.
+
+    python scripts/export_inference_model.py --crop cassava
+    python scripts/export_inference_model.py --crop cassava --variant fast
+"""
+
+import os
+import sys
+import random
+import argparse
+import numpy as np
+import tensorflow as tf
+from PIL import Image
+from model_signature import read_signature, write_signature
+
+CONV_TYPES = (tf.keras.layers.Conv2D, tf.keras.layers.DepthwiseConv2D)
+
+
+def producing_layer(tensor):
+    """The layer that produced a symbolic tensor"""
+    return tensor._keras_history[0]
+
+
+def find_foldable_pairs(model):
+    """Map BatchNormalization layer names to the convolution they can be folded into"""
+    pairs = {}
+    for layer in model.layers:
+        if not isinstance(layer, tf.keras.layers.BatchNormalization):
+            continue
+        if layer.axis not in (-1, 3, [3], [-1]):
+            continue
+        conv = producing_layer(layer.input)
+        if not isinstance(conv, CONV_TYPES) or conv.data_format != "channels_last":
+            continue
+        # The raw convolution output must not be used anywhere else
+        if len(conv._outbound_nodes) != 1:
+            continue
+        pairs[layer.name] = conv.name
+    return pairs
+
+
+def folded_conv_weights(conv, bn):
+    """Kernel and bias of a convolution with the following batch norm folded in"""
+    gamma = np.asarray(bn.gamma) if bn.scale else 1.0
+    beta = np.asarray(bn.beta) if bn.center else 0.0
+    mean = np.asarray(bn.moving_mean)
+    variance = np.asarray(bn.moving_variance)
+    scale = gamma / np.sqrt(variance + bn.epsilon)
+
+    weights = conv.get_weights()
+    kernel = weights[0]
+    bias = weights[1] if conv.use_bias else np.zeros_like(mean)
+
+    if isinstance(conv, tf.keras.layers.DepthwiseConv2D):
+        # Depthwise kernels are (h, w, in_channels, multiplier); output channel = in * multiplier + m
+        kernel = kernel * scale.reshape(kernel.shape[2], kernel.shape[3])
+    else:
+        kernel = kernel * scale
+
+    bias = (bias - mean) * scale + beta
+    return [kernel.astype(np.float32), bias.astype(np.float32)]
+
+
+def fold_batch_norms(model):
+    """Rebuild a functional model with conv + batch norm pairs merged into single convolutions
+
+    Layers are replayed in topological order. A folded batch norm is skipped
+    entirely: whatever consumed it is wired to the (re-weighted) convolution.
+    """
+    pairs = find_foldable_pairs(model)
+    folded_convs = {conv: bn for bn, conv in pairs.items()}
+    outputs_by_layer = {}
+
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.InputLayer):
+            outputs_by_layer[layer.name] = tf.keras.Input(shape=model.input_shape[1:], name=layer.name)
+            continue
+
+        sources = layer.input if isinstance(layer.input, list) else [layer.input]
+        inputs = [outputs_by_layer[producing_layer(tensor).name] for tensor in sources]
+        inputs = inputs if isinstance(layer.input, list) else inputs[0]
+
+        if layer.name in pairs:
+            # Scale and shift now live in the convolution
+            outputs_by_layer[layer.name] = inputs
+            continue
+
+        config = layer.get_config()
+        if layer.name in folded_convs:
+            config["use_bias"] = True
+            weights = folded_conv_weights(layer, model.get_layer(folded_convs[layer.name]))
+        else:
+            weights = layer.get_weights()
+
+        clone = layer.__class__.from_config(config)
+        outputs_by_layer[layer.name] = clone(inputs)
+        clone.set_weights(weights)
+
+    model_inputs = outputs_by_layer[producing_layer(model.input).name]
+    model_outputs = outputs_by_layer[producing_layer(model.output).name]
+    return tf.keras.Model(model_inputs, model_outputs, name=model.name), len(pairs)
+
+
+def build_inference_model(model, signature):
+    """uint8 input -> in-graph rescaling -> folded network without dropout"""
+    height, width = signature["input_size"]
+    inputs = tf.keras.Input(shape=(height, width, 3), dtype="uint8", name="image")
+    x = tf.keras.layers.Rescaling(signature["rescale"], name="rescale")(inputs)
+
+    folded_count = 0
+    dropped_count = 0
+    for layer in model.layers:
+        if isinstance(layer, tf.keras.layers.Dropout):
+            dropped_count += 1
+            continue
+        if isinstance(layer, tf.keras.Model):
+            folded_layer, count = fold_batch_norms(layer)
+            folded_count += count
+            x = folded_layer(x)
+        else:
+            clone = layer.__class__.from_config(layer.get_config())
+            x = clone(x)
+            clone.set_weights(layer.get_weights())
+
+    exported = tf.keras.Model(inputs, x, name=f"{model.name}_export")
+    return exported, folded_count, dropped_count
+
+
+def load_parity_images(data_dir, signature, count):
+    """Sample validation-style images the same way the API loads them, as uint8"""
+    height, width = signature["input_size"]
+    paths = []
+    if os.path.isdir(data_dir):
+        for root, _, files in os.walk(data_dir):
+            paths.extend(os.path.join(root, f) for f in files
+                         if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp')))
+
+    if not paths:
+        print("ℹ️  No training images found; using random pixels for the parity check")
+        return np.random.default_rng(0).integers(0, 256, (count, height, width, 3), dtype=np.uint8)
+
+    random.Random(0).shuffle(paths)
+    images = [
+        np.asarray(Image.open(path).convert("RGB").resize((width, height)), dtype=np.uint8)
+        for path in paths[:count]
+    ]
+    return np.stack(images)
+
+
+def check_parity(model, exported, images, rescale, tolerance):
+    """Compare the exported model on uint8 input against the float32 / 255 path"""
+    reference = model.predict(images.astype(np.float32) * np.float32(rescale), verbose=0)
+    candidate = exported.predict(images, verbose=0)
+    max_difference = float(np.max(np.abs(reference - candidate)))
+    agreement = float(np.mean(reference.argmax(axis=1) == candidate.argmax(axis=1)))
+    return max_difference, agreement, max_difference <= tolerance and agreement == 1.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a trained model for serving.")
+    parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type to export.")
+    parser.add_argument("--variant", type=str, default="best", help="Model variant to export: 'best' or 'fast' (default: best)")
+    parser.add_argument("--parity-samples", type=int, default=64, help="Images used for the parity check (default: 64)")
+    parser.add_argument("--tolerance", type=float, default=1e-4, help="Maximum allowed probability difference (default: 1e-4)")
+    args = parser.parse_args()
+
+    model_path = f"models/{args.crop}/{args.crop}_{args.variant}_model.h5"
+    export_path = f"models/{args.crop}/{args.crop}_{args.variant}_export.h5"
+
+    signature = read_signature(model_path)
+    if signature is None:
+        sys.exit(f"❌ No signature for {model_path} (see scripts/model_signature.py)")
+    if signature["input_dtype"] != "float32":
+        sys.exit(f"❌ {model_path} already takes {signature['input_dtype']} input")
+
+    print(f"📥 Loading {model_path}...")
+    model = tf.keras.models.load_model(model_path)
+
+    exported, folded_count, dropped_count = build_inference_model(model, signature)
+    print(f"🔧 Folded {folded_count} batch norms and removed {dropped_count} dropout layers")
+
+    images = load_parity_images(f"data/{args.crop}", signature, args.parity_samples)
+    max_difference, agreement, passed = check_parity(model, exported, images, signature["rescale"], args.tolerance)
+    print(f"🔍 Parity on {len(images)} images: max |Δp| = {max_difference:.2e}, top-1 agreement {agreement:.1%}")
+    if not passed:
+        sys.exit(f"❌ Exported model differs from the current serving path by more than {args.tolerance}")
+
+    exported.save(export_path)
+    export_signature = dict(signature)
+    export_signature.update({
+        "input_dtype": "uint8",
+        "rescale": 1.0,
+        "source_model": os.path.basename(model_path),
+        "folded_batch_norms": folded_count,
+    })
+    write_signature(export_path, export_signature)
+    print(f"✅ Exported model saved to {export_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Knowledge distillation
+======================
+
+Trains a small student model on the soft targets of an existing
+``{crop}_best_model.h5`` teacher.
+
+1. The training images are indexed and split like ``flow_from_directory``
+   with ``validation_split=0.2`` (the first 20% of each class's sorted files
+   are validation), so the student is evaluated on the same images as the
+   teacher.
+2. The teacher runs once over every image and its logits are cached in
+   ``{crop}_teacher_logits.npz``; later runs reuse the cache as long as the
+   teacher file and the image list are unchanged.
+3. The student (MobileNetV3-Small or a narrow / low-resolution MobileNetV2) is
+   trained with augmentation on a mix of the hard labels and the teacher's
+   temperature-softened distribution.
+
+    python scripts/mobilenet_distill.py --crop cassava --student mobilenetv3small
+    python scripts/mobilenet_distill.py --crop cassava --student mobilenetv2 --alpha 0.35 --input-size 160
+
+Compare student and teacher afterwards with:
+
+    python scripts/mobilenet_evaluate.py --crop cassava --compare \
+        models/cassava/cassava_best_model.h5 models/cassava/cassava_student_model.h5
+"""
+
+import os
+import argparse
+import numpy as np
+import tensorflow as tf
+from model_signature import build_signature, read_signature, write_signature
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+def index_dataset(data_dir, class_names, validation_split=0.2):
+    """List (path, label) pairs split the way flow_from_directory splits them"""
+    train, validation = [], []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(data_dir, class_name)
+        if not os.path.isdir(class_dir):
+            continue
+        files = sorted(f for f in os.listdir(class_dir) if f.lower().endswith(IMAGE_EXTENSIONS))
+        split = int(validation_split * len(files))
+        validation.extend((os.path.join(class_dir, f), label) for f in files[:split])
+        train.extend((os.path.join(class_dir, f), label) for f in files[split:])
+    return train, validation
+
+
+def load_image(path, input_size, rescale):
+    """Decode and resize one image file into a float32 tensor"""
+    image = tf.io.decode_image(tf.io.read_file(path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, input_size)
+    return image * rescale
+
+
+def teacher_logits(teacher, teacher_signature, paths, cache_path, teacher_path, batch_size):
+    """Teacher logits for every path, computed once and cached on disk"""
+    teacher_mtime = os.path.getmtime(teacher_path)
+    if os.path.exists(cache_path):
+        cache = np.load(cache_path, allow_pickle=False)
+        if cache["teacher_mtime"] == teacher_mtime and list(cache["paths"]) == list(paths):
+            print(f"♻️  Reusing cached teacher logits from {cache_path}")
+            return cache["logits"]
+
+    print(f"🧑‍🏫 Running the teacher over {len(paths)} images (once)...")
+    input_size = tuple(teacher_signature["input_size"])
+    rescale = teacher_signature["rescale"]
+    dataset = (tf.data.Dataset.from_tensor_slices(list(paths))
+               .map(lambda p: load_image(p, input_size, rescale), num_parallel_calls=tf.data.AUTOTUNE)
+               .batch(batch_size)
+               .prefetch(tf.data.AUTOTUNE))
+    probabilities = teacher.predict(dataset, verbose=1)
+
+    # The teacher ends in a softmax; log-probabilities are logits up to a per-row constant
+    logits = np.log(np.clip(probabilities, 1e-7, 1.0)).astype(np.float32)
+    np.savez(cache_path, paths=np.array(paths), logits=logits, teacher_mtime=teacher_mtime)
+    print(f"💾 Teacher logits cached in {cache_path}")
+    return logits
+
+
+def build_student(student, num_classes, input_size, alpha):
+    """Small backbone + softmax head; returns (model, rescale expected by the backbone)"""
+    input_shape = tuple(input_size) + (3,)
+    if student == "mobilenetv3small":
+        # MobileNetV3 rescales internally and expects raw 0-255 pixels
+        base_model = tf.keras.applications.MobileNetV3Small(
+            input_shape=input_shape, alpha=alpha, include_top=False, weights='imagenet')
+        rescale = 1.0
+    else:
+        base_model = tf.keras.applications.MobileNetV2(
+            input_shape=input_shape, alpha=alpha, include_top=False, weights='imagenet')
+        rescale = 1.0 / 255
+
+    model = tf.keras.Sequential([
+        base_model,
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dropout(0.2),
+        tf.keras.layers.Dense(num_classes, activation='softmax')
+    ])
+    return model, rescale
+
+
+def distillation_loss(num_classes, temperature, kd_weight):
+    """Loss over y_true = [one-hot labels | teacher logits] and student probabilities"""
+    def loss(y_true, y_pred):
+        labels = y_true[:, :num_classes]
+        teacher = y_true[:, num_classes:]
+        hard = tf.keras.losses.categorical_crossentropy(labels, y_pred)
+
+        student_logits = tf.math.log(tf.clip_by_value(y_pred, 1e-7, 1.0))
+        soft_teacher = tf.nn.softmax(teacher / temperature)
+        soft_student = tf.nn.log_softmax(student_logits / temperature)
+        soft = -tf.reduce_sum(soft_teacher * soft_student, axis=-1)
+
+        # temperature**2 keeps soft-target gradients on the same scale as the hard loss
+        return (1 - kd_weight) * hard + kd_weight * temperature ** 2 * soft
+    return loss
+
+
+def hard_label_accuracy(num_classes):
+    def accuracy(y_true, y_pred):
+        return tf.cast(tf.equal(tf.argmax(y_true[:, :num_classes], axis=-1), tf.argmax(y_pred, axis=-1)), tf.float32)
+    return accuracy
+
+
+def make_dataset(samples, logits, num_classes, input_size, rescale, batch_size, training):
+    """tf.data pipeline yielding (image, [one-hot | teacher logits])"""
+    paths = [path for path, _ in samples]
+    targets = np.concatenate([np.eye(num_classes, dtype=np.float32)[[label for _, label in samples]], logits], axis=1)
+
+    def prepare(path, target):
+        image = load_image(path, input_size, 1.0)
+        if training:
+            image = tf.image.random_flip_left_right(image)
+            image = tf.image.random_flip_up_down(image)
+            image = tf.clip_by_value(image * tf.random.uniform([], 0.7, 1.3), 0.0, 255.0)
+        return image * rescale, target
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, targets))
+    if training:
+        dataset = dataset.shuffle(len(paths), reshuffle_each_iteration=True)
+    return dataset.map(prepare, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Distill a crop model into a smaller student.")
+    parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type to distill.")
+    parser.add_argument("--student", type=str, default="mobilenetv3small", choices=["mobilenetv3small", "mobilenetv2"])
+    parser.add_argument("--alpha", type=float, default=None, help="Width multiplier (default: 1.0 for V3-Small, 0.35 for V2; V3-Small has ImageNet weights for 0.75 and 1.0)")
+    parser.add_argument("--input-size", type=int, default=224, help="Student input resolution (default: 224)")
+    parser.add_argument("--temperature", type=float, default=4.0, help="Softmax temperature for soft targets (default: 4)")
+    parser.add_argument("--kd-weight", type=float, default=0.9, help="Weight of the soft-target loss (default: 0.9)")
+    parser.add_argument("--epochs", type=int, default=30)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--learning-rate", type=float, default=1e-3)
+    parser.add_argument("--variant", type=str, default="student", help="Output name: models/{crop}/{crop}_{variant}_model.h5")
+    args = parser.parse_args()
+
+    data_dir = f"data/{args.crop}"
+    teacher_path = f"models/{args.crop}/{args.crop}_best_model.h5"
+    student_path = f"models/{args.crop}/{args.crop}_{args.variant}_model.h5"
+    cache_path = f"models/{args.crop}/{args.crop}_teacher_logits.npz"
+    alpha = args.alpha if args.alpha is not None else (1.0 if args.student == "mobilenetv3small" else 0.35)
+
+    teacher_signature = read_signature(teacher_path)
+    if teacher_signature is None:
+        raise SystemExit(f"❌ No signature for {teacher_path} (see scripts/model_signature.py)")
+    class_names = teacher_signature["class_names"]
+    num_classes = len(class_names)
+
+    train_samples, val_samples = index_dataset(data_dir, class_names)
+    all_paths = [path for path, _ in train_samples + val_samples]
+    print(f"📂 {len(train_samples)} training / {len(val_samples)} validation images, {num_classes} classes")
+
+    print(f"📥 Loading teacher from {teacher_path}...")
+    teacher = tf.keras.models.load_model(teacher_path)
+    logits = teacher_logits(teacher, teacher_signature, all_paths, cache_path, teacher_path, args.batch_size)
+    del teacher
+    train_logits, val_logits = logits[:len(train_samples)], logits[len(train_samples):]
+
+    input_size = (args.input_size, args.input_size)
+    student, rescale = build_student(args.student, num_classes, input_size, alpha)
+    student.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=args.learning_rate),
+                    loss=distillation_loss(num_classes, args.temperature, args.kd_weight),
+                    metrics=[hard_label_accuracy(num_classes)])
+
+    train_data = make_dataset(train_samples, train_logits, num_classes, input_size, rescale, args.batch_size, True)
+    val_data = make_dataset(val_samples, val_logits, num_classes, input_size, rescale, args.batch_size, False)
+
+    weights_path = f"models/{args.crop}/{args.crop}_{args.variant}.weights.h5"
+    callbacks = [
+        tf.keras.callbacks.ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1),
+        tf.keras.callbacks.ModelCheckpoint(weights_path, save_best_only=True, save_weights_only=True,
+                                           monitor="val_accuracy", mode="max"),
+    ]
+    student.fit(train_data, epochs=args.epochs, validation_data=val_data, callbacks=callbacks)
+
+    # Save the best student with a standard loss so it loads without custom objects
+    student.load_weights(weights_path)
+    student.compile(optimizer='adam', loss='categorical_crossentropy', metrics=['accuracy'])
+    student.save(student_path)
+    os.remove(weights_path)
+
+    architecture = "MobileNetV3Small" if args.student == "mobilenetv3small" else "MobileNetV2"
+    signature = build_signature(args.crop, class_names, input_size=input_size, rescale=rescale,
+                                architecture=architecture, alpha=alpha,
+                                distilled_from=os.path.basename(teacher_path),
+                                temperature=args.temperature)
+    write_signature(student_path, signature)
+
+    print(f"✅ Student saved to {student_path}")
+    print("📊 Compare it with the teacher:")
+    print(f"   python scripts/mobilenet_evaluate.py --crop {args.crop} --compare {teacher_path} {student_path}")
+
+
+if __name__ == "__main__":
+    main()
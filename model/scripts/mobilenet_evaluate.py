@@ -1,69 +1,185 @@
+import os
+import time
 import argparse
 import tensorflow as tf
 import numpy as np
+import pandas as pd    # type: ignore
 import matplotlib.pyplot as plt
 from sklearn.metrics import classification_report, confusion_matrix     # type: ignore
 import seaborn as sns    # type: ignore
 from tensorflow.keras.preprocessing.image import ImageDataGenerator         # type: ignore
+from model_signature import read_signature
 
-# Argument parser to choose the crop type
-parser = argparse.ArgumentParser(description="Evaluate MobileNetV2 model.")
-parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type to evaluate.")
-args = parser.parse_args()
-
-# Define dataset directory and number of classes
-data_dir = f"data/{args.crop}"
+# Default input size and batch size for models without a signature
 img_size = (224, 224)
 batch_size = 32
 
-# Load validation data
-datagen = ImageDataGenerator(rescale=1.0/255, validation_split=0.2)
-
-val_data = datagen.flow_from_directory(
-    data_dir,
-    target_size=img_size,
-    batch_size=batch_size,
-    class_mode='categorical',
-    subset="validation",
-    shuffle=False
-)
-
-# Load trained model
-model_path = f"models/{args.crop}/{args.crop}_best_model.h5"
-print(f"📥 Loading model from {model_path}...")
-model = tf.keras.models.load_model(model_path)
-
-# Evaluate model
-print(f"🔍 Evaluating MobileNetV2 model for {args.crop}...")
-eval_results = model.evaluate(val_data)
-val_loss, val_acc = eval_results[0], eval_results[1]
-
-print(f"📊 Validation Accuracy: {val_acc:.4f}")
-print(f"📉 Validation Loss: {val_loss:.4f}")
-
-# Save evaluation results
-with open(f"models/{args.crop}/{args.crop}_evaluation.txt", "w") as f:
-    f.write(f"Validation Accuracy: {val_acc:.4f}\n")
-    f.write(f"Validation Loss: {val_loss:.4f}\n")
-
-# Generate Confusion Matrix
-y_true = val_data.classes
-y_pred = np.argmax(model.predict(val_data), axis=1)
-
-cm = confusion_matrix(y_true, y_pred)
-plt.figure(figsize=(8, 6))
-sns.heatmap(cm, annot=True, fmt="d", cmap="Blues", xticklabels=val_data.class_indices.keys(), yticklabels=val_data.class_indices.keys())
-plt.xlabel("Predicted")
-plt.ylabel("Actual")
-plt.title(f"Confusion Matrix for {args.crop}")
-plt.savefig(f"models/{args.crop}/{args.crop}_confusion_matrix.png")
-plt.show()
-
-# Classification Report
-report = classification_report(y_true, y_pred, target_names=val_data.class_indices.keys())
-print(report)
-with open(f"models/{args.crop}/{args.crop}_classification_report.txt", "w") as f:
-    f.write(report)
-
-print("✅ Evaluation complete! Results and confusion matrix saved.")
 
+def load_validation_data(model_path, data_dir):
+    """Validation split preprocessed with the model's own signature (input size, rescaling)"""
+    signature = read_signature(model_path)
+    target_size = tuple(signature["input_size"]) if signature else img_size
+    rescale = signature["rescale"] if signature else 1.0/255
+
+    datagen = ImageDataGenerator(rescale=rescale, validation_split=0.2)
+    return datagen.flow_from_directory(
+        data_dir,
+        target_size=target_size,
+        batch_size=batch_size,
+        class_mode='categorical',
+        subset="validation",
+        shuffle=False
+    )
+
+
+def validation_data_from_index(paths, labels, class_names, target_size, rescale=1.0/255):
+    """Validation iterator over an already indexed split (no directory scan, no augmentation)"""
+    frame = pd.DataFrame({"filename": paths, "class": [class_names[label] for label in labels]})
+    datagen = ImageDataGenerator(rescale=rescale)
+    return datagen.flow_from_dataframe(
+        frame,
+        classes=list(class_names),
+        target_size=tuple(target_size),
+        batch_size=batch_size,
+        class_mode='categorical',
+        shuffle=False,
+        validate_filenames=False
+    )
+
+
+def evaluate_model(model, val_data, crop, show_plots=True):
+    """Score a model on the validation iterator and save the results in models/{crop}/"""
+    class_names = [name for name, _ in sorted(val_data.class_indices.items(), key=lambda item: item[1])]
+
+    # One prediction pass gives loss, accuracy, the confusion matrix and the report
+    print(f"🔍 Evaluating MobileNetV2 model for {crop}...")
+    probabilities = model.predict(val_data)
+    y_true = np.asarray(val_data.classes)
+    y_pred = np.argmax(probabilities, axis=1)
+    metrics = evaluation_metrics(y_true, probabilities, class_names)
+    val_loss, val_acc = metrics["loss"], metrics["accuracy"]
+
+    print(f"📊 Validation Accuracy: {val_acc:.4f}")
+    print(f"📉 Validation Loss: {val_loss:.4f}")
+
+    # Save evaluation results
+    with open(f"models/{crop}/{crop}_evaluation.txt", "w") as f:
+        f.write(f"Validation Accuracy: {val_acc:.4f}\n")
+        f.write(f"Validation Loss: {val_loss:.4f}\n")
+
+    # Generate Confusion Matrix
+    cm = confusion_matrix(y_true, y_pred, labels=list(range(len(class_names))))
+    plt.figure(figsize=(8, 6))
+    sns.heatmap(cm, annot=True, fmt="d", cmap="Blues", xticklabels=class_names, yticklabels=class_names)
+    plt.xlabel("Predicted")
+    plt.ylabel("Actual")
+    plt.title(f"Confusion Matrix for {crop}")
+    plt.savefig(f"models/{crop}/{crop}_confusion_matrix.png")
+    if show_plots:
+        plt.show()
+    plt.close()
+
+    # Classification Report
+    report = classification_report(y_true, y_pred, labels=list(range(len(class_names))),
+                                   target_names=class_names, zero_division=0)
+    print(report)
+    with open(f"models/{crop}/{crop}_classification_report.txt", "w") as f:
+        f.write(report)
+
+    print("✅ Evaluation complete! Results and confusion matrix saved.")
+    return metrics
+
+
+def measure_latency(model, input_shape, runs=30):
+    """Median single-image prediction latency in milliseconds"""
+    dummy = tf.zeros((1,) + tuple(input_shape[1:]), dtype=tf.float32)
+    infer = tf.function(lambda x: model(x, training=False))
+    infer(dummy)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        infer(dummy).numpy()
+        timings.append((time.perf_counter() - start) * 1000)
+    return float(np.median(timings))
+
+
+def evaluation_metrics(y_true, probabilities, class_names):
+    """Accuracy, loss and per-class precision / recall for a set of predictions"""
+    y_pred = np.argmax(probabilities, axis=1)
+    true_probabilities = np.clip(probabilities[np.arange(len(y_true)), y_true], 1e-7, 1.0)
+    report = classification_report(y_true, y_pred, labels=list(range(len(class_names))),
+                                   target_names=class_names, output_dict=True, zero_division=0)
+    return {
+        "accuracy": float(np.mean(y_pred == y_true)),
+        "loss": float(-np.mean(np.log(true_probabilities))),
+        "per_class": {
+            name: {"precision": report[name]["precision"], "recall": report[name]["recall"],
+                   "support": int(report[name]["support"])}
+            for name in class_names
+        },
+    }
+
+
+def compare_models(model_paths, crop, data_dir):
+    """Print and save an accuracy / latency / size table for several models"""
+    rows = []
+    for model_path in model_paths:
+        print(f"📥 Loading model from {model_path}...")
+        model = tf.keras.models.load_model(model_path)
+        val_data = load_validation_data(model_path, data_dir)
+        y_pred = np.argmax(model.predict(val_data, verbose=0), axis=1)
+        rows.append({
+            "model": os.path.basename(model_path),
+            "accuracy": float(np.mean(y_pred == val_data.classes)),
+            "latency_ms": measure_latency(model, model.input_shape),
+            "size_mb": os.path.getsize(model_path) / (1024 * 1024),
+            "params_m": model.count_params() / 1e6,
+        })
+
+    reference = rows[0]
+    lines = [
+        "| Model | Accuracy | Latency (ms/image) | Size (MB) | Params (M) | Speed-up | Size ratio |",
+        "|-------|----------|--------------------|-----------|------------|----------|------------|",
+    ]
+    for row in rows:
+        lines.append(
+            f"| {row['model']} | {row['accuracy']:.4f} | {row['latency_ms']:.1f} | {row['size_mb']:.1f} | "
+            f"{row['params_m']:.2f} | {reference['latency_ms'] / row['latency_ms']:.2f}x | "
+            f"{row['size_mb'] / reference['size_mb']:.2f} |"
+        )
+    table = "\n".join(lines)
+    print(table)
+
+    with open(f"models/{crop}/{crop}_model_comparison.md", "w") as f:
+        f.write(table + "\n")
+    print(f"✅ Comparison saved to models/{crop}/{crop}_model_comparison.md")
+
+
+def main():
+    # Argument parser to choose the crop type
+    parser = argparse.ArgumentParser(description="Evaluate MobileNetV2 model.")
+    parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type to evaluate.")
+    parser.add_argument("--model", type=str, help="Model to evaluate (default: models/{crop}/{crop}_best_model.h5)")
+    parser.add_argument("--compare", type=str, nargs="+", metavar="MODEL",
+                        help="Compare accuracy, latency and size of several models (e.g. teacher and student)")
+    args = parser.parse_args()
+
+    data_dir = f"data/{args.crop}"
+
+    if args.compare:
+        compare_models(args.compare, args.crop, data_dir)
+        return
+
+    # Load validation data
+    model_path = args.model or f"models/{args.crop}/{args.crop}_best_model.h5"
+    val_data = load_validation_data(model_path, data_dir)
+
+    # Load trained model
+    print(f"📥 Loading model from {model_path}...")
+    model = tf.keras.models.load_model(model_path)
+
+    evaluate_model(model, val_data, args.crop)
+
+
+if __name__ == "__main__":
+    main()
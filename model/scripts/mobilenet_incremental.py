@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""
+Incremental fine-tuning
+=======================
+
+Updates ``{crop}_best_model.h5`` with newly labelled field images instead of
+retraining from ImageNet weights over the whole dataset.
+
+1. New images are read from ``data/{crop}_new/<class>/`` (same class folders as
+   ``data/{crop}``; classes without new images can be left out). 20% of each
+   class is held out to check the new model actually learned them.
+2. The current best model is fine-tuned for a few epochs at a low learning rate
+   on the new images plus a stratified replay sample of the old training split,
+   so it does not forget the classes that got no new images. Early stopping
+   watches one part of the old validation split and the held-out new images;
+   the rest (``--gate-fraction``, per class) is kept for the gate only.
+3. Regression gate: the previous and the candidate model are scored with the
+   evaluation script's image loading and metrics on the gate part of the old validation split and
+   of the held-out new images, which training never saw. The candidate is promoted only if overall accuracy does not drop by
+   more than ``--max-accuracy-drop``, no class loses more than
+   ``--max-class-recall-drop`` recall and the new images are classified at
+   least as well as before.
+4. On promotion the previous model is archived under ``models/{crop}/archive/``
+   and an existing serving export is rebuilt, so the API does not keep serving
+   the old weights.
+
+    python scripts/mobilenet_incremental.py --crop cassava
+    python scripts/mobilenet_incremental.py --crop cassava --replay-ratio 3 --epochs 5 --merge
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import numpy as np
+import tensorflow as tf
+from model_signature import read_signature, write_signature, class_names_from_directory, signature_path
+from mobilenet_distill import index_dataset, load_image
+from mobilenet_evaluate import evaluation_metrics, validation_data_from_index
+
+
+def stratified_replay(samples, count, min_per_class, seed=0):
+    """Sample old training images keeping each class's share, with a floor per class"""
+    rng = np.random.default_rng(seed)
+    by_label = {}
+    for sample in samples:
+        by_label.setdefault(sample[1], []).append(sample)
+
+    replay = []
+    for label, class_samples in sorted(by_label.items()):
+        share = int(round(count * len(class_samples) / len(samples)))
+        take = min(len(class_samples), max(share, min_per_class))
+        picked = rng.choice(len(class_samples), size=take, replace=False)
+        replay.extend(class_samples[i] for i in picked)
+    return replay
+
+
+def split_for_gate(samples, gate_fraction, seed=0):
+    """Split (path, label) samples per class into (early stopping, gate) parts"""
+    rng = np.random.default_rng(seed)
+    by_label = {}
+    for sample in samples:
+        by_label.setdefault(sample[1], []).append(sample)
+
+    stopping, gate = [], []
+    for label, class_samples in sorted(by_label.items()):
+        order = rng.permutation(len(class_samples))
+        # A class with a single sample goes to the gate, where it counts
+        take = max(1, int(round(gate_fraction * len(class_samples))))
+        gate.extend(class_samples[i] for i in order[:take])
+        stopping.extend(class_samples[i] for i in order[take:])
+    return stopping, gate
+
+
+def make_dataset(samples, num_classes, input_size, rescale, batch_size, training):
+    """tf.data pipeline yielding (image, one-hot label)"""
+    paths = [path for path, _ in samples]
+    labels = np.eye(num_classes, dtype=np.float32)[[label for _, label in samples]]
+
+    def prepare(path, label):
+        image = load_image(path, input_size, 1.0)
+        if training:
+            image = tf.image.random_flip_left_right(image)
+            image = tf.image.random_flip_up_down(image)
+            image = tf.clip_by_value(image * tf.random.uniform([], 0.7, 1.3), 0.0, 255.0)
+        return image * rescale, label
+
+    dataset = tf.data.Dataset.from_tensor_slices((paths, labels))
+    if training:
+        dataset = dataset.shuffle(len(paths), reshuffle_each_iteration=True)
+    return dataset.map(prepare, num_parallel_calls=tf.data.AUTOTUNE).batch(batch_size).prefetch(tf.data.AUTOTUNE)
+
+
+def score(model, samples, class_names, input_size, rescale):
+    """Evaluation-script metrics of a model on a list of (path, label) samples
+
+    Images are loaded the way mobilenet_evaluate.py loads them, so the gate
+    compares models on the same pixels as an evaluation run.
+    """
+    if not samples:
+        return None
+    paths, labels = [path for path, _ in samples], [label for _, label in samples]
+    val_data = validation_data_from_index(paths, labels, class_names, input_size, rescale)
+    probabilities = model.predict(val_data, verbose=0)
+    return evaluation_metrics(np.array(labels), probabilities, class_names)
+
+
+def regression_gate(previous, candidate, max_accuracy_drop, max_class_recall_drop):
+    """Return the list of failed checks (empty when the candidate may be promoted)"""
+    failures = []
+    old_before, old_after = previous["old_validation"], candidate["old_validation"]
+    if old_after["accuracy"] < old_before["accuracy"] - max_accuracy_drop:
+        failures.append(f"validation accuracy {old_after['accuracy']:.4f} < "
+                        f"{old_before['accuracy']:.4f} - {max_accuracy_drop}")
+
+    for name, before in old_before["per_class"].items():
+        after = old_after["per_class"][name]
+        if before["support"] and after["recall"] < before["recall"] - max_class_recall_drop:
+            failures.append(f"recall of {name} dropped from {before['recall']:.3f} to {after['recall']:.3f}")
+
+    new_before, new_after = previous["new_holdout"], candidate["new_holdout"]
+    if new_before is not None and new_after["accuracy"] < new_before["accuracy"]:
+        failures.append(f"held-out new images: accuracy {new_after['accuracy']:.4f} < {new_before['accuracy']:.4f}")
+    return failures
+
+
+def archive_model(model_path, archive_dir):
+    """Move a model and its signature into the archive, stamped with its creation time"""
+    os.makedirs(archive_dir, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(os.path.getmtime(model_path)))
+    name = os.path.splitext(os.path.basename(model_path))[0]
+    archived_path = os.path.join(archive_dir, f"{name}_{stamp}.h5")
+    shutil.move(model_path, archived_path)
+    if os.path.exists(signature_path(model_path)):
+        shutil.move(signature_path(model_path), signature_path(archived_path))
+    return archived_path
+
+
+def refresh_export(crop, model, signature, data_dir):
+    """Rebuild an existing serving export so the API picks up the promoted weights"""
+    from export_inference_model import build_inference_model, load_parity_images, check_parity
+
+    export_path = f"models/{crop}/{crop}_best_export.h5"
+    export_signature = read_signature(export_path)
+    if export_signature is None:
+        return
+
+    exported, folded_count, _ = build_inference_model(model, signature)
+    images = load_parity_images(data_dir, signature, 64)
+    max_difference, _, passed = check_parity(model, exported, images, signature["rescale"], 1e-4)
+    if not passed:
+        os.remove(export_path)
+        os.remove(signature_path(export_path))
+        print(f"⚠️  Export parity failed (max |Δp| = {max_difference:.2e}); removed the stale {export_path}")
+        return
+
+    exported.save(export_path)
+    export_signature.update({"created": signature["created"], "folded_batch_norms": folded_count})
+    write_signature(export_path, export_signature)
+    print(f"🔄 Serving export {export_path} rebuilt")
+
+
+def merge_new_images(new_dir, data_dir):
+    """Move the new images into the main dataset so the next full training run sees them"""
+    moved = 0
+    for class_name in class_names_from_directory(new_dir):
+        target_dir = os.path.join(data_dir, class_name)
+        for file_name in os.listdir(os.path.join(new_dir, class_name)):
+            # Camera file names repeat (IMG_0001.jpg); never overwrite an existing image
+            stem, extension = os.path.splitext(file_name)
+            target = os.path.join(target_dir, file_name)
+            suffix = 1
+            while os.path.exists(target):
+                target = os.path.join(target_dir, f"{stem}_{suffix}{extension}")
+                suffix += 1
+            shutil.move(os.path.join(new_dir, class_name, file_name), target)
+            moved += 1
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fine-tune the current best model on newly labelled images.")
+    parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type to update.")
+    parser.add_argument("--new-data", type=str, help="New images, one sub-directory per class (default: data/{crop}_new)")
+    parser.add_argument("--replay-ratio", type=float, default=2.0, help="Old training images replayed per new image (default: 2)")
+    parser.add_argument("--min-replay-per-class", type=int, default=16, help="Replayed images per class at least (default: 16)")
+    parser.add_argument("--epochs", type=int, default=8)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--learning-rate", type=float, default=1e-5)
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.005,
+                        help="Allowed drop of validation accuracy (default: 0.005)")
+    parser.add_argument("--max-class-recall-drop", type=float, default=0.03,
+                        help="Allowed drop of any class's validation recall (default: 0.03)")
+    parser.add_argument("--gate-fraction", type=float, default=0.5,
+                        help="Share of each validation class kept out of early stopping for the gate (default: 0.5)")
+    parser.add_argument("--merge", action="store_true", help="Move the new images into data/{crop} after promotion")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    data_dir = f"data/{args.crop}"
+    new_dir = args.new_data or f"data/{args.crop}_new"
+    best_path = f"models/{args.crop}/{args.crop}_best_model.h5"
+    candidate_path = f"models/{args.crop}/{args.crop}_candidate_model.h5"
+
+    signature = read_signature(best_path)
+    if signature is None:
+        sys.exit(f"❌ No signature for {best_path} (see scripts/model_signature.py)")
+    if not os.path.isdir(new_dir):
+        sys.exit(f"❌ New image directory {new_dir} not found")
+
+    class_names = signature["class_names"]
+    unknown = sorted(set(class_names_from_directory(new_dir)) - set(class_names))
+    if unknown:
+        sys.exit(f"❌ New classes {unknown} need a full training run (scripts/mobilenet_train.py)")
+
+    old_train, old_val = index_dataset(data_dir, class_names)
+    new_train, new_holdout = index_dataset(new_dir, class_names)
+    if not new_train:
+        sys.exit(f"❌ No new training images in {new_dir}")
+    if not 0 < args.gate_fraction <= 1:
+        sys.exit("❌ --gate-fraction must be in (0, 1]")
+
+    # The gate must judge on images that did not pick the epoch
+    old_stopping, old_gate = split_for_gate(old_val, args.gate_fraction)
+    new_stopping, new_gate = split_for_gate(new_holdout, args.gate_fraction)
+
+    replay = stratified_replay(old_train, int(args.replay_ratio * len(new_train)), args.min_replay_per_class)
+    print(f"📂 {len(new_train)} new images (+{len(new_holdout)} held out), "
+          f"{len(replay)} replayed from {len(old_train)} old training images")
+    print(f"🚦 Gate on {len(old_gate)} old validation + {len(new_gate)} new images; "
+          f"early stopping on {len(old_stopping)} + {len(new_stopping)}")
+
+    input_size = tuple(signature["input_size"])
+    rescale = signature["rescale"]
+
+    print(f"📥 Loading current model from {best_path}...")
+    model = tf.keras.models.load_model(best_path)
+    previous = {
+        "old_validation": score(model, old_gate, class_names, input_size, rescale),
+        "new_holdout": score(model, new_gate, class_names, input_size, rescale),
+    }
+
+    # Low learning rate: adjust the existing weights rather than relearn them
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=args.learning_rate),
+                  loss='categorical_crossentropy', metrics=['accuracy'])
+    train_data = make_dataset(new_train + replay, len(class_names), input_size, rescale, args.batch_size, True)
+    if old_stopping + new_stopping:
+        val_data = make_dataset(old_stopping + new_stopping, len(class_names), input_size, rescale, args.batch_size, False)
+        callbacks = [tf.keras.callbacks.EarlyStopping(monitor='val_loss', patience=2, restore_best_weights=True)]
+        model.fit(train_data, epochs=args.epochs, validation_data=val_data, callbacks=callbacks)
+    else:
+        print("⚠️  Every validation image is in the gate; training all epochs without early stopping")
+        model.fit(train_data, epochs=args.epochs)
+
+    candidate = {
+        "old_validation": score(model, old_gate, class_names, input_size, rescale),
+        "new_holdout": score(model, new_gate, class_names, input_size, rescale),
+    }
+    candidate_signature = dict(signature)
+    candidate_signature.update({
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "incremental": {"base_created": signature["created"], "new_images": len(new_train),
+                        "replay_images": len(replay), "epochs": args.epochs,
+                        "gate_images": len(old_gate) + len(new_gate)},
+    })
+    model.save(candidate_path)
+    write_signature(candidate_path, candidate_signature)
+
+    print("\n📊 Regression gate")
+    for name in ("old_validation", "new_holdout"):
+        if previous[name] is not None:
+            print(f"   {name:<15} accuracy {previous[name]['accuracy']:.4f} -> {candidate[name]['accuracy']:.4f}   "
+                  f"loss {previous[name]['loss']:.4f} -> {candidate[name]['loss']:.4f}")
+    failures = regression_gate(previous, candidate, args.max_accuracy_drop, args.max_class_recall_drop)
+
+    report_path = f"models/{args.crop}/{args.crop}_regression_gate.json"
+    with open(report_path, "w") as f:
+        json.dump({"previous": previous, "candidate": candidate, "failures": failures,
+                   "promoted": not failures}, f, indent=2)
+
+    elapsed = time.time() - start_time
+    if failures:
+        for failure in failures:
+            print(f"   ❌ {failure}")
+        print(f"🚫 Candidate not promoted; kept as {candidate_path} ({elapsed / 60:.1f} min, report: {report_path})")
+        sys.exit(1)
+
+    archived_path = archive_model(best_path, f"models/{args.crop}/archive")
+    shutil.move(candidate_path, best_path)
+    shutil.move(signature_path(candidate_path), signature_path(best_path))
+    print(f"✅ Candidate promoted to {best_path}; previous model archived as {archived_path}")
+
+    refresh_export(args.crop, model, candidate_signature, data_dir)
+    if read_signature(f"models/{args.crop}/{args.crop}_fast_model.h5") is not None:
+        print(f"ℹ️  Re-run scripts/calibrate_cascade.py --crop {args.crop} to recalibrate the cascade threshold")
+
+    if args.merge:
+        print(f"📦 Moved {merge_new_images(new_dir, data_dir)} new images into {data_dir}")
+    print(f"⏱️  Incremental update finished in {elapsed / 60:.1f} min")
+
+
+if __name__ == "__main__":
+    main()
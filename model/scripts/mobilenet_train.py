@@ -1,74 +1,235 @@
+import os
+import json
+import time
+import shutil
+import tempfile
 import tensorflow as tf
 from tensorflow.keras.preprocessing.image import ImageDataGenerator # type: ignore
 from tensorflow.keras.callbacks import ReduceLROnPlateau, ModelCheckpoint # type: ignore
 import argparse
+from model_signature import build_signature, class_names_from_directory, class_names_from_indices, write_signature
+from mobilenet_distill import index_dataset
+from distributed_training import make_training_dataset, train_distributed, worker_role
 
-# Argument parser to select crop type
-parser = argparse.ArgumentParser()
-parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type for fine-tuning")
-args = parser.parse_args()
-
-data_dir = f"data/{args.crop}"
-num_classes = {"cassava": 5, "maize": 4, "tomato": 10}[args.crop]
-
-# Improved data augmentation
-datagen = ImageDataGenerator(
-    rescale=1.0/255,
-    rotation_range=30,
-    width_shift_range=0.3,
-    height_shift_range=0.3,
-    brightness_range=[0.7, 1.3],
-    zoom_range=0.2,
-    horizontal_flip=True,
-    vertical_flip=True,
-    validation_split=0.2
-)
-
-# Load datasets
-train_data = datagen.flow_from_directory(
-    data_dir, target_size=(224, 224), batch_size=64, class_mode='categorical', subset='training')
-val_data = datagen.flow_from_directory(
-    data_dir, target_size=(224, 224), batch_size=64, class_mode='categorical', subset='validation')
-
-# Load pre-trained MobileNetV2 model
-base_model = tf.keras.applications.MobileNetV2(input_shape=(224, 224, 3), include_top=False, weights='imagenet')
-
-# Freeze first 100 layers
-for layer in base_model.layers[:100]:
-    layer.trainable = False
-
-# Unfreeze the rest
-for layer in base_model.layers[100:]:
-    layer.trainable = True
-
-# Build the fine-tuned model
-model = tf.keras.Sequential([
-    base_model,
-    tf.keras.layers.GlobalAveragePooling2D(),
-    tf.keras.layers.Dense(256, activation='relu'),
-    tf.keras.layers.Dropout(0.3),
-    tf.keras.layers.Dense(num_classes, activation='softmax')
-])
-
-# Compile the model
-model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=1e-4),
-              loss='categorical_crossentropy',
-              metrics=['accuracy'])
-
-# Learning rate scheduler
-lr_scheduler = ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1)
-
-# Model checkpointing
-checkpoint = ModelCheckpoint(f"models/{args.crop}/{args.crop}_best_model.h5", save_best_only=True, monitor="val_accuracy", mode="max")
-
-# Train the model
-history = model.fit(
-    train_data,
-    epochs=50,
-    validation_data=val_data,
-    callbacks=[lr_scheduler, checkpoint]
-)
-
-# Save final model
-model.save(f"models/{args.crop}/{args.crop}_fine_tuned.h5")
-print("✅ Fine-tuning complete! Best model saved.")
\ No newline at end of file
+
+class BestWeights(tf.keras.callbacks.Callback):
+    """Keeps the weights of the best epoch in memory, matching what ModelCheckpoint writes"""
+
+    def __init__(self, monitor="val_accuracy"):
+        super().__init__()
+        self.monitor = monitor
+        self.best = -float("inf")
+        self.weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        value = (logs or {}).get(self.monitor)
+        if value is not None and value > self.best:
+            self.best = value
+            self.weights = self.model.get_weights()
+
+
+class Throughput(tf.keras.callbacks.Callback):
+    """Training images/second per epoch, excluding validation, as train_distributed reports it"""
+
+    def __init__(self, images_per_epoch):
+        super().__init__()
+        self.images_per_epoch = images_per_epoch
+        self.images_per_second = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+        self.elapsed = None
+
+    def on_test_begin(self, logs=None):
+        self.elapsed = time.perf_counter() - self.start
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = self.elapsed if self.elapsed is not None else time.perf_counter() - self.start
+        self.images_per_second.append(self.images_per_epoch / elapsed)
+
+
+def load_training_data(data_dir, img_size, batch_size):
+    """Augmented training and validation iterators from the class sub-directories"""
+    # Improved data augmentation
+    datagen = ImageDataGenerator(
+        rescale=1.0/255,
+        rotation_range=30,
+        width_shift_range=0.3,
+        height_shift_range=0.3,
+        brightness_range=[0.7, 1.3],
+        zoom_range=0.2,
+        horizontal_flip=True,
+        vertical_flip=True,
+        validation_split=0.2
+    )
+
+    # Load datasets
+    train_data = datagen.flow_from_directory(
+        data_dir, target_size=img_size, batch_size=batch_size, class_mode='categorical', subset='training')
+    val_data = datagen.flow_from_directory(
+        data_dir, target_size=img_size, batch_size=batch_size, class_mode='categorical', subset='validation')
+    return train_data, val_data
+
+
+def build_model(num_classes, img_size, alpha, learning_rate):
+    """MobileNetV2 backbone with the first 100 layers frozen and a new classification head"""
+    # Load pre-trained MobileNetV2 model
+    base_model = tf.keras.applications.MobileNetV2(input_shape=img_size + (3,), alpha=alpha, include_top=False, weights='imagenet')
+
+    # Freeze first 100 layers
+    for layer in base_model.layers[:100]:
+        layer.trainable = False
+
+    # Unfreeze the rest
+    for layer in base_model.layers[100:]:
+        layer.trainable = True
+
+    # Build the fine-tuned model
+    model = tf.keras.Sequential([
+        base_model,
+        tf.keras.layers.GlobalAveragePooling2D(),
+        tf.keras.layers.Dense(256, activation='relu'),
+        tf.keras.layers.Dropout(0.3),
+        tf.keras.layers.Dense(num_classes, activation='softmax')
+    ])
+
+    # Compile the model
+    model.compile(optimizer=tf.keras.optimizers.Adam(learning_rate=learning_rate),
+                  loss='categorical_crossentropy',
+                  metrics=['accuracy'])
+    return model
+
+
+def train(crop, input_size=224, alpha=1.0, variant="best", epochs=50, batch_size=64, learning_rate=1e-4,
+          distributed=False, steps_per_epoch=None, throughput_file=None):
+    """Fine-tune a model for one crop and save it with its signature
+
+    Returns a dict with the in-memory model (holding the best epoch's weights,
+    i.e. what was saved to ``best_model_path``), its class names, the
+    validation split as (paths, labels) and the training history, so callers
+    can evaluate without reloading anything from disk.
+    """
+    data_dir = f"data/{crop}"
+    img_size = (input_size, input_size)
+
+    # Best-model checkpoint and final model paths
+    best_model_path = f"models/{crop}/{crop}_{variant}_model.h5"
+    if variant == "best":
+        final_model_path = f"models/{crop}/{crop}_fine_tuned.h5"
+    else:
+        final_model_path = f"models/{crop}/{crop}_{variant}_fine_tuned.h5"
+
+    if distributed:
+        # Every worker runs this same script; TF_CONFIG tells it its role in the cluster
+        strategy = tf.distribute.MultiWorkerMirroredStrategy()
+        num_workers, worker_index, is_chief = worker_role(strategy.cluster_resolver)
+    else:
+        strategy = tf.distribute.get_strategy()
+        num_workers, worker_index, is_chief = 1, 0, True
+
+    # Keep the per-worker batch fixed and scale the learning rate with the global batch (linear scaling rule)
+    global_batch_size = batch_size * num_workers
+    learning_rate = learning_rate * num_workers
+
+    if distributed:
+        class_names = class_names_from_directory(data_dir)
+        train_samples, val_samples = index_dataset(data_dir, class_names)
+        train_data = make_training_dataset(train_samples, len(class_names), img_size, global_batch_size,
+                                           worker_index, num_workers, training=True)
+        val_data = make_training_dataset(val_samples, len(class_names), img_size, global_batch_size,
+                                         worker_index, num_workers, training=False)
+        steps_per_epoch = steps_per_epoch or max(1, len(train_samples) // global_batch_size)
+        validation_steps = max(1, len(val_samples) // global_batch_size)
+        validation_index = ([path for path, _ in val_samples], [label for _, label in val_samples])
+        print(f"🌐 Worker {worker_index + 1}/{num_workers}{' (chief)' if is_chief else ''}: "
+              f"global batch {global_batch_size}, learning rate {learning_rate:g}")
+    else:
+        train_data, val_data = load_training_data(data_dir, img_size, batch_size)
+        # Class order is whatever flow_from_directory assigned; it is recorded in the signature
+        class_names = class_names_from_indices(train_data.class_indices)
+        validation_index = (list(val_data.filepaths), list(val_data.classes))
+
+    # Variables must be created inside the strategy scope to be mirrored across workers
+    with strategy.scope():
+        model = build_model(len(class_names), img_size, alpha, learning_rate)
+
+    # Model checkpointing; every worker has to save, but only the chief writes to models/
+    if is_chief:
+        checkpoint_path = best_model_path
+    else:
+        scratch_dir = tempfile.mkdtemp(prefix=f"worker{worker_index}_")
+        checkpoint_path = os.path.join(scratch_dir, os.path.basename(best_model_path))
+
+    # Train the model
+    if distributed:
+        history, best_weights = train_distributed(strategy, model, train_data, val_data, epochs, steps_per_epoch,
+                                                  validation_steps, global_batch_size, checkpoint_path)
+    else:
+        # Learning rate scheduler
+        lr_scheduler = ReduceLROnPlateau(monitor='val_loss', factor=0.5, patience=3, verbose=1)
+        checkpoint = ModelCheckpoint(checkpoint_path, save_best_only=True, monitor="val_accuracy", mode="max")
+        best = BestWeights()
+        throughput = Throughput(train_data.samples)
+        history = model.fit(
+            train_data,
+            epochs=epochs,
+            validation_data=val_data,
+            callbacks=[lr_scheduler, checkpoint, best, throughput]
+        ).history
+        history["images_per_second"] = throughput.images_per_second
+        best_weights = best.weights
+
+    # Save final model
+    if is_chief:
+        model.save(final_model_path)
+        # Signature read by the API: class list, input size and preprocessing. Written only next to
+        # models that exist, so the API never finds a signature for a checkpoint still to come
+        signature = build_signature(crop, class_names, input_size=img_size, rescale=1.0/255, alpha=alpha)
+        write_signature(final_model_path, signature)
+        if os.path.exists(best_model_path):
+            write_signature(best_model_path, signature)
+        if throughput_file:
+            with open(throughput_file, "w") as f:
+                json.dump({"workers": num_workers, "global_batch_size": global_batch_size,
+                           "images_per_second": history["images_per_second"]}, f, indent=2)
+        print("✅ Fine-tuning complete! Best model saved.")
+    else:
+        model.save(os.path.join(scratch_dir, os.path.basename(final_model_path)))
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    # Hand back the best epoch, like the checkpoint on disk
+    if best_weights is not None:
+        model.set_weights(best_weights)
+
+    return {
+        "model": model,
+        "class_names": class_names,
+        "input_size": img_size,
+        "validation_index": validation_index,
+        "history": history,
+        "best_model_path": best_model_path,
+    }
+
+
+def main():
+    # Argument parser to select crop type
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--crop", type=str, required=True, choices=["cassava", "maize", "tomato"], help="Crop type for fine-tuning")
+    parser.add_argument("--input-size", type=int, default=224, choices=[96, 128, 160, 192, 224], help="Square input resolution (default: 224)")
+    parser.add_argument("--alpha", type=float, default=1.0, choices=[0.35, 0.5, 0.75, 1.0, 1.3, 1.4], help="MobileNetV2 width multiplier (default: 1.0)")
+    parser.add_argument("--variant", type=str, default="best", help="Model name suffix: 'best' for the main model, 'fast' for the cascade's first stage")
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--batch-size", type=int, default=64, help="Batch size per worker (default: 64)")
+    parser.add_argument("--learning-rate", type=float, default=1e-4, help="Learning rate of a single worker; scaled by the number of workers (default: 1e-4)")
+    parser.add_argument("--distributed", action="store_true", help="Data-parallel training with MultiWorkerMirroredStrategy; the cluster comes from TF_CONFIG")
+    parser.add_argument("--steps-per-epoch", type=int, help="Limit steps per epoch (distributed mode, for benchmarks)")
+    parser.add_argument("--throughput-file", type=str, help="Write per-epoch training throughput as JSON")
+    args = parser.parse_args()
+
+    train(args.crop, input_size=args.input_size, alpha=args.alpha, variant=args.variant, epochs=args.epochs,
+          batch_size=args.batch_size, learning_rate=args.learning_rate, distributed=args.distributed,
+          steps_per_epoch=args.steps_per_epoch, throughput_file=args.throughput_file)
+
+
+if __name__ == "__main__":
+    main()
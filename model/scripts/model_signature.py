@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+Model signature files
+=====================
+
+Every trained model is shipped with a small JSON "signature" stored next to
+the .h5 file (``cassava_best_model.h5`` -> ``cassava_best_model.signature.json``).
+It records what the API needs to serve the model without any hard-coded lists:
+
+- ``class_names``: output index -> label, in the order the model was trained on
+- ``input_size``: [height, width] the image must be resized to
+- ``input_dtype``: dtype of the tensor fed to the model (``float32`` or ``uint8``)
+- ``rescale``: multiplier applied to the 0-255 pixel values before inference
+
+The script can also be run directly to write a signature for a model that was
+trained before signatures existed:
+
+    python scripts/model_signature.py --model models/cassava/cassava_best_model.h5 --data data/cassava
+"""
+
+import os
+import json
+import argparse
+from datetime import datetime
+
+SIGNATURE_VERSION = 1
+SIGNATURE_SUFFIX = ".signature.json"
+
+
+def signature_path(model_path):
+    """Return the signature file path for a model file"""
+    return os.path.splitext(model_path)[0] + SIGNATURE_SUFFIX
+
+
+def build_signature(crop, class_names, input_size=(224, 224), input_dtype="float32",
+                    rescale=1.0 / 255, architecture="MobileNetV2", **extra):
+    """Build a signature dictionary for a trained model"""
+    signature = {
+        "format_version": SIGNATURE_VERSION,
+        "crop": crop,
+        "class_names": list(class_names),
+        "input_size": [int(input_size[0]), int(input_size[1])],
+        "input_dtype": input_dtype,
+        "rescale": rescale,
+        "architecture": architecture,
+        "created": datetime.now().isoformat(timespec="seconds"),
+    }
+    signature.update(extra)
+    return signature
+
+
+def class_names_from_indices(class_indices):
+    """Order the labels of a flow_from_directory ``class_indices`` mapping by index"""
+    return [name for name, _ in sorted(class_indices.items(), key=lambda item: item[1])]
+
+
+def class_names_from_directory(data_dir):
+    """List class sub-directories in the order flow_from_directory assigns them"""
+    return sorted(
+        entry for entry in os.listdir(data_dir)
+        if os.path.isdir(os.path.join(data_dir, entry))
+    )
+
+
+def write_signature(model_path, signature):
+    """Write the signature next to the model and return its path"""
+    path = signature_path(model_path)
+    with open(path, "w") as f:
+        json.dump(signature, f, indent=2)
+    return path
+
+
+def read_signature(model_path):
+    """Read the signature stored next to a model, or None if there is none"""
+    path = signature_path(model_path)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write a signature file for an existing model.")
+    parser.add_argument("--model", required=True, help="Path to the .h5 model")
+    parser.add_argument("--data", required=True, help="Training data directory (one sub-directory per class)")
+    parser.add_argument("--crop", help="Crop name (default: taken from the data directory name)")
+    parser.add_argument("--input-size", type=int, default=224, help="Square input resolution (default: 224)")
+    args = parser.parse_args()
+
+    crop = args.crop or os.path.basename(os.path.normpath(args.data))
+    class_names = class_names_from_directory(args.data)
+    signature = build_signature(crop, class_names, input_size=(args.input_size, args.input_size))
+    path = write_signature(args.model, signature)
+    print(f"✅ Signature with {len(class_names)} classes written to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,13 @@ This script provides an interactive interface for the mobilenet_train.py script.
 
 import os
 import sys
-import subprocess
 import argparse
+import importlib.util
 from pathlib import Path
 
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'scripts'))
+from model_signature import class_names_from_directory, read_signature
+
 def print_banner():
     """Print welcome banner"""
     print("🌾" + "="*60 + "🌾")
@@ -30,15 +33,11 @@ def check_prerequisites():
         print("❌ Python 3.8+ is required")
         return False
     
-    # Check if required packages are installed
-    required_packages = ['tensorflow', 'numpy', 'matplotlib', 'sklearn']
-    missing_packages = []
-    
-    for package in required_packages:
-        try:
-            __import__(package)
-        except ImportError:
-            missing_packages.append(package)
+    # Check if required packages are installed; find_spec only looks them up,
+    # importing TensorFlow here would add seconds to startup
+    required_packages = ['tensorflow', 'numpy', 'matplotlib', 'sklearn', 'seaborn']
+    missing_packages = [package for package in required_packages
+                        if importlib.util.find_spec(package) is None]
     
     if missing_packages:
         print(f"❌ Missing packages: {', '.join(missing_packages)}")
@@ -56,31 +55,32 @@ def check_data_structure(crop_type):
         print(f"❌ Data directory not found: {data_dir}")
         return False
     
-    # Expected classes for each crop
-    expected_classes = {
-        'cassava': ['bacterial_blight', 'brown_streak_disease', 'green_mottle', 'healthy', 'mosaic_disease'],
-        'maize': ['blight', 'common_rust', 'gray_leaf_spot', 'healthy'],
-        'tomato': ['bacterial_spot', 'early_blight', 'healthy', 'late_blight', 'leaf_mold', 
-                  'mosaic_virus', 'septoria_spot', 'spider_mites', 'target_spot', 'yellow_leaf_curl_virus']
-    }
-    
-    classes = expected_classes.get(crop_type, [])
-    missing_classes = []
+    # Classes are whatever sub-directories exist; the training script records them
+    # in the model signature, so new classes need no code changes
+    classes = class_names_from_directory(data_dir)
     class_counts = {}
     
+    if not classes:
+        print(f"❌ No class directories found in {data_dir}")
+        return False
+    
     for class_name in classes:
         class_dir = data_dir / class_name
-        if not class_dir.exists():
-            missing_classes.append(class_name)
-        else:
-            # Count images in class directory
-            image_files = [f for f in os.listdir(class_dir) 
-                          if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
-            class_counts[class_name] = len(image_files)
-    
-    if missing_classes:
-        print(f"❌ Missing class directories: {', '.join(missing_classes)}")
-        return False
+        # Count images in class directory
+        image_files = [f for f in os.listdir(class_dir) 
+                      if f.lower().endswith(('.jpg', '.jpeg', '.png', '.bmp'))]
+        class_counts[class_name] = len(image_files)
+    
+    # Compare against the classes of the currently deployed model, if any
+    signature = read_signature(f"models/{crop_type}/{crop_type}_best_model.h5")
+    if signature is not None and signature['class_names'] != classes:
+        added = sorted(set(classes) - set(signature['class_names']))
+        removed = sorted(set(signature['class_names']) - set(classes))
+        print(f"⚠️  Classes differ from the current {crop_type} model signature")
+        if added:
+            print(f"   New classes: {', '.join(added)}")
+        if removed:
+            print(f"   Removed classes: {', '.join(removed)}")
     
     # Check if classes have enough images
     min_images = 50
@@ -102,6 +102,28 @@ def create_output_directories(crop_type):
     model_dir.mkdir(parents=True, exist_ok=True)
     print(f"✅ Output directory ready: {model_dir}")
 
+def run_pipeline(crop_type, epochs=50, batch_size=64, learning_rate=1e-4, evaluate=True):
+    """Train and evaluate one crop in this process
+    
+    The evaluation reuses the trained model (best epoch) and the validation
+    split indexed during training instead of reloading them from disk.
+    """
+    # TensorFlow is only imported once training actually starts
+    from mobilenet_train import train
+    from mobilenet_evaluate import evaluate_model, validation_data_from_index
+    
+    result = train(crop_type, epochs=epochs, batch_size=batch_size, learning_rate=learning_rate)
+    print(f"✅ {crop_type} model training completed successfully!")
+    
+    if evaluate:
+        print(f"\n📊 Evaluating {crop_type} model...")
+        paths, labels = result['validation_index']
+        val_data = validation_data_from_index(paths, labels, result['class_names'], result['input_size'])
+        evaluate_model(result['model'], val_data, crop_type, show_plots=False)
+        print(f"✅ {crop_type} model evaluation completed!")
+    
+    return result
+
 def interactive_training():
     """Interactive training setup"""
     print_banner()
@@ -111,9 +133,9 @@ def interactive_training():
         return
     
     print("\n📋 Available crop types:")
-    print("1. Cassava (5 disease classes)")
-    print("2. Maize (4 disease classes)")  
-    print("3. Tomato (10 disease classes)")
+    print("1. Cassava")
+    print("2. Maize")  
+    print("3. Tomato")
     print("4. All crops (sequential training)")
     
     while True:
@@ -170,34 +192,13 @@ def interactive_training():
         print("="*50)
         
         try:
-            # Run training script
-            result = subprocess.run([
-                sys.executable, 
-                'scripts/mobilenet_train.py', 
-                '--crop', crop
-            ], cwd=Path.cwd(), check=True)
-            
-            print(f"✅ {crop} model training completed successfully!")
-            
-            # Run evaluation
-            print(f"\n📊 Evaluating {crop} model...")
-            eval_result = subprocess.run([
-                sys.executable,
-                'scripts/mobilenet_evaluate.py',
-                '--crop', crop
-            ], cwd=Path.cwd(), check=True)
-            
-            print(f"✅ {crop} model evaluation completed!")
-            
-        except subprocess.CalledProcessError as e:
-            print(f"❌ Training failed for {crop}: {e}")
-            continue
-        except FileNotFoundError:
-            print(f"❌ Training script not found. Please ensure scripts/mobilenet_train.py exists")
-            return
+            run_pipeline(crop)
         except KeyboardInterrupt:
             print(f"\n⏹️  Training interrupted for {crop}")
             break
+        except Exception as e:
+            print(f"❌ Training failed for {crop}: {e}")
+            continue
     
     print(f"\n🎉 Training completed for: {', '.join(crops_to_train)}")
     print("\n📂 Your trained models are saved in:")
@@ -262,31 +263,14 @@ Examples:
         
         create_output_directories(crop)
         
+        print(f"   Epochs: {args.epochs}")
+        print(f"   Batch size: {args.batch_size}")
+        print(f"   Learning rate: {args.learning_rate}")
+        
         try:
-            # Run training with custom parameters
-            cmd = [
-                sys.executable,
-                'scripts/mobilenet_train.py',
-                '--crop', crop
-            ]
-            
-            # Note: The original script doesn't support these parameters
-            # This is a placeholder for enhanced training script
-            print(f"   Epochs: {args.epochs}")
-            print(f"   Batch size: {args.batch_size}")
-            print(f"   Learning rate: {args.learning_rate}")
-            
-            subprocess.run(cmd, check=True)
-            
-            if not args.no_eval:
-                print(f"\n📊 Evaluating {crop} model...")
-                subprocess.run([
-                    sys.executable,
-                    'scripts/mobilenet_evaluate.py', 
-                    '--crop', crop
-                ], check=True)
-            
-        except subprocess.CalledProcessError as e:
+            run_pipeline(crop, epochs=args.epochs, batch_size=args.batch_size,
+                         learning_rate=args.learning_rate, evaluate=not args.no_eval)
+        except Exception as e:
             print(f"❌ Training failed for {crop}: {e}")
             continue
 